@@ -0,0 +1,201 @@
+"""
+Admission control in front of the database pool.
+
+Requests are classified as booking or search. Each class is capped by
+the connections of the pools it uses (size plus overflow): bookings by the
+primary's, searches by the read replicas' (db_routing) or, with none
+configured, by the primary's less BOOKING_RESERVE. At most
+ADMISSION_MAX_CONCURRENCY requests run at once, by default all of those
+connections together. Everything else waits on the event loop, where it holds neither a
+threadpool worker nor a DB connection. When a slot frees, waiting
+bookings go before waiting searches.
+
+A request is rejected up front with 503 + Retry-After when its estimated
+queue wait (queue position x observed service time) exceeds its class
+budget, and it is also rejected if it is still queued when the budget
+runs out. Under overload, latency stays near the budget instead of
+growing with the queue.
+"""
+from collections import deque
+from database import engine
+import asyncio
+import db_routing
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger("train_search")
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") not in ("0", "false", "no")
+
+
+def _pool_capacity(pool, fallback=15):
+    """Connections the pool hands out at once: size plus overflow.
+
+    Pools without a fixed size (NullPool, StaticPool, unlimited overflow)
+    fall back to the SQLAlchemy QueuePool default of 5 + 10.
+    """
+    size = getattr(pool, "size", None)
+    overflow = getattr(pool, "_max_overflow", None)
+    if not callable(size) or not isinstance(overflow, int) or overflow < 0:
+        return fallback
+    return size() + overflow
+
+
+PRIMARY_CAPACITY = _pool_capacity(engine.pool)
+REPLICA_CAPACITY = sum(_pool_capacity(r.engine.pool) for r in db_routing.router.replicas)
+# Primary connections searches leave to bookings when there are no replicas
+BOOKING_RESERVE = int(os.getenv("BOOKING_RESERVE", "3"))
+
+ADMISSION_MAX_CONCURRENCY = int(
+    os.getenv("ADMISSION_MAX_CONCURRENCY") or PRIMARY_CAPACITY + REPLICA_CAPACITY
+)
+
+BOOKING = "booking"
+SEARCH = "search"
+
+# Highest priority first
+PRIORITY = (BOOKING, SEARCH)
+
+CLASS_LIMITS = {
+    BOOKING: int(os.getenv("BOOKING_CONCURRENCY") or PRIMARY_CAPACITY),
+    SEARCH: int(
+        os.getenv("SEARCH_CONCURRENCY")
+        or REPLICA_CAPACITY
+        or max(1, PRIMARY_CAPACITY - BOOKING_RESERVE)
+    ),
+}
+
+# Longest a request may wait for a slot, in seconds
+QUEUE_BUDGETS = {
+    BOOKING: float(os.getenv("BOOKING_QUEUE_BUDGET", "5.0")),
+    SEARCH: float(os.getenv("SEARCH_QUEUE_BUDGET", "1.0")),
+}
+
+# Smoothing for the per-class service time estimate
+EWMA_ALPHA = 0.2
+
+
+def classify(method: str, path: str):
+    """Endpoint class for admission, or None for endpoints that are never queued."""
+    if path.startswith(("/holds", "/waitlist", "/bookings")):
+        return BOOKING
+    if path == "/search_trains":
+        return SEARCH
+    return None
+
+
+class Rejected(Exception):
+    def __init__(self, endpoint_class, retry_after, reason):
+        super().__init__(reason)
+        self.endpoint_class = endpoint_class
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """One per worker process; all methods run on the event loop thread."""
+
+    def __init__(self, max_concurrency, limits, budgets):
+        self.max_concurrency = max_concurrency
+        self.limits = limits
+        self.budgets = budgets
+        self.running = {c: 0 for c in PRIORITY}
+        self.total_running = 0
+        self.waiting = {c: deque() for c in PRIORITY}
+        self.service_time = {c: 0.05 for c in PRIORITY}
+        self.rejected = {c: 0 for c in PRIORITY}
+
+    def _has_slot(self, cls):
+        return self.total_running < self.max_concurrency and self.running[cls] < self.limits[cls]
+
+    def _ahead(self, cls):
+        """Waiters that will be admitted before a new arrival of cls."""
+        ahead = 0
+        for c in PRIORITY:
+            ahead += len(self.waiting[c])
+            if c == cls:
+                break
+        return ahead
+
+    def estimated_wait(self, cls):
+        parallel = max(1, min(self.limits[cls], self.max_concurrency))
+        return math.ceil((self._ahead(cls) + 1) / parallel) * self.service_time[cls]
+
+    def _start(self, cls):
+        self.running[cls] += 1
+        self.total_running += 1
+
+    async def acquire(self, cls):
+        if self._has_slot(cls) and self._ahead(cls) == 0:
+            self._start(cls)
+            return
+
+        budget = self.budgets[cls]
+        estimate = self.estimated_wait(cls)
+        if estimate > budget:
+            self.rejected[cls] += 1
+            raise Rejected(cls, estimate, "estimated queue wait exceeds budget")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting[cls].append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=budget)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Admitted just as the budget ran out: hand the slot back
+                self.release(cls, None)
+            else:
+                self.waiting[cls].remove(waiter)
+                waiter.cancel()
+            self.rejected[cls] += 1
+            raise Rejected(cls, self.estimated_wait(cls), "queue wait budget exhausted")
+        except BaseException:
+            # Client went away while queued
+            if waiter.done() and not waiter.cancelled():
+                self.release(cls, None)
+            elif waiter in self.waiting[cls]:
+                self.waiting[cls].remove(waiter)
+            raise
+
+    def release(self, cls, elapsed):
+        self.running[cls] -= 1
+        self.total_running -= 1
+        if elapsed is not None:
+            self.service_time[cls] += EWMA_ALPHA * (elapsed - self.service_time[cls])
+        self._dispatch()
+
+    def _dispatch(self):
+        for cls in PRIORITY:
+            queue = self.waiting[cls]
+            while queue and self._has_slot(cls):
+                waiter = queue.popleft()
+                if not waiter.done():
+                    self._start(cls)
+                    waiter.set_result(None)
+
+    def status(self):
+        return {
+            "running": dict(self.running),
+            "waiting": {c: len(q) for c, q in self.waiting.items()},
+            "service_time": {c: round(t, 4) for c, t in self.service_time.items()},
+            "rejected": dict(self.rejected),
+        }
+
+
+controller = AdmissionController(ADMISSION_MAX_CONCURRENCY, CLASS_LIMITS, QUEUE_BUDGETS)
+
+
+async def admit(cls, call):
+    """Run await call() inside an admission slot for cls."""
+    await controller.acquire(cls)
+    started = time.perf_counter()
+    try:
+        return await call()
+    finally:
+        controller.release(cls, time.perf_counter() - started)
+
+
+def retry_after_header(rejected: Rejected) -> str:
+    return str(max(1, math.ceil(rejected.retry_after)))
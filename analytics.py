@@ -0,0 +1,222 @@
+"""
+Occupancy analytics served from periodic columnar snapshots.
+
+A background thread copies TrainSeatAvailability x BerthClass (plus the
+train's route) into NumPy column arrays every ANALYTICS_SNAPSHOT_INTERVAL
+seconds, and writes them to ANALYTICS_SNAPSHOT_PATH (.npz). One process per
+node takes a file lock and refreshes the file; the other workers just load
+it when it changes. /analytics/occupancy aggregates the in-memory snapshot
+with vectorized group-bys and never queries the live tables.
+"""
+from datetime import date, datetime, timezone
+from sqlalchemy import select
+from models import Train, BerthClass, TrainSeatAvailability
+import db_routing
+import fcntl
+import logging
+import numpy as np
+import os
+import threading
+import time
+
+logger = logging.getLogger("train_search")
+
+ANALYTICS_SNAPSHOT_INTERVAL = float(os.getenv("ANALYTICS_SNAPSHOT_INTERVAL", "300"))
+ANALYTICS_SNAPSHOT_PATH = os.getenv("ANALYTICS_SNAPSHOT_PATH", "occupancy_snapshot.npz")
+SNAPSHOT_FETCH_SIZE = 10000
+
+GROUP_COLUMNS = ("route_id", "train_id", "class_type", "travel_date")
+
+
+class Snapshot:
+    def __init__(self, columns, class_names, taken_at):
+        self.route_id = columns["route_id"]
+        self.train_id = columns["train_id"]
+        self.class_code = columns["class_code"]        # index into class_names
+        self.travel_date = columns["travel_date"]      # date.toordinal()
+        self.total = columns["total"]
+        self.sold = columns["sold"]
+        self.class_names = class_names
+        self.taken_at = taken_at
+
+    @property
+    def rows(self):
+        return len(self.total)
+
+    # ---------------- Persistence ----------------
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            route_id=self.route_id, train_id=self.train_id, class_code=self.class_code,
+            travel_date=self.travel_date, total=self.total, sold=self.sold,
+            # Fixed-width strings, so loading never needs pickle
+            class_names=np.array(self.class_names, dtype=str),
+            taken_at=np.array(self.taken_at.isoformat()),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            columns = {k: data[k] for k in ("route_id", "train_id", "class_code", "travel_date", "total", "sold")}
+            return cls(columns, [str(n) for n in data["class_names"]], datetime.fromisoformat(str(data["taken_at"])))
+
+    # ---------------- Aggregation ----------------
+    def occupancy(self, group_by, date_from=None, date_to=None, route_id=None, train_id=None, class_type=None):
+        mask = np.ones(self.rows, dtype=bool)
+        if date_from:
+            mask &= self.travel_date >= date_from.toordinal()
+        if date_to:
+            mask &= self.travel_date <= date_to.toordinal()
+        if route_id is not None:
+            mask &= self.route_id == route_id
+        if train_id is not None:
+            mask &= self.train_id == train_id
+        if class_type:
+            wanted = [i for i, name in enumerate(self.class_names) if class_type.lower() in name.lower()]
+            mask &= np.isin(self.class_code, wanted)
+
+        total = self.total[mask]
+        sold = self.sold[mask]
+        if not len(total):
+            return []
+
+        source = {
+            "route_id": self.route_id[mask],
+            "train_id": self.train_id[mask],
+            "class_type": self.class_code[mask],
+            "travel_date": self.travel_date[mask],
+        }
+        if group_by:
+            keys = np.stack([source[c] for c in group_by], axis=1)
+            groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+        else:
+            groups, inverse = np.zeros((1, 0), dtype=np.int64), np.zeros(len(total), dtype=np.int64)
+
+        sold_sum = np.bincount(inverse, weights=sold, minlength=len(groups))
+        total_sum = np.bincount(inverse, weights=total, minlength=len(groups))
+        load = np.divide(sold_sum, total_sum, out=np.zeros_like(sold_sum), where=total_sum > 0)
+
+        result = []
+        for i, key in enumerate(groups.tolist()):
+            row = {}
+            for col, value in zip(group_by, key):
+                if col == "class_type":
+                    value = self.class_names[value]
+                elif col == "travel_date":
+                    value = date.fromordinal(value)
+                row[col] = value
+            row["sold"] = int(sold_sum[i])
+            row["total_berths"] = int(total_sum[i])
+            row["load_factor"] = round(float(load[i]), 4)
+            result.append(row)
+        return result
+
+
+# ---------------- Snapshotting ----------------
+def take_snapshot(db) -> Snapshot:
+    """One streaming pass over availability; runs in the background, never per request."""
+    stmt = (
+        select(
+            Train.route_id,
+            TrainSeatAvailability.train_id,
+            BerthClass.class_type,
+            TrainSeatAvailability.travel_date,
+            BerthClass.total_berths,
+            TrainSeatAvailability.available_seats,
+        )
+        .join(BerthClass, BerthClass.berth_class_id == TrainSeatAvailability.berth_class_id)
+        .join(Train, Train.train_id == TrainSeatAvailability.train_id)
+        .execution_options(yield_per=SNAPSHOT_FETCH_SIZE)
+    )
+    route_ids, train_ids, class_codes, dates, totals, available = [], [], [], [], [], []
+    class_index = {}
+    for route_id, train_id, class_type, travel_date, total, seats in db.execute(stmt):
+        route_ids.append(route_id or 0)
+        train_ids.append(train_id)
+        class_codes.append(class_index.setdefault(class_type, len(class_index)))
+        dates.append(travel_date.toordinal())
+        totals.append(total)
+        available.append(seats)
+
+    total_arr = np.array(totals, dtype=np.int64)
+    columns = {
+        "route_id": np.array(route_ids, dtype=np.int64),
+        "train_id": np.array(train_ids, dtype=np.int64),
+        "class_code": np.array(class_codes, dtype=np.int64),
+        "travel_date": np.array(dates, dtype=np.int64),
+        "total": total_arr,
+        "sold": np.clip(total_arr - np.array(available, dtype=np.int64), 0, None),
+    }
+    return Snapshot(columns, list(class_index), datetime.now(timezone.utc))
+
+
+_snapshot = None
+_loaded_mtime = None
+_stop = threading.Event()
+_thread = None
+
+
+def get_snapshot():
+    return _snapshot
+
+
+def refresh():
+    """Rebuild the file if we hold the lock and it is stale, then load it if it changed."""
+    global _snapshot, _loaded_mtime
+    path = ANALYTICS_SNAPSHOT_PATH
+
+    with open(path + ".lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            owner = True
+        except BlockingIOError:
+            owner = False
+
+        if owner:
+            stale = not os.path.exists(path) or time.time() - os.path.getmtime(path) >= ANALYTICS_SNAPSHOT_INTERVAL
+            if stale:
+                started = time.perf_counter()
+                # Replicas if configured: snapshots are a read-only bulk scan
+                db = db_routing.router.read_session()
+                try:
+                    snapshot = take_snapshot(db)
+                finally:
+                    db.close()
+                snapshot.save(path)
+                logger.info("occupancy snapshot written", extra={"rows": snapshot.rows, "seconds": round(time.perf_counter() - started, 3)})
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    if os.path.exists(path):
+        mtime = os.path.getmtime(path)
+        if mtime != _loaded_mtime:
+            _snapshot = Snapshot.load(path)
+            _loaded_mtime = mtime
+
+
+def _run():
+    while True:
+        try:
+            refresh()
+        except Exception:
+            logger.warning("occupancy snapshot failed", exc_info=True)
+        # Followers poll more often so they pick up a new file quickly
+        if _stop.wait(min(ANALYTICS_SNAPSHOT_INTERVAL, 30)):
+            return
+
+
+def start():
+    global _thread
+    if ANALYTICS_SNAPSHOT_INTERVAL <= 0 or _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="occupancy-snapshot", daemon=True)
+    _thread.start()
+
+
+def stop():
+    global _thread
+    _stop.set()
+    _thread = None
@@ -0,0 +1,265 @@
+"""
+Group-commit writer for seat holds.
+
+At ticket opening, many holds land on the same few TrainSeatAvailability
+rows. If each one runs its own UPDATE and commit, they all queue on the
+same row locks. Instead, place_hold() enqueues the request per
+availability row, i.e. per (train, date, class), and waits on a future.
+One writer thread per process then:
+
+  1. waits at most GROUP_COMMIT_WINDOW after the first queued request, or
+     until GROUP_COMMIT_MAX_BATCH requests are queued
+  2. locks the affected availability rows and reads their seats
+  3. allocates seats in memory, first come first served
+  4. issues one conditional UPDATE per row for the batch total and one
+     bulk INSERT of all hold rows, then commits once. If another process
+     took seats in between, the UPDATE matches nothing; the row is re-read
+     and its group allocated again (GROUP_COMMIT_RETRIES times)
+  5. completes every future with its hold or a HoldError
+
+The extra latency is bounded by the window plus one commit. Correctness
+across processes still comes from the conditional UPDATE
+(available_seats >= batch total), exactly as in seat_holds.place_hold.
+
+A caller that waits longer than GROUP_COMMIT_TIMEOUT gets a 503 HoldError.
+Its request is taken off the queue if it is still there. If its batch
+commits anyway, the writer releases the orphaned hold right away instead
+of leaving the seats taken until the hold expires.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from sqlalchemy import insert, select, update
+from models import SeatHold, TrainSeatAvailability
+from database import SessionLocal
+import logging
+import os
+import seat_holds
+import threading
+import time
+
+logger = logging.getLogger("train_search")
+
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "1") not in ("0", "false", "no")
+GROUP_COMMIT_WINDOW = float(os.getenv("GROUP_COMMIT_WINDOW", "0.005"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "500"))
+GROUP_COMMIT_TIMEOUT = float(os.getenv("GROUP_COMMIT_TIMEOUT", "10"))
+# Re-allocations of a row's group when another process took seats first
+GROUP_COMMIT_RETRIES = int(os.getenv("GROUP_COMMIT_RETRIES", "3"))
+
+
+class _Request:
+    __slots__ = ("availability_id", "train_id", "berth_class_id", "travel_date", "seats", "fare", "future", "abandoned")
+
+    def __init__(self, availability, travel_date, seats, fare):
+        self.availability_id = availability.availability_id
+        self.train_id = availability.train_id
+        self.berth_class_id = availability.berth_class_id
+        self.travel_date = travel_date
+        self.seats = seats
+        self.fare = fare
+        self.future = Future()
+        self.abandoned = False      # caller timed out; changed under the writer's lock
+
+
+def _allocate(requests, left):
+    """First come first served: (granted, [(refused, seats left when refused)])."""
+    granted, refused = [], []
+    for r in requests:
+        if r.seats <= left:
+            left -= r.seats
+            granted.append(r)
+        else:
+            refused.append((r, left))
+    return granted, refused
+
+
+class GroupCommitWriter:
+    def __init__(self, session_factory=SessionLocal, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self._queues = OrderedDict()     # availability_id -> [_Request], arrival order
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.batches = 0
+        self.committed = 0
+
+    # ---------------- Callers ----------------
+    def place_hold(self, availability, travel_date, seats: int, fare=None, timeout=GROUP_COMMIT_TIMEOUT) -> SeatHold:
+        """Same contract as seat_holds.place_hold, batched with concurrent callers."""
+        if seats < 1 or seats > seat_holds.MAX_SEATS_PER_HOLD:
+            raise seat_holds.HoldError(400, f"Seats must be between 1 and {seat_holds.MAX_SEATS_PER_HOLD}")
+        request = _Request(availability, travel_date, seats, fare)
+        with self._cond:
+            if self._stopped:
+                raise seat_holds.HoldError(503, "Booking writer is shutting down")
+            self._queues.setdefault(request.availability_id, []).append(request)
+            self._queued += 1
+            self._ensure_thread()
+            self._cond.notify()
+        try:
+            return request.future.result(timeout=timeout)
+        except FutureTimeout:
+            pass
+
+        with self._cond:
+            if request.future.done():
+                return request.future.result()
+            request.abandoned = True
+            queue = self._queues.get(request.availability_id)
+            if queue and request in queue:
+                queue.remove(request)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[request.availability_id]
+        logger.warning("seat hold timed out in group commit", extra={"availability_id": request.availability_id})
+        raise seat_holds.HoldError(503, "Seat hold timed out, please retry")
+
+    def _ensure_thread(self):
+        # Started lazily so a gunicorn master never owns it
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="booking-writer", daemon=True)
+            self._thread.start()
+
+    # ---------------- Writer thread ----------------
+    def _take_batch(self):
+        """Up to max_batch requests, oldest rows first."""
+        batch, taken = {}, 0
+        for availability_id in list(self._queues):
+            queue = self._queues[availability_id]
+            room = self.max_batch - taken
+            batch[availability_id], rest = queue[:room], queue[room:]
+            taken += len(batch[availability_id])
+            if rest:
+                self._queues[availability_id] = rest
+            else:
+                del self._queues[availability_id]
+            if taken >= self.max_batch:
+                break
+        self._queued -= taken
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queued and not self._stopped:
+                    self._cond.wait()
+                if not self._queued and self._stopped:
+                    return
+                # Let the group fill up, but never past the window
+                deadline = time.monotonic() + self.window
+                while self._queued < self.max_batch and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+            self._commit(batch)
+
+    def _commit(self, batch):
+        with self._cond:
+            batch = {aid: [r for r in reqs if not r.abandoned] for aid, reqs in batch.items()}
+            batch = {aid: reqs for aid, reqs in batch.items() if reqs}
+        if not batch:
+            return
+        requests = [r for reqs in batch.values() for r in reqs]
+        db = self.session_factory()
+        try:
+            inventory = dict(db.execute(
+                select(TrainSeatAvailability.availability_id, TrainSeatAvailability.available_seats)
+                .where(TrainSeatAvailability.availability_id.in_(list(batch)))
+                .with_for_update()
+            ).all())
+
+            accepted, rejected = [], []
+            for availability_id, reqs in batch.items():
+                left = inventory.get(availability_id, 0)
+                for attempt in range(GROUP_COMMIT_RETRIES + 1):
+                    granted, refused = _allocate(reqs, left)
+                    if not granted:
+                        break
+                    total = sum(r.seats for r in granted)
+                    taken = db.execute(
+                        update(TrainSeatAvailability)
+                        .where(
+                            TrainSeatAvailability.availability_id == availability_id,
+                            TrainSeatAvailability.available_seats >= total
+                        )
+                        .values(available_seats=TrainSeatAvailability.available_seats - total)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                    if taken:
+                        accepted.extend(granted)
+                        break
+                    # Another process got there between our read and write:
+                    # allocate the group again from what is left now
+                    left = db.execute(
+                        select(TrainSeatAvailability.available_seats)
+                        .where(TrainSeatAvailability.availability_id == availability_id)
+                    ).scalar() or 0
+                else:
+                    refused = [(r, left) for r in reqs]
+                rejected.extend(refused)
+
+            holds = [seat_holds.new_hold(r.availability_id, r.train_id, r.berth_class_id, r.travel_date, r.seats, r.fare)
+                     for r in accepted]
+            if holds:
+                db.execute(insert(SeatHold), [seat_holds.hold_row(h) for h in holds])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.exception("group commit failed", extra={"requests": len(requests)})
+            for r in requests:
+                r.future.set_exception(e)
+            return
+        finally:
+            db.close()
+
+        self.batches += 1
+        self.committed += len(accepted)
+        orphaned = []
+        with self._cond:
+            # Under the lock: a caller either sees its result or is marked abandoned, never neither
+            for r, hold in zip(accepted, holds):
+                if r.abandoned:
+                    orphaned.append(hold.hold_id)
+                else:
+                    seat_holds.scheduler.schedule(hold.hold_id, hold.expires_at)
+                    r.future.set_result(hold)
+            for r, left in rejected:
+                r.future.set_exception(seat_holds.HoldError(409, f"Only {left} seats are available"))
+        if orphaned:
+            self._release_orphans(orphaned)
+        logger.debug(
+            "group commit",
+            extra={"requests": len(requests), "accepted": len(accepted), "rows": len(batch)}
+        )
+
+    def _release_orphans(self, hold_ids):
+        """Give back holds whose callers timed out; the TTL sweep is the fallback."""
+        db = self.session_factory()
+        try:
+            released = seat_holds.release_holds(db, hold_ids)
+            logger.warning("released holds of timed-out callers", extra={"released": released})
+        except Exception:
+            db.rollback()
+            logger.exception("releasing timed-out holds failed, they expire with their TTL")
+        finally:
+            db.close()
+
+    def stop(self):
+        """Finish what is queued, then let the thread exit."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=GROUP_COMMIT_TIMEOUT)
+
+    def status(self):
+        with self._cond:
+            return {"queued": self._queued, "batches": self.batches, "committed": self.committed}
+
+
+writer = GroupCommitWriter()
@@ -0,0 +1,451 @@
+"""
+Pluggable result cache shared by search and lookup callers.
+
+CACHE_BACKEND picks where entries live:
+
+    none    nothing is cached (default)
+    memory  per-process LRU dict
+    sqlite  one SQLite file (CACHE_PATH, /dev/shm when available) shared by
+            every worker on the node
+    redis   any server speaking the Redis protocol at CACHE_URL
+            (redis://host:port/db); `python cache.py serve` runs a small
+            local stand-in for development and tests
+
+Every backend stores the same bytes, produced by dumps(). Each entry has
+its own TTL, so a process can switch backends without changing callers. A
+failing backend is logged and treated as a miss, so it never fails a
+request.
+"""
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger("train_search")
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "none").lower()
+CACHE_URL = os.getenv("CACHE_URL", "redis://127.0.0.1:6379/0")
+CACHE_PATH = os.getenv("CACHE_PATH") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "polrail_cache.sqlite"
+)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "15"))
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "300"))
+
+# Bump when the cached shapes change so old entries are ignored
+KEY_PREFIX = "polrail:v1"
+
+
+# ---------------- Serialization ----------------
+def dumps(value) -> bytes:
+    return json.dumps(jsonable_encoder(value), separators=(",", ":")).encode()
+
+
+def loads(data: bytes):
+    return json.loads(data)
+
+
+# ---------------- Backends ----------------
+class CacheBackend:
+    """Bytes in, bytes out. ttl is in seconds."""
+
+    name = "base"
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class NullBackend(CacheBackend):
+    name = "none"
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    name = "memory"
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()      # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    One WAL-mode SQLite file, so concurrent readers never block each other.
+    Each thread (and each forked process) opens its own connection.
+    """
+
+    name = "sqlite"
+    PURGE_EVERY = 1000
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl)
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+
+
+# ---------------- Redis protocol ----------------
+class RespError(Exception):
+    pass
+
+
+def _encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(f):
+    line = f.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        raise RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        if n < 0:
+            return None
+        data = f.read(n + 2)
+        return data[:-2]
+    if kind == b"*":
+        n = int(rest)
+        return None if n < 0 else [_read_reply(f) for _ in range(n)]
+    raise RespError(f"unexpected reply {line!r}")
+
+
+class RedisBackend(CacheBackend):
+    """Minimal RESP2 client: one connection per thread, reconnect on failure."""
+
+    name = "redis"
+
+    def __init__(self, url=CACHE_URL, timeout=0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn, self._local.pid = conn, os.getpid()
+            if self.password:
+                self._call(b"AUTH", self.password)
+            if self.db:
+                self._call(b"SELECT", self.db)
+        return conn
+
+    def _call(self, *args):
+        sock, f = self._connection()
+        try:
+            sock.sendall(_encode_command(*args))
+            return _read_reply(f)
+        except (OSError, ConnectionError):
+            self._local.conn = None
+            sock.close()
+            raise
+
+    def get(self, key):
+        return self._call(b"GET", key)
+
+    def set(self, key, value, ttl):
+        self._call(b"SET", key, value, b"PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._call(b"DEL", key)
+
+    def clear(self):
+        cursor = b"0"
+        while True:
+            cursor, keys = self._call(b"SCAN", cursor, b"MATCH", KEY_PREFIX + ":*", b"COUNT", 500)
+            if keys:
+                self._call(b"DEL", *keys)
+            if cursor in (b"0", "0", 0):
+                return
+
+
+BACKENDS = {
+    "none": NullBackend,
+    "memory": MemoryBackend,
+    "sqlite": SQLiteBackend,
+    "redis": RedisBackend,
+}
+
+
+def make_backend(name=CACHE_BACKEND) -> CacheBackend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"CACHE_BACKEND must be one of {', '.join(BACKENDS)}, got {name!r}")
+
+
+# ---------------- Namespaced cache ----------------
+class Cache:
+    def __init__(self, namespace, ttl, backend=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._backend = backend
+
+    @property
+    def backend(self) -> CacheBackend:
+        if self._backend is None:
+            self._backend = _default_backend()
+        return self._backend
+
+    @property
+    def enabled(self):
+        return not isinstance(self.backend, NullBackend)
+
+    def key(self, key) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return f"{KEY_PREFIX}:{self.namespace}:{digest}"
+
+    def get_bytes(self, key):
+        try:
+            return self.backend.get(self.key(key))
+        except (OSError, ConnectionError, RespError, sqlite3.Error):
+            logger.warning("cache get failed", extra={"cache": self.backend.name}, exc_info=True)
+            return None
+
+    def set_bytes(self, key, data: bytes, ttl=None):
+        try:
+            self.backend.set(self.key(key), data, self.ttl if ttl is None else ttl)
+        except (OSError, ConnectionError, RespError, sqlite3.Error):
+            logger.warning("cache set failed", extra={"cache": self.backend.name}, exc_info=True)
+
+    def get(self, key):
+        data = self.get_bytes(key)
+        return None if data is None else loads(data)
+
+    def set(self, key, value, ttl=None):
+        self.set_bytes(key, dumps(value), ttl)
+
+    def get_or_compute(self, key, compute, ttl=None):
+        """Cached value for key, or compute() stored under it. Exceptions are not cached."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _default_backend() -> CacheBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = make_backend()
+    return _backend
+
+
+search_cache = Cache("search", SEARCH_CACHE_TTL)
+lookup_cache = Cache("lookup", LOOKUP_CACHE_TTL)
+
+
+# ---------------- Local Redis stand-in ----------------
+def serve(host="127.0.0.1", port=6379):
+    """
+    In-memory server for GET/SET (EX/PX)/DEL/EXISTS/SCAN/FLUSHDB/PING/SELECT/AUTH,
+    enough for RedisBackend. Development and tests only.
+    """
+    import asyncio
+    import fnmatch
+
+    store = {}   # key -> (value, expires_at or None)
+
+    def alive(key):
+        entry = store.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del store[key]
+            return None
+        return entry[0]
+
+    def reply(value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(reply(v) for v in value)
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def execute(args):
+        cmd = args[0].upper()
+        if cmd == b"PING":
+            return b"+PONG\r\n"
+        if cmd in (b"SELECT", b"AUTH"):
+            return b"+OK\r\n"
+        if cmd == b"GET":
+            return reply(alive(args[1]))
+        if cmd == b"SET":
+            expires = None
+            opts = [a.upper() for a in args[3:]]
+            if b"PX" in opts:
+                expires = time.monotonic() + int(args[3 + opts.index(b"PX") + 1]) / 1000
+            elif b"EX" in opts:
+                expires = time.monotonic() + int(args[3 + opts.index(b"EX") + 1])
+            store[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if cmd == b"DEL":
+            return reply(sum(1 for k in args[1:] if store.pop(k, None) is not None))
+        if cmd == b"EXISTS":
+            return reply(sum(1 for k in args[1:] if alive(k) is not None))
+        if cmd == b"SCAN":
+            pattern = b"*"
+            if b"MATCH" in [a.upper() for a in args]:
+                pattern = args[[a.upper() for a in args].index(b"MATCH") + 1]
+            keys = [k for k in list(store) if alive(k) is not None and fnmatch.fnmatchcase(k, pattern)]
+            return reply([b"0", keys])
+        if cmd == b"FLUSHDB":
+            store.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % cmd
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    size = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(execute(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, host, port)
+        print(f"cache stand-in listening on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Result cache tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("serve", help="Run the local Redis-protocol stand-in")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=6379)
+    sub.add_parser("clear", help="Drop every entry in the configured backend")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port)
+    else:
+        make_backend().clear()
@@ -0,0 +1,346 @@
+"""
+Change versioning for the timetable tables.
+
+install_triggers() adds triggers (row-level on SQLite and PostgreSQL,
+statement-level on SQL Server) that append every insert, update and delete
+on the tracked tables to polRail_change_log_2, so edits made by the
+importer, by other services or by hand are all captured. The change_id of
+the newest log row is the timetable "version". migrate.py installs them on
+every deploy.
+
+Each worker runs a CacheRefresher thread that polls the log, groups new
+entries by table, and hands them to the registered caches. The same thread
+prunes entries older than CHANGE_LOG_RETENTION_DAYS every
+CHANGE_LOG_PRUNE_INTERVAL seconds. Caches build
+their next state off to the side and swap it in with a single assignment,
+so readers see either the old or the new state and are never blocked.
+"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal, engine
+from models import (
+    ChangeLog, Station, Route, Train, RouteStation, BerthClass, TrainSeatAvailability,
+    TrainServiceCalendar, TrainServiceException
+)
+import argparse
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("train_search")
+
+# ---------------- Settings ----------------
+CACHE_REFRESH_INTERVAL = float(os.getenv("CACHE_REFRESH_INTERVAL", "2"))
+# Ids are handed out before commit, so a slow transaction can commit an id
+# lower than one already seen. Re-scanning this many ids back catches it.
+CHANGE_ID_OVERLAP = int(os.getenv("CHANGE_ID_OVERLAP", "100"))
+# Every seat hold, release and booking writes a row (live availability
+# follows them), so the log is pruned by the refresher, in short batches
+CHANGE_LOG_RETENTION_DAYS = float(os.getenv("CHANGE_LOG_RETENTION_DAYS", "1"))
+CHANGE_LOG_PRUNE_INTERVAL = float(os.getenv("CHANGE_LOG_PRUNE_INTERVAL", "600"))
+CHANGE_LOG_PRUNE_BATCH = int(os.getenv("CHANGE_LOG_PRUNE_BATCH", "5000"))
+
+# table name -> primary key column
+TRACKED_TABLES = {
+    m.__tablename__: m.__table__.primary_key.columns.keys()[0]
+    for m in (Station, Route, Train, RouteStation, BerthClass, TrainSeatAvailability,
+              TrainServiceCalendar, TrainServiceException)
+}
+
+
+# ---------------- Triggers ----------------
+def _sqlite_triggers(table, pk):
+    log = ChangeLog.__tablename__
+    for op, event, ref in (("I", "INSERT", "NEW"), ("U", "UPDATE", "NEW"), ("D", "DELETE", "OLD")):
+        yield f'''
+            CREATE TRIGGER IF NOT EXISTS "trg_{table}_{op}" AFTER {event} ON "{table}"
+            BEGIN
+                INSERT INTO "{log}" (table_name, row_id, op, changed_at)
+                VALUES ('{table}', {ref}."{pk}", '{op}', CURRENT_TIMESTAMP);
+            END
+        '''
+
+
+def _postgres_triggers(table, pk):
+    yield f'DROP TRIGGER IF EXISTS "trg_{table}_changes" ON "{table}"'
+    yield f'''
+        CREATE TRIGGER "trg_{table}_changes"
+        AFTER INSERT OR UPDATE OR DELETE ON "{table}"
+        FOR EACH ROW EXECUTE FUNCTION polrail_log_change('{pk}')
+    '''
+
+
+_POSTGRES_FUNCTION = f'''
+    CREATE OR REPLACE FUNCTION polrail_log_change() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO "{ChangeLog.__tablename__}" (table_name, row_id, op, changed_at)
+        VALUES (
+            TG_TABLE_NAME,
+            (to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END) ->> TG_ARGV[0])::int,
+            left(TG_OP, 1),
+            now()
+        );
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+'''
+
+
+def _mssql_triggers(table, pk):
+    # Statement-level: inserted/deleted hold every row the statement touched.
+    # NOCOUNT keeps the trigger's INSERTs out of the caller's rowcount, which
+    # the seat-hold UPDATEs rely on.
+    log = ChangeLog.__tablename__
+    yield f'''
+        CREATE OR ALTER TRIGGER [trg_{table}_changes] ON [{table}]
+        AFTER INSERT, UPDATE, DELETE AS
+        BEGIN
+            SET NOCOUNT ON;
+            INSERT INTO [{log}] (table_name, row_id, op, changed_at)
+            SELECT '{table}', i.[{pk}],
+                   CASE WHEN EXISTS (SELECT 1 FROM deleted) THEN 'U' ELSE 'I' END,
+                   SYSUTCDATETIME()
+            FROM inserted i;
+            INSERT INTO [{log}] (table_name, row_id, op, changed_at)
+            SELECT '{table}', d.[{pk}], 'D', SYSUTCDATETIME()
+            FROM deleted d
+            WHERE NOT EXISTS (SELECT 1 FROM inserted);
+        END
+    '''
+
+
+_TRIGGERS = {"sqlite": _sqlite_triggers, "postgresql": _postgres_triggers, "mssql": _mssql_triggers}
+
+
+def install_triggers(bind):
+    """Create the change log table and its triggers. Safe to run repeatedly."""
+    ChangeLog.__table__.create(bind, checkfirst=True)
+    dialect = bind.dialect.name
+
+    if dialect not in _TRIGGERS:
+        raise NotImplementedError(f"change triggers are not available for {dialect}")
+    with bind.begin() as conn:
+        if dialect == "postgresql":
+            conn.execute(text(_POSTGRES_FUNCTION))
+        for table, pk in TRACKED_TABLES.items():
+            for ddl in _TRIGGERS[dialect](table, pk):
+                conn.execute(text(ddl))
+
+
+def prune_change_log(bind, retention_days=CHANGE_LOG_RETENTION_DAYS, batch=CHANGE_LOG_PRUNE_BATCH):
+    """
+    Delete entries older than the retention, oldest ids first, one short
+    transaction per batch of ids so the triggers appending to the log are
+    never blocked for long. Returns the number deleted.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    pruned = 0
+    while True:
+        with bind.begin() as conn:
+            oldest = conn.execute(select(func.min(ChangeLog.change_id))).scalar()
+            if oldest is None:
+                return pruned
+            deleted = conn.execute(
+                delete(ChangeLog).where(ChangeLog.change_id < oldest + batch, ChangeLog.changed_at < cutoff)
+            ).rowcount
+        if not deleted:
+            return pruned
+        pruned += deleted
+
+
+# ---------------- Reading the log ----------------
+def current_version(db) -> int:
+    """Newest change id, 0 for an empty (or missing) log."""
+    try:
+        return db.execute(select(func.max(ChangeLog.change_id))).scalar() or 0
+    except SQLAlchemyError:
+        db.rollback()
+        return 0
+
+
+class ChangeFeed:
+    def __init__(self, version: int = 0):
+        self.version = version
+        self._seen = None
+
+    def poll(self, db):
+        """
+        Return {table_name: {row_id, ...}} for entries not seen yet, or None
+        when the log was pruned past our version and a full reload is needed.
+        """
+        rows = db.execute(
+            select(ChangeLog.change_id, ChangeLog.table_name, ChangeLog.row_id)
+            .where(ChangeLog.change_id > self.version - CHANGE_ID_OVERLAP)
+            .order_by(ChangeLog.change_id)
+        ).all()
+
+        # A gap right after our version is either rolled-back ids or pruning
+        if rows and rows[0].change_id > self.version + 1:
+            oldest = db.execute(select(func.min(ChangeLog.change_id))).scalar()
+            if oldest > self.version + 1:
+                return None
+
+        if self._seen is None:
+            # Whatever is at or below the starting version is already applied
+            self._seen = {r.change_id for r in rows if r.change_id <= self.version}
+
+        changes = {}
+        for change_id, table_name, row_id in rows:
+            if change_id in self._seen:
+                continue
+            self._seen.add(change_id)
+            changes.setdefault(table_name, set()).add(row_id)
+
+        if rows:
+            self.version = max(self.version, rows[-1].change_id)
+            floor = self.version - CHANGE_ID_OVERLAP
+            self._seen = {c for c in self._seen if c > floor}
+        return changes
+
+
+# ---------------- Refresher ----------------
+class CacheRefresher:
+    """
+    Caches register an object with:
+      tables                       -- set of table names it depends on
+      version                      -- change id the cache was built at, None if not built
+      apply_changes(db, changes, version)
+                                   -- changes: {table_name: {row_id, ...}}
+      reload(db)                   -- full rebuild
+    Both methods must swap in their new state atomically. A cache whose
+    apply_changes fails is reloaded instead, and one whose reload fails is
+    retried every interval until it succeeds, so no error stops the thread.
+    """
+
+    def __init__(self, interval=CACHE_REFRESH_INTERVAL, prune_interval=CHANGE_LOG_PRUNE_INTERVAL):
+        self.interval = interval
+        self.prune_interval = prune_interval
+        self.caches = []
+        self.feed = None
+        self._stale = []       # caches whose last update failed; reloaded next time
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, cache):
+        self.caches.append(cache)
+
+    def refresh_once(self):
+        db = SessionLocal()
+        try:
+            if self.feed is None:
+                # Start from the oldest cache so nothing since its build is missed
+                built = [c.version for c in self.caches if c.version is not None]
+                self.feed = ChangeFeed(min(built) if built else current_version(db))
+
+            changes = self.feed.poll(db)
+            if changes is None:
+                logger.warning("change log pruned past cache version, reloading caches")
+                self._stale = list(self.caches)
+                changes = {}
+
+            for cache in self.caches:
+                if cache in self._stale:
+                    self._reload(db, cache)
+                    continue
+                relevant = {t: ids for t, ids in changes.items() if t in cache.tables}
+                if not relevant:
+                    continue
+                try:
+                    cache.apply_changes(db, relevant, self.feed.version)
+                except Exception:
+                    # The feed has moved past these changes: only a reload catches up
+                    db.rollback()
+                    logger.exception("cache update failed, reloading", extra={"cache": type(cache).__name__})
+                    self._reload(db, cache)
+                    continue
+                logger.info(
+                    "cache refreshed",
+                    extra={"cache": type(cache).__name__, "version": self.feed.version,
+                           "rows": sum(len(ids) for ids in relevant.values())}
+                )
+        finally:
+            db.close()
+
+    def _reload(self, db, cache):
+        try:
+            cache.reload(db)
+        except Exception:
+            db.rollback()
+            logger.exception("cache reload failed, retrying", extra={"cache": type(cache).__name__})
+            if cache not in self._stale:
+                self._stale.append(cache)
+            return
+        if cache in self._stale:
+            self._stale.remove(cache)
+
+    def prune(self):
+        try:
+            pruned = prune_change_log(engine)
+        except SQLAlchemyError:
+            logger.warning("change log pruning failed, retrying later", exc_info=True)
+            return
+        if pruned:
+            logger.info("change log pruned", extra={"rows": pruned})
+
+    def _log_exists(self):
+        """Whether the change log table exists; retries while the database is unreachable."""
+        while True:
+            try:
+                return inspect(engine).has_table(ChangeLog.__tablename__)
+            except SQLAlchemyError:
+                logger.warning("change log check failed, retrying", exc_info=True)
+                if self._stop.wait(self.interval):
+                    return False
+
+    def _run(self):
+        # Checked here, not in start(): the app must start while the database is down
+        if not self._log_exists():
+            if not self._stop.is_set():
+                logger.warning("change log table missing, caches will not refresh (run: python change_tracking.py install)")
+            return
+        next_prune = time.monotonic() + self.prune_interval
+        while True:
+            try:
+                self.refresh_once()
+            except SQLAlchemyError:
+                logger.warning("cache refresh failed", exc_info=True)
+            except Exception:
+                # Anything else must not end the thread and leave every cache stale
+                logger.exception("cache refresh failed")
+            if time.monotonic() >= next_prune:
+                self.prune()
+                next_prune = time.monotonic() + self.prune_interval
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+refresher = CacheRefresher()
+
+
+# ---------------- CLI ----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Timetable change tracking")
+    parser.add_argument("command", choices=["install", "prune", "version"])
+    args = parser.parse_args()
+
+    if args.command == "install":
+        install_triggers(engine)
+        print(f"triggers installed on {', '.join(TRACKED_TABLES)}")
+    elif args.command == "prune":
+        print(f"pruned {prune_change_log(engine)} change log rows")
+    else:
+        with SessionLocal() as db:
+            print(current_version(db))
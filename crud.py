@@ -1,23 +1,25 @@
 from sqlalchemy.orm import Session, aliased
-from sqlalchemy import and_
-from sqlalchemy import func
+from sqlalchemy import and_, or_
+from sqlalchemy import func, case, select
 from datetime import date, datetime, timedelta
 from fastapi import HTTPException
 from models import Train, RouteStation, Station, BerthClass, TrainSeatAvailability
 from schemas import TrainAvailability, ClassAvailability
+import service_calendar
+import fares
+import folding
+import station_groups
+import search_core
+import cache
+from folding import fold
+import search_cursor
 import unicodedata
 import logging
 import re
 
-# ---------------- Logger Setup ----------------
+# ---------------- Logger ----------------
+# Handlers are attached by search_logging.setup_logging() at app startup
 logger = logging.getLogger("train_search")
-logger.setLevel(logging.INFO)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
-console_handler.setFormatter(formatter)
-logger.handlers.clear()
-logger.addHandler(console_handler)
 
 # ---------------- Normalize station names ----------------
 def normalize(s: str):
@@ -47,16 +49,16 @@ def wildcard_match(text: str, pattern: str) -> bool:
 
 # ---------------- Match station using name variants ----------------
 def match_station(user_input: str, station: Station):
-    norm_input = normalize(user_input)
+    norm_input = fold(user_input)
 
     # 1. Exact match on primary fields
-    if normalize(station.station_name) == norm_input:
+    if fold(station.station_name) == norm_input:
         return True
 
-    if normalize(station.station_name_PL) == norm_input:
+    if fold(station.station_name_PL) == norm_input:
         return True
 
-    if normalize(station.station_id_code) == norm_input:
+    if fold(station.station_id_code) == norm_input:
         return True
 
     # 2. Alias-based matching (controlled)
@@ -64,7 +66,7 @@ def match_station(user_input: str, station: Station):
         aliases = station.station_name_comb_PL.split("|")
 
         for alias in aliases:
-            norm_alias = normalize(alias)
+            norm_alias = fold(alias)
 
             # a) Exact alias match (preferred)
             if norm_alias == norm_input:
@@ -78,6 +80,443 @@ def match_station(user_input: str, station: Station):
     return False
 
 
+# ---------------- Coalescing key for identical searches ----------------
+# Parameters search_trains itself folds before using them, with the same
+# function. Everything else (times, train numbers and types, the cursor) is
+# keyed as given: " 06:00" is a 400, so it must not share a key with "06:00".
+_FOLDED_PARAMS = {
+    "from_station_name": fold,
+    "to_station_name": fold,
+    "train_class": normalize,
+    "return_train_class": normalize,
+    "train_name": normalize,
+    "return_train_name": normalize,
+}
+
+
+def search_key(params: dict) -> tuple:
+    """Searches that search_trains cannot tell apart (case, accents, spaces in names) share a key."""
+    return tuple(
+        (k, _FOLDED_PARAMS[k](v) if k in _FOLDED_PARAMS and isinstance(v, str) else v)
+        for k, v in sorted(params.items())
+    )
+
+
+# ---------------- Seat availability for a class ----------------
+def find_availability(db: Session, berth_class_id: int, travel_date: date):
+    """
+    The row for travel_date when one exists (so holds taken for that date
+    show up in search), else any row for the class as before. Search
+    display only: anything that takes or watches seats must use
+    find_exact_availability().
+    """
+    return (
+        db.query(TrainSeatAvailability)
+        .filter(TrainSeatAvailability.berth_class_id == berth_class_id)
+        .order_by(case((TrainSeatAvailability.travel_date == travel_date, 0), else_=1))
+        .first()
+    )
+
+
+def find_exact_availability(db: Session, berth_class_id: int, travel_date: date):
+    """The row for exactly travel_date, or None: for holds, the waitlist and live watches."""
+    return (
+        db.query(TrainSeatAvailability)
+        .filter(
+            TrainSeatAvailability.berth_class_id == berth_class_id,
+            TrainSeatAvailability.travel_date == travel_date
+        )
+        .first()
+    )
+
+
+# ---------------- Boarding and alighting stops ----------------
+def _boarding_stop(from_ids):
+    """
+    RouteStation filter for where a train is boarded: the station itself,
+    or for a station group the train's first stop in the group.
+    """
+    if len(from_ids) == 1:
+        return RouteStation.station_id == from_ids[0]
+    rs = aliased(RouteStation)
+    first_stop = (
+        select(func.min(rs.stop_number))
+        .where(rs.train_id == RouteStation.train_id, rs.station_id.in_(from_ids))
+        .scalar_subquery()
+    )
+    return and_(RouteStation.station_id.in_(from_ids), RouteStation.stop_number == first_stop)
+
+
+def _trip_stops(db, train_id, from_ids, to_ids):
+    """(boarding, alighting) RouteStation of a train, or (None, None) if it does not run from -> to."""
+    rs_from = (
+        db.query(RouteStation)
+        .filter(RouteStation.train_id == train_id, RouteStation.station_id.in_(from_ids))
+        .order_by(RouteStation.stop_number)
+        .first()
+    )
+    if not rs_from:
+        return None, None
+    rs_to = (
+        db.query(RouteStation)
+        .filter(
+            RouteStation.train_id == train_id,
+            RouteStation.station_id.in_(to_ids),
+            RouteStation.stop_number > rs_from.stop_number
+        )
+        .order_by(RouteStation.stop_number)
+        .first()
+    )
+    return (rs_from, rs_to) if rs_to else (None, None)
+
+
+# ---------------- Requested class -> stored class name ----------------
+# Map possible inputs to actual stored class names
+_CLASS_MAP = {
+    "1st": "1st Class",
+    "first": "1st Class",
+    "first class": "1st class",
+    "2nd": "2nd Class",
+    "second": "2nd Class",
+    "second class": "2nd class",
+    "chair": "Chair Car",
+    "executive": "Executive Chair Car",
+    "exec": "Executive Chair Car"
+}
+
+
+def _class_name(requested: str, invalid_detail: str) -> str:
+    # Normalize user input class type, then find the correct DB class value
+    requested = normalize(requested)
+    matched = next((v for k, v in _CLASS_MAP.items() if k in requested), None)
+    if not matched:
+        raise HTTPException(400, invalid_detail)
+    return matched
+
+
+# ---------------- Requested stations -> station ids ----------------
+def resolve_stations(db: Session, from_station_name: str, to_station_name: str):
+    """
+    (polish_from, polish_to, names, from_ids, to_ids) for a trip, or 404.
+    Shared by search and by holds, so a booking prices the stops search quoted.
+    """
+    # A city ("Warszawa") stands for all of its stations
+    groups = station_groups.get_station_groups(db)
+    from_group = groups.lookup(from_station_name)
+    to_group = groups.lookup(to_station_name)
+
+    # Exact names, codes and aliases: indexed lookup on the folded keys
+    from_station = None if from_group else folding.lookup_station_ref(db, from_station_name)
+    to_station = None if to_group else folding.lookup_station_ref(db, to_station_name)
+
+    # Wildcards (or keys not built yet): match by English OR Polish OR station code
+    if not (from_group or from_station) or not (to_group or to_station):
+        stations = search_core.stations(db) if search_core.SEARCH_CORE else db.query(Station).all()
+        if not from_group:
+            from_station = from_station or next(
+                (s for s in stations if match_station(from_station_name, s)),
+                None
+            )
+        if not to_group:
+            to_station = to_station or next(
+                (s for s in stations if match_station(to_station_name, s)),
+                None
+            )
+
+    if not (from_group or from_station):
+        raise HTTPException(
+            status_code=404,
+            detail=f"From station '{from_station_name}' not found"
+        )
+
+    if not (to_group or to_station):
+        raise HTTPException(
+            status_code=404,
+            detail=f"To station '{to_station_name}' not found"
+        )
+
+    # ✅ Force Polish names for API output
+    polish_from, from_stations = from_group or (from_station.station_name_PL, [from_station])
+    polish_to, to_stations = to_group or (to_station.station_name_PL, [to_station])
+    names = {s.station_id: s.station_name_PL for s in from_stations + to_stations}
+
+    # "Warszawa" -> "Warszawa Wschodnia" means the other Warsaw stations
+    from_ids = [s.station_id for s in from_stations]
+    to_ids = [s.station_id for s in to_stations]
+    if from_group:
+        from_ids = [sid for sid in from_ids if sid not in to_ids]
+    elif to_group:
+        to_ids = [sid for sid in to_ids if sid not in from_ids]
+
+    return polish_from, polish_to, names, from_ids, to_ids
+
+
+# ---------------- Fare of a hold or waitlist entry ----------------
+def quote_fare(db: Session, bc: BerthClass, from_station_name=None, to_station_name=None) -> float:
+    """
+    Per-seat fare of class bc for from -> to, priced exactly as search
+    prices the same trip. Without stations the train's whole run is priced.
+    """
+    if from_station_name or to_station_name:
+        if not (from_station_name and to_station_name):
+            raise HTTPException(400, "Give both from_station and to_station, or neither")
+        polish_from, polish_to, _, from_ids, to_ids = resolve_stations(db, from_station_name, to_station_name)
+        rs_from, rs_to = _trip_stops(db, bc.train_id, from_ids, to_ids)
+        if not rs_from:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Train {bc.train.train_no} does not run from {polish_from} to {polish_to}"
+            )
+    else:
+        stops = (
+            db.query(RouteStation)
+            .filter(RouteStation.train_id == bc.train_id)
+            .order_by(RouteStation.stop_number)
+            .all()
+        )
+        rs_from, rs_to = (stops[0], stops[-1]) if len(stops) > 1 else (None, None)
+
+    km = fares.trip_km(rs_from, rs_to) if rs_from else -1
+    return fares.fare(km, bc.class_type, bc.price)
+
+
+# ---------------- Onward results for a list of trains ----------------
+def _onward_results(db, trains, from_ids, to_ids, names, travel_date, train_class, pending_fares):
+    """names: station_id -> Polish name, for every station in from_ids and to_ids."""
+    if search_core.SEARCH_CORE:
+        class_name = _class_name(train_class, "Invalid class type requested") if train_class and trains else None
+        return search_core.results(db, trains, from_ids, to_ids, names, travel_date, class_name, pending_fares)
+
+    result = []
+    for train in trains:
+        # ---------------- Get from/to RouteStation ----------------
+        rs_from, rs_to = _trip_stops(db, train.train_id, from_ids, to_ids)
+        if not rs_from:
+            continue
+
+        # ---------------- Time filter ----------------
+        #if time:
+        #input_t = datetime.strptime(time, "%H:%M").time()
+        #start_t = (datetime.combine(date.today(), input_t) - timedelta(hours=23)).time()
+        #end_t = (datetime.combine(date.today(), input_t) + timedelta(hours=23)).time()
+        #if not (start_t <= rs_from.departure_time <= end_t):
+        #    continue
+
+        # ---------------- Classes & Availability ----------------
+        berth_query = db.query(BerthClass).filter(BerthClass.train_id == train.train_id)
+        #if train_class:
+        berth_query = berth_query.filter(BerthClass.class_type.ilike(f"%{train_class}%"))
+
+        # ---------------- Classes & Availability (Show only requested class if provided) ----------------
+        classes = []
+        if train_class:
+            matched_class_name = _class_name(train_class, "Invalid class type requested")
+
+            # Query only that class
+            bc = (
+                db.query(BerthClass)
+                .filter(
+                    BerthClass.train_id == train.train_id,
+                    func.lower(BerthClass.class_type).like(func.lower(f"%{matched_class_name}%"))
+                )
+                .first()
+            )
+
+            if bc:
+                avail = find_availability(db, bc.berth_class_id, travel_date)
+
+                available = avail.available_seats if avail else 0
+                booked = bc.total_berths - available
+
+                classes.append(
+                    ClassAvailability(
+                        class_type=bc.class_type,
+                        total_berths=bc.total_berths,
+                        booked=booked,
+                        available=available,
+                        price=bc.price,
+                        waitlist=avail.waitlist_count if avail else 0
+                    )
+                )
+
+        else:
+            # No class filter → fetch all classes (existing behavior)
+            for bc in db.query(BerthClass).filter(BerthClass.train_id == train.train_id).all():
+                avail = find_availability(db, bc.berth_class_id, travel_date)
+
+                available = avail.available_seats if avail else 0
+                booked = bc.total_berths - available
+
+                classes.append(
+                    ClassAvailability(
+                        class_type=bc.class_type,
+                        total_berths=bc.total_berths,
+                        booked=booked,
+                        available=available,
+                        price=bc.price,
+                        waitlist=avail.waitlist_count if avail else 0
+                    )
+                )
+
+
+        km = fares.trip_km(rs_from, rs_to)
+        pending_fares.extend((c, km) for c in classes)
+
+        result.append(
+            TrainAvailability(
+                train_id=train.train_id,
+                train_name=train.train_name,
+                train_number= str(train.train_no),
+                train_type=train.train_type,
+                from_station=names[rs_from.station_id],
+                to_station=names[rs_to.station_id],
+                travel_date=travel_date,
+                departure_time=rs_from.departure_time,
+                arrival_time=rs_to.arrival_time,
+                departure_date= travel_date,
+                classes=classes
+            )
+        )
+
+    return result
+
+
+# ---------------- Return results for a list of trains ----------------
+def _return_results(db, trains, from_ids, to_ids, names, return_date, return_train_class, pending_fares):
+    """Like _onward_results, for the return leg: from_ids are the onward destination's stations."""
+    if search_core.SEARCH_CORE:
+        class_name = None
+        if return_train_class and trains:
+            class_name = _class_name(return_train_class, "Invalid return train class type requested")
+        return search_core.results(
+            db, trains, from_ids, to_ids, names, return_date, class_name, pending_fares,
+            first_only=False, require_class=bool(return_train_class)
+        )
+
+    result = []
+    for train in trains:
+        rs_from, rs_to = _trip_stops(db, train.train_id, from_ids, to_ids)
+        if not rs_from:
+            continue
+
+        classes_rt = []
+        berth_q = db.query(BerthClass).filter(BerthClass.train_id == train.train_id)
+
+        if return_train_class:
+            matched_return_class_name = _class_name(return_train_class, "Invalid return train class type requested")
+
+            berth_q = berth_q.filter(
+                func.lower(BerthClass.class_type).like(
+                    func.lower(f"%{matched_return_class_name}%")
+                )
+            )
+
+        for bc in berth_q.all():
+            avail = find_availability(db, bc.berth_class_id, return_date)
+
+            available = avail.available_seats if avail else 0
+            classes_rt.append(
+                ClassAvailability(
+                    class_type=bc.class_type,
+                    total_berths=bc.total_berths,
+                    booked=bc.total_berths - available,
+                    available=available,
+                    price=bc.price,
+                    waitlist=avail.waitlist_count if avail else 0
+                )
+            )
+
+        if return_train_class and not classes_rt:
+            continue
+
+        km = fares.trip_km(rs_from, rs_to)
+        pending_fares.extend((c, km) for c in classes_rt)
+
+        result.append(
+            TrainAvailability(
+                train_id=train.train_id,
+                train_name=train.train_name,
+                train_number=str(train.train_no),
+                train_type=train.train_type,
+                from_station=names[rs_from.station_id],
+                to_station=names[rs_to.station_id],
+                travel_date=return_date,
+                departure_time=rs_from.departure_time,
+                arrival_time=rs_to.arrival_time,
+                departure_date=return_date,
+                classes=classes_rt
+            )
+        )
+
+    return result
+
+
+# ---------------- Keyset page of departures ----------------
+def _search_page(db: Session, state: dict):
+    """
+    One page after (or before) the cursor's (departure_time, train_id).
+    Stations, routes and train filters come resolved in the cursor; the
+    service calendar is an in-memory lookup.
+    """
+    page_size = state["page_size"]
+    travel_date = state["travel_date"]
+    boundary_t, boundary_id = state["t"], state["id"]
+    forward = state["dir"] == search_cursor.NEXT
+
+    running = service_calendar.get_service_calendar(db).running_trains(state["route_ids"], travel_date)
+    if search_core.SEARCH_CORE:
+        departures = search_core.departures(state["from_ids"], state["route_ids"], running, state.get("train_ids"))
+        rows = search_core.page(db, departures, boundary_t, boundary_id, forward, page_size + 1)
+    else:
+        q = (
+            db.query(Train, RouteStation.departure_time)
+            .join(RouteStation, RouteStation.train_id == Train.train_id)
+            .filter(_boarding_stop(state["from_ids"]), Train.route_id.in_(state["route_ids"]))
+        )
+        if running is not None:
+            q = q.filter(Train.train_id.in_(running))
+        if "train_ids" in state:
+            q = q.filter(Train.train_id.in_(state["train_ids"]))
+
+        if forward:
+            q = q.filter(or_(
+                RouteStation.departure_time > boundary_t,
+                and_(RouteStation.departure_time == boundary_t, Train.train_id > boundary_id)
+            )).order_by(RouteStation.departure_time.asc(), Train.train_id.asc())
+        else:
+            q = q.filter(or_(
+                RouteStation.departure_time < boundary_t,
+                and_(RouteStation.departure_time == boundary_t, Train.train_id < boundary_id)
+            )).order_by(RouteStation.departure_time.desc(), Train.train_id.desc())
+        rows = q.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not forward:
+        rows.reverse()
+
+    pending_fares = []
+    names = {int(sid): name for sid, name in state["names"].items()}   # JSON keys are strings
+    result = _onward_results(
+        db, [t for t, _ in rows], state["from_ids"], state["to_ids"],
+        names, travel_date, state["train_class"], pending_fares
+    )
+    fares.price_classes(pending_fares)
+
+    # Going forward there is always a way back to the cursor's page, and vice versa
+    resolved = {k: v for k, v in state.items() if k not in ("dir", "t", "id")}
+    next_cursor = prev_cursor = None
+    if rows:
+        first, first_dep = rows[0]
+        last, last_dep = rows[-1]
+        if has_more or not forward:
+            next_cursor = search_cursor.encode(resolved, search_cursor.NEXT, last_dep, last.train_id)
+        if has_more or forward:
+            prev_cursor = search_cursor.encode(resolved, search_cursor.PREV, first_dep, first.train_id)
+
+    logger.info("search_trains page", extra={"onward_count": len(result), "direction": state["dir"]})
+    return {"onward": result, "return": [], "next_cursor": next_cursor, "prev_cursor": prev_cursor}
+
+
 # ---------------- Main search function ----------------
 def search_trains(
     db: Session,
@@ -94,10 +533,15 @@ def search_trains(
     return_train_class: str | None = None,
     return_train_number: str | None = None,
     return_train_name: str | None = None,
-    return_train_type: str | None = None
-    
+    return_train_type: str | None = None,
+    cursor: str | None = None,
+    page_size: int = 3
 ):
     try:
+        # ---------------- Next/previous page of an earlier search ----------------
+        if cursor:
+            return _search_page(db, search_cursor.decode(cursor))
+
         # ---------------- Validate Mandatory Fields ----------------
         if not from_station_name or from_station_name.strip() == "":
             raise HTTPException(
@@ -161,58 +605,45 @@ def search_trains(
 
 
 
-        logger.info("🔥 search_trains called")
-        logger.info(f"params: from={from_station_name} to={to_station_name} date={travel_date} time={time} train_number={train_number}")
-
-        # ---------------- Get Stations ----------------
-        stations = db.query(Station).all()
-
-# Match by English OR Polish OR station code
-        from_station = next(
-            (s for s in stations if match_station(from_station_name, s)),
-            None
-        )
-
-        to_station = next(
-            (s for s in stations if match_station(to_station_name, s)),
-            None
+        logger.info(
+            "search_trains called",
+            extra={
+                "from_station": from_station_name,
+                "to_station": to_station_name,
+                "travel_date": travel_date,
+                "time": time,
+                "train_number": train_number,
+                "return_date": return_date,
+            }
         )
 
-        if not from_station:
-            raise HTTPException(
-                status_code=404,
-                detail=f"From station '{from_station_name}' not found"
-            )
-
-        if not to_station:
-            raise HTTPException(
-                status_code=404,
-                detail=f"To station '{to_station_name}' not found"
-            )
-
-        from_id = from_station.station_id
-        to_id = to_station.station_id
-
-        # ✅ Force Polish names for API output
-        polish_from = from_station.station_name_PL
-        polish_to = to_station.station_name_PL
+        # ---------------- Get Stations ----------------
+        polish_from, polish_to, names, from_ids, to_ids = resolve_stations(db, from_station_name, to_station_name)
 
 
         # ---------------- Find route_ids containing both stations in correct order ----------------
-        rf = aliased(RouteStation)
-        rt = aliased(RouteStation)
-        route_rows = (
-            db.query(rf.route_id)
-            .join(rt, rf.route_id == rt.route_id)
-            .filter(
-                rf.station_id == from_id,
-                rt.station_id == to_id,
-                rf.stop_number < rt.stop_number
+        def load_route_ids():
+            if search_core.SEARCH_CORE:
+                return search_core.routes(db, from_ids, to_ids)
+            rf = aliased(RouteStation)
+            rt = aliased(RouteStation)
+            route_rows = (
+                db.query(rf.route_id)
+                .join(rt, rf.route_id == rt.route_id)
+                .filter(
+                    rf.station_id.in_(from_ids),
+                    rt.station_id.in_(to_ids),
+                    rf.stop_number < rt.stop_number
+                )
+                .distinct()
+                .all()
             )
-            .distinct()
-            .all()
-        )
-        route_ids = [r[0] for r in route_rows]
+            return [r[0] for r in route_rows]
+
+        if cache.lookup_cache.enabled:
+            route_ids = cache.lookup_cache.get_or_compute(("routes", tuple(from_ids), tuple(to_ids)), load_route_ids)
+        else:
+            route_ids = load_route_ids()
         if not route_ids:
             raise HTTPException(
                 status_code=404,
@@ -220,6 +651,16 @@ def search_trains(
             )
         # ---------------- Base Train Query ----------------
         trains_query = db.query(Train).filter(Train.route_id.in_(route_ids))
+
+        # ---------------- Service calendar: drop trains not running on travel_date ----------------
+        running = service_calendar.get_service_calendar(db).running_trains(route_ids, travel_date)
+        if running is not None:
+            if not running:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"No trains run between {polish_from} and {polish_to} on {travel_date}"
+                )
+            trains_query = trains_query.filter(Train.train_id.in_(running))
         if train_number:
             try:
                 tn = int(train_number)
@@ -281,39 +722,75 @@ def search_trains(
                 Train.train_type.ilike(f"%{train_type}%")
             )
 
+        # Trains left by the number, name and type filters, as ids: how the
+        # Core statements and the cursor take them
+        filtered_ids = None
+        if search_core.SEARCH_CORE and (train_number or train_name or train_type):
+            filtered_ids = [tid for (tid,) in trains_query.with_entities(Train.train_id)]
+
         # ---------------- Time-based nearest train filtering ----------------
+        next_cursor = prev_cursor = None
         if time:
             input_t = datetime.strptime(time, "%H:%M").time()
+            if search_core.SEARCH_CORE:
+                departures = search_core.departures(from_ids, route_ids, running, filtered_ids)
+                # page_size trains before and after input time (one extra tells us whether there are more)
+                before_rows = search_core.before(db, departures, input_t, page_size + 1)
+                after_rows = search_core.after(db, departures, input_t, page_size + 1)
+            else:
+                window = (
+                    trains_query
+                    .join(RouteStation, RouteStation.train_id == Train.train_id)
+                    .add_columns(RouteStation.departure_time)
+                    .filter(_boarding_stop(from_ids))
+                )
 
-            # 3 trains BEFORE input time
-            before_trains = (
-                trains_query
-                .join(RouteStation, RouteStation.train_id == Train.train_id)
-                .filter(
-                    RouteStation.station_id == from_id,
-                    RouteStation.departure_time < input_t
+                # page_size trains BEFORE input time (one extra tells us whether there are more)
+                before_rows = (
+                    window
+                    .filter(RouteStation.departure_time < input_t)
+                    .order_by(RouteStation.departure_time.desc(), Train.train_id.desc())
+                    .limit(page_size + 1)
+                    .all()
                 )
-                .order_by(RouteStation.departure_time.desc())
-                .limit(3)
-                .all()
-            )
 
-            # 3 trains AFTER (including equal time)
-            after_trains = (
-                trains_query
-                .join(RouteStation, RouteStation.train_id == Train.train_id)
-                .filter(
-                    RouteStation.station_id == from_id,
-                    RouteStation.departure_time >= input_t
+                # page_size trains AFTER (including equal time)
+                after_rows = (
+                    window
+                    .filter(RouteStation.departure_time >= input_t)
+                    .order_by(RouteStation.departure_time.asc(), Train.train_id.asc())
+                    .limit(page_size + 1)
+                    .all()
                 )
-                .order_by(RouteStation.departure_time.asc())
-                .limit(3)
-                .all()
-            )
 
-            # Final combined list (before trains in ascending order)
-            trains = list(reversed(before_trains)) + after_trains
+            has_prev, has_next = len(before_rows) > page_size, len(after_rows) > page_size
+            before_rows, after_rows = before_rows[:page_size], after_rows[:page_size]
 
+            # Final combined list (before trains in ascending order)
+            rows = list(reversed(before_rows)) + after_rows
+            trains = [t for t, _ in rows]
+
+            if has_prev or has_next:
+                state = {
+                    "from_ids": from_ids, "to_ids": to_ids, "names": names,
+                    "route_ids": route_ids,
+                    "travel_date": travel_date,
+                    "train_class": train_class,
+                    "page_size": page_size,
+                }
+                if filtered_ids is not None:
+                    state["train_ids"] = filtered_ids
+                elif train_number or train_name or train_type:
+                    state["train_ids"] = [tid for (tid,) in trains_query.with_entities(Train.train_id)]
+                if has_prev:
+                    first, dep = rows[0]
+                    prev_cursor = search_cursor.encode(state, search_cursor.PREV, dep, first.train_id)
+                if has_next:
+                    last, dep = rows[-1]
+                    next_cursor = search_cursor.encode(state, search_cursor.NEXT, dep, last.train_id)
+
+        elif search_core.SEARCH_CORE:
+            trains = search_core.trains(db, route_ids, running, filtered_ids)
         else:
             trains = trains_query.distinct().all()
 
@@ -322,140 +799,31 @@ def search_trains(
 
 
         # ---------------- Build Result ----------------
-        result = []
-
-        for train in trains:
-            # ---------------- Get from/to RouteStation ----------------
-            rs_from = db.query(RouteStation).filter(RouteStation.train_id == train.train_id, RouteStation.station_id == from_id).first()
-            rs_to = db.query(RouteStation).filter(RouteStation.train_id == train.train_id, RouteStation.station_id == to_id).first()
-            if not rs_from or not rs_to or rs_from.stop_number >= rs_to.stop_number:
-                continue
-
-            # ---------------- Time filter ----------------
-            #if time:
-            #input_t = datetime.strptime(time, "%H:%M").time()
-            #start_t = (datetime.combine(date.today(), input_t) - timedelta(hours=23)).time()
-            #end_t = (datetime.combine(date.today(), input_t) + timedelta(hours=23)).time()
-            #if not (start_t <= rs_from.departure_time <= end_t):
-            #    continue
-
-            # ---------------- Classes & Availability ----------------
-            berth_query = db.query(BerthClass).filter(BerthClass.train_id == train.train_id)
-            #if train_class:
-            berth_query = berth_query.filter(BerthClass.class_type.ilike(f"%{train_class}%"))
-
-            # ---------------- Classes & Availability (Show only requested class if provided) ----------------
-            classes = []
-            if train_class:
-                # Normalize user input class type
-                requested_class = normalize(train_class)
-
-                # Map possible inputs to actual stored class names
-                class_map = {
-                    "1st": "1st Class",
-                    "first": "1st Class",
-                    "first class": "1st class",
-                    "2nd": "2nd Class",
-                    "second": "2nd Class",
-                    "second class": "2nd class",
-                    "chair": "Chair Car",
-                    "executive": "Executive Chair Car",
-                    "exec": "Executive Chair Car"
-                }
-
-                # Find correct DB class value
-                matched_class_name = next(
-                    (v for k, v in class_map.items() if k in requested_class),
-                    None
-                )
-
-                if not matched_class_name:
-                    raise HTTPException(400, "Invalid class type requested")
-
-                # Query only that class
-                bc = (
-                    db.query(BerthClass)
-                    .filter(
-                        BerthClass.train_id == train.train_id,
-                        func.lower(BerthClass.class_type).like(func.lower(f"%{matched_class_name}%"))
-                    )
-                    .first()
-                )
-
-                if bc:
-                    avail = db.query(TrainSeatAvailability).filter(
-                        TrainSeatAvailability.berth_class_id == bc.berth_class_id,
-                        #TrainSeatAvailability.travel_date == travel_date
-                    ).first()
-
-                    available = avail.available_seats if avail else 0
-                    booked = bc.total_berths - available
-
-                    classes.append(
-                        ClassAvailability(
-                            class_type=bc.class_type,
-                            total_berths=bc.total_berths,
-                            booked=booked,
-                            available=available,
-                            price=bc.price
-                        )
-                    )
-
-            else:
-                # No class filter → fetch all classes (existing behavior)
-                for bc in db.query(BerthClass).filter(BerthClass.train_id == train.train_id).all():
-                    avail = db.query(TrainSeatAvailability).filter(
-                        TrainSeatAvailability.berth_class_id == bc.berth_class_id,
-                        #TrainSeatAvailability.travel_date == travel_date
-                    ).first()
-
-                    available = avail.available_seats if avail else 0
-                    booked = bc.total_berths - available
-
-                    classes.append(
-                        ClassAvailability(
-                            class_type=bc.class_type,
-                            total_berths=bc.total_berths,
-                            booked=booked,
-                            available=available,
-                            price=bc.price
-                        )
-                    )
-
-
-            result.append(
-                TrainAvailability(
-                    train_id=train.train_id,
-                    train_name=train.train_name,
-                    train_number= str(train.train_no),
-                    train_type=train.train_type,
-                    from_station=polish_from,
-                    to_station=polish_to,
-                    travel_date=travel_date,
-                    departure_time=rs_from.departure_time,
-                    arrival_time=rs_to.arrival_time,
-                    departure_date= travel_date,
-                    classes=classes
-                )
-            )
-
+        # (ClassAvailability, km) pairs, priced together once all trains are built
+        pending_fares = []
+        result = _onward_results(
+            db, trains, from_ids, to_ids, names, travel_date, train_class, pending_fares
+        )
 
         # ================= RETURN JOURNEY =================
         return_list = []
 
         if return_date:
-            rf, rt = aliased(RouteStation), aliased(RouteStation)
-            reverse_route_ids = [
-                r[0] for r in db.query(rf.route_id)
-                .join(rt, rf.route_id == rt.route_id)
-                .filter(
-                    rf.station_id == to_id,
-                    rt.station_id == from_id,
-                    rf.stop_number < rt.stop_number
-                )
-                .distinct()
-                .all()
-            ]
+            if search_core.SEARCH_CORE:
+                reverse_route_ids = search_core.routes(db, to_ids, from_ids)
+            else:
+                rf, rt = aliased(RouteStation), aliased(RouteStation)
+                reverse_route_ids = [
+                    r[0] for r in db.query(rf.route_id)
+                    .join(rt, rf.route_id == rt.route_id)
+                    .filter(
+                        rf.station_id.in_(to_ids),
+                        rt.station_id.in_(from_ids),
+                        rf.stop_number < rt.stop_number
+                    )
+                    .distinct()
+                    .all()
+                ]
 
             if not reverse_route_ids:
                 raise HTTPException(
@@ -464,6 +832,14 @@ def search_trains(
 
             reverse_q = db.query(Train).filter(Train.route_id.in_(reverse_route_ids))
 
+            running = service_calendar.get_service_calendar(db).running_trains(reverse_route_ids, return_date)
+            if running is not None:
+                if not running:
+                    raise HTTPException(
+                        404, f"No trains run between {polish_to} and {polish_from} on {return_date}"
+                    )
+                reverse_q = reverse_q.filter(Train.train_id.in_(running))
+
             if return_train_number:
                 rtn = int(return_train_number)
                 q = reverse_q.filter(
@@ -492,115 +868,53 @@ def search_trains(
                     raise HTTPException(404, f"Return train type '{return_train_type}' not found")
                 reverse_q = q
 
+            reverse_ids = None
+            if search_core.SEARCH_CORE and (return_train_number or return_train_name or return_train_type):
+                reverse_ids = [tid for (tid,) in reverse_q.with_entities(Train.train_id)]
+
             # -------- Time filter (RETURN) --------
             if return_time:
                 t = datetime.strptime(return_time, "%H:%M").time()
 
-                before = (
-                    reverse_q.join(RouteStation)
-                    .filter(RouteStation.station_id == to_id, RouteStation.departure_time < t)
-                    .order_by(RouteStation.departure_time.desc())
-                    .limit(3)
-                    .all()
-                )
+                if search_core.SEARCH_CORE:
+                    departures = search_core.departures(to_ids, reverse_route_ids, running, reverse_ids)
+                    before = [train for train, _ in search_core.before(db, departures, t, 3)]
+                    after = [train for train, _ in search_core.after(db, departures, t, 3)]
+                else:
+                    before = (
+                        reverse_q.join(RouteStation)
+                        .filter(_boarding_stop(to_ids), RouteStation.departure_time < t)
+                        .order_by(RouteStation.departure_time.desc())
+                        .limit(3)
+                        .all()
+                    )
 
-                after = (
-                    reverse_q.join(RouteStation)
-                    .filter(RouteStation.station_id == to_id, RouteStation.departure_time >= t)
-                    .order_by(RouteStation.departure_time.asc())
-                    .limit(3)
-                    .all()
-                )
+                    after = (
+                        reverse_q.join(RouteStation)
+                        .filter(_boarding_stop(to_ids), RouteStation.departure_time >= t)
+                        .order_by(RouteStation.departure_time.asc())
+                        .limit(3)
+                        .all()
+                    )
 
                 reverse_trains = list(reversed(before)) + after
+            elif search_core.SEARCH_CORE:
+                reverse_trains = search_core.trains(db, reverse_route_ids, running, reverse_ids)
             else:
                 reverse_trains = reverse_q.distinct().all()
 
-            for train in reverse_trains:
-                rs_from = db.query(RouteStation).filter(
-                    RouteStation.train_id == train.train_id,
-                    RouteStation.station_id == to_id
-                ).first()
-
-                rs_to = db.query(RouteStation).filter(
-                    RouteStation.train_id == train.train_id,
-                    RouteStation.station_id == from_id
-                ).first()
-
-                if not rs_from or not rs_to or rs_from.stop_number >= rs_to.stop_number:
-                    continue
-
-                classes_rt = []
-                berth_q = db.query(BerthClass).filter(BerthClass.train_id == train.train_id)
-
-                if return_train_class:
-                    # Normalize user input return class type
-                    requested_return_class = normalize(return_train_class)
-
-                    # Map possible inputs to actual stored class names
-                    class_map = {
-                        "1st": "1st Class",
-                        "first": "1st Class",
-                        "first class": "1st Class",
-                        "2nd": "2nd Class",
-                        "second": "2nd Class",
-                        "second class": "2nd Class",
-                        "chair": "Chair Car",
-                        "executive": "Executive Chair Car",
-                        "exec": "Executive Chair Car"
-                    }
-
-                    # Find correct DB class value
-                    matched_return_class_name = next(
-                        (v for k, v in class_map.items() if k in requested_return_class),
-                        None
-                    )
-
-                    if not matched_return_class_name:
-                        raise HTTPException(400, "Invalid return train class type requested")
-
-                    berth_q = berth_q.filter(
-                        func.lower(BerthClass.class_type).like(
-                            func.lower(f"%{matched_return_class_name}%")
-                        )
-                    )
-
-                for bc in berth_q.all():
-                    avail = db.query(TrainSeatAvailability).filter(
-                        TrainSeatAvailability.berth_class_id == bc.berth_class_id
-                    ).first()
-
-                    available = avail.available_seats if avail else 0
-                    classes_rt.append(
-                        ClassAvailability(
-                            class_type=bc.class_type,
-                            total_berths=bc.total_berths,
-                            booked=bc.total_berths - available,
-                            available=available,
-                            price=bc.price
-                        )
-                    )
+            return_list = _return_results(
+                db, reverse_trains, to_ids, from_ids, names, return_date, return_train_class, pending_fares
+            )
 
-                if return_train_class and not classes_rt:
-                    continue
-
-                return_list.append(
-                    TrainAvailability(
-                        train_id=train.train_id,
-                        train_name=train.train_name,
-                        train_number=str(train.train_no),
-                        train_type=train.train_type,
-                        from_station=polish_to,
-                        to_station=polish_from,
-                        travel_date=return_date,
-                        departure_time=rs_from.departure_time,
-                        arrival_time=rs_to.arrival_time,
-                        departure_date=return_date,
-                        classes=classes_rt
-                    )
-                )
+        # ---------------- Distance-based fares (one vectorized pass) ----------------
+        fares.price_classes(pending_fares)
 
-        return {"onward": result, "return": return_list}
+        logger.info(
+            "search_trains completed",
+            extra={"onward_count": len(result), "return_count": len(return_list)}
+        )
+        return {"onward": result, "return": return_list, "next_cursor": next_cursor, "prev_cursor": prev_cursor}
 
     except HTTPException:
         raise
@@ -36,13 +36,40 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 
+# Compiled statements SQLAlchemy keeps per engine (its default is 500)
+SQL_COMPILED_CACHE_SIZE = int(os.getenv("SQL_COMPILED_CACHE_SIZE", "1000"))
+# psycopg 3: server-side PREPARE a statement on its Nth execution on a
+# connection; "off" for poolers that cannot keep prepared statements
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "2")
+# SQLite: prepared statements kept per connection by the sqlite3 module
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+
+def engine_options(url):
+    """Dialect-specific create_engine() options."""
+    options = {"query_cache_size": SQL_COMPILED_CACHE_SIZE}
+    # pyodbc sends executemany() as one array-bound round trip
+    if url and url.startswith("mssql+pyodbc"):
+        options["fast_executemany"] = True
+    # Server-side prepared statements where the driver supports them.
+    # psycopg2, pyodbc and pymssql have none; SQL Server still reuses the
+    # plan of a parameterized statement.
+    if url and url.startswith("postgresql+psycopg") and not url.startswith("postgresql+psycopg2"):
+        threshold = None if DB_PREPARE_THRESHOLD.lower() in ("off", "none", "") else int(DB_PREPARE_THRESHOLD)
+        options["connect_args"] = {"prepare_threshold": threshold}
+    elif url and url.startswith("sqlite"):
+        options["connect_args"] = {"cached_statements": DB_STATEMENT_CACHE}
+    return options
+
+
 #engine = create_engine(
 #    DATABASE_URL,
 #   fast_executemany=True,  
 #    pool_pre_ping=True,     
 #)
 engine = create_engine(
-    DATABASE_URL      
+    DATABASE_URL,
+    **engine_options(DATABASE_URL)
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
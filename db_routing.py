@@ -0,0 +1,198 @@
+"""
+Read-replica routing.
+
+Writes (and read-your-writes flows) always use the primary engine from
+database.py. Read-only paths such as /search_trains are spread round-robin
+over REPLICA_DATABASE_URLS, skipping replicas that failed their last health
+check or whose replication lag exceeds REPLICA_MAX_LAG_SECONDS. With no
+healthy replica left, reads fall back to the primary.
+
+Local test with two SQLite files:
+
+    DATABASE_URL=sqlite:///primary.db
+    REPLICA_DATABASE_URLS=sqlite:///replica.db
+    REPLICA_MAX_LAG_SECONDS=5
+
+Copy primary.db to replica.db to "replicate"; the heartbeat row copied along
+with it tells the router how far behind the replica is.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, Integer, Table, create_engine, event, select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from database import Base, SessionLocal, engine, engine_options
+import itertools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("train_search")
+
+# ---------------- Settings ----------------
+REPLICA_DATABASE_URLS = [u.strip() for u in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if u.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+REPLICA_HEARTBEAT_INTERVAL = float(os.getenv("REPLICA_HEARTBEAT_INTERVAL", "1"))
+
+# Cookie that pins a client to the primary after it wrote something
+PIN_PRIMARY_COOKIE = "pin_primary"
+
+# ---------------- Heartbeat table ----------------
+# Written on the primary, read on replicas: lag = now - beat_at.
+# PostgreSQL replicas use pg_last_xact_replay_timestamp() instead.
+replication_heartbeat = Table(
+    "polRail_replication_heartbeat_2",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("beat_at", DateTime, nullable=False),
+)
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def touch_heartbeat(bind=None):
+    """Record 'now' on the primary. Replicas see it once they have caught up."""
+    bind = bind or engine
+    with bind.begin() as conn:
+        replication_heartbeat.create(conn, checkfirst=True)
+        updated = conn.execute(
+            replication_heartbeat.update()
+            .where(replication_heartbeat.c.id == 1)
+            .values(beat_at=_utcnow())
+        ).rowcount
+        if not updated:
+            conn.execute(replication_heartbeat.insert().values(id=1, beat_at=_utcnow()))
+
+
+# ---------------- Replica ----------------
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_engine(url, pool_pre_ping=True, **engine_options(url))
+        self.healthy = True
+        self.lag = None
+        self.checked_at = 0.0
+        event.listen(self.engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        # A dropped connection takes the replica out of rotation until the next check
+        if context.is_disconnect:
+            self.healthy = False
+
+    def measure_lag(self, conn):
+        if self.engine.dialect.name == "postgresql":
+            lag = conn.execute(text(
+                "SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+            )).scalar()
+            return float(lag) if lag is not None else None
+
+        beat_at = conn.execute(
+            select(replication_heartbeat.c.beat_at).where(replication_heartbeat.c.id == 1)
+        ).scalar()
+        if beat_at is None:
+            return None
+        return (_utcnow() - beat_at).total_seconds()
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                try:
+                    self.lag = self.measure_lag(conn)
+                except SQLAlchemyError:
+                    self.lag = None
+            # Unknown lag counts as too far behind
+            self.healthy = self.lag is not None and self.lag <= REPLICA_MAX_LAG_SECONDS
+        except SQLAlchemyError:
+            self.healthy = False
+            self.lag = None
+        self.checked_at = time.monotonic()
+        if not self.healthy:
+            logger.warning("replica out of rotation", extra={"replica": self.engine.url.render_as_string(hide_password=True), "lag": self.lag})
+        return self.healthy
+
+
+# ---------------- Router ----------------
+class ReplicaRouter:
+    def __init__(self, urls):
+        self.replicas = [Replica(u) for u in urls]
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+        self._lock = threading.Lock()
+
+    def _refresh(self, replica):
+        # Checks are cached; only one request per interval pays for them
+        if time.monotonic() - replica.checked_at >= REPLICA_CHECK_INTERVAL:
+            replica.check()
+
+    def read_engine(self):
+        """Next healthy, caught-up replica, or the primary if there is none."""
+        if not self._cycle:
+            return engine
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = next(self._cycle)
+            self._refresh(replica)
+            if replica.healthy:
+                return replica.engine
+        return engine
+
+    def read_session(self) -> Session:
+        bind = self.read_engine()
+        if bind is engine:
+            return SessionLocal()
+        return Session(bind=bind, autoflush=False)
+
+    def status(self):
+        return [
+            {
+                "url": r.engine.url.render_as_string(hide_password=True),
+                "healthy": r.healthy,
+                "lag_seconds": r.lag,
+            }
+            for r in self.replicas
+        ]
+
+
+router = ReplicaRouter(REPLICA_DATABASE_URLS)
+
+
+# ---------------- Read-your-writes ----------------
+def pin_primary(response):
+    """
+    Call from write endpoints: the client reads from the primary until the
+    replicas have had time to catch up with what it just wrote.
+    """
+    response.set_cookie(PIN_PRIMARY_COOKIE, "1", max_age=max(1, int(REPLICA_MAX_LAG_SECONDS) + 1), httponly=True)
+
+
+def is_pinned(request) -> bool:
+    return bool(request.cookies.get(PIN_PRIMARY_COOKIE) or request.headers.get("X-Read-Primary"))
+
+
+# ---------------- Heartbeat writer ----------------
+_heartbeat_stop = threading.Event()
+
+
+def _heartbeat_loop():
+    while True:
+        try:
+            touch_heartbeat()
+        except SQLAlchemyError:
+            logger.warning("replication heartbeat failed", exc_info=True)
+        if _heartbeat_stop.wait(REPLICA_HEARTBEAT_INTERVAL):
+            return
+
+
+def start_heartbeat():
+    """Only needed when replicas are configured and lag comes from the heartbeat table."""
+    if not router.replicas:
+        return
+    _heartbeat_stop.clear()
+    threading.Thread(target=_heartbeat_loop, name="replication-heartbeat", daemon=True).start()
+
+
+def stop_heartbeat():
+    _heartbeat_stop.set()
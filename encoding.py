@@ -0,0 +1,169 @@
+"""
+Negotiated response encodings for search results.
+
+Clients pick a format with Accept and a compression with Accept-Encoding:
+
+    Accept: application/msgpack (or application/x-msgpack)   -> MessagePack
+    anything else                                             -> JSON
+    Accept-Encoding: br (if brotli is installed) / gzip       -> compressed
+                                                                 above COMPRESS_MIN_BYTES
+
+A result is first normalized through the response model, so every format
+carries exactly what the JSON response always did. Each (format, coding)
+variant is then encoded once and, when the result cache is enabled, stored
+next to the result. Later requests for that variant send the stored bytes
+with no encoding work. `python encoding.py bench` compares sizes and
+encode times.
+"""
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+import gzip
+import json
+import msgpack
+import os
+
+try:
+    import brotli
+except ImportError:   # optional: br is simply not offered
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+JSON = "json"
+MSGPACK = "msgpack"
+MEDIA_TYPES = {JSON: "application/json", MSGPACK: "application/msgpack"}
+_MSGPACK_ACCEPT = ("application/msgpack", "application/x-msgpack")
+
+
+# ---------------- Negotiation ----------------
+def _accepted_codings(header: str):
+    """Codings with a non-zero q value, lower-cased."""
+    codings = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            codings.add(name.strip().lower())
+    return codings
+
+
+def negotiate(request):
+    """(format, coding) for this request; coding is None, 'br' or 'gzip'."""
+    accept = request.headers.get("accept", "").lower()
+    fmt = MSGPACK if any(t in accept for t in _MSGPACK_ACCEPT) else JSON
+    codings = _accepted_codings(request.headers.get("accept-encoding"))
+    if brotli is not None and "br" in codings:
+        return fmt, "br"
+    if "gzip" in codings or "*" in codings:
+        return fmt, "gzip"
+    return fmt, None
+
+
+# ---------------- Encoding ----------------
+def to_response_data(result, model):
+    """Plain data in the response model's shape (aliases applied, dates as strings)."""
+    return jsonable_encoder(model.model_validate(result), by_alias=True)
+
+
+def serialize(data, fmt) -> bytes:
+    if fmt == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True)
+    # Same bytes FastAPI's JSONResponse would send
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def compress(body: bytes, coding):
+    """(body, applied coding): small bodies are sent as they are."""
+    if coding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+
+
+def encode(data, variant):
+    """Stored form of one variant: coding byte + body, so the cache keeps both."""
+    fmt, coding = variant
+    body, applied = compress(serialize(data, fmt), coding)
+    return (applied or "-").encode() + b"\n" + body
+
+
+def respond(variant, encoded: bytes) -> Response:
+    applied, _, body = encoded.partition(b"\n")
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if applied != b"-":
+        headers["Content-Encoding"] = applied.decode()
+    return Response(content=body, media_type=MEDIA_TYPES[variant[0]], headers=headers)
+
+
+# ---------------- Benchmark ----------------
+def bench(result, rounds=200):
+    import time
+
+    data = to_response_data(result, _search_model())
+    variants = [(JSON, None), (JSON, "gzip"), (MSGPACK, None), (MSGPACK, "gzip")]
+    if brotli is not None:
+        variants += [(JSON, "br"), (MSGPACK, "br")]
+
+    rows = []
+    for variant in variants:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            encoded = encode(data, variant)
+        per_call = (time.perf_counter() - started) / rounds
+        rows.append((f"{variant[0]}+{variant[1] or 'identity'}", len(encoded.partition(b"\n")[2]), per_call * 1e6))
+
+    baseline = rows[0][1]
+    print(f"{'variant':<20}{'bytes':>10}{'vs json':>10}{'encode us':>12}")
+    for name, size, micros in rows:
+        print(f"{name:<20}{size:>10}{size / baseline:>10.2f}{micros:>12.1f}")
+
+
+def _search_model():
+    from schemas import SearchResponse
+    return SearchResponse
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from datetime import date
+    from database import SessionLocal
+    import crud
+
+    parser = argparse.ArgumentParser(description="Compare search response encodings")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--from-station", default="Krakow")
+    parser.add_argument("--to-station", default="Warsaw")
+    parser.add_argument("--travel-date", default=date.today().isoformat())
+    parser.add_argument("--return-date")
+    parser.add_argument("--train-class", default="2nd")
+    parser.add_argument("--time", default="10:00")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = crud.search_trains(
+            db=db,
+            from_station_name=args.from_station,
+            to_station_name=args.to_station,
+            travel_date=date.fromisoformat(args.travel_date),
+            train_class=args.train_class,
+            time=args.time,
+            return_date=date.fromisoformat(args.return_date) if args.return_date else None,
+            return_time=args.time if args.return_date else None,
+        )
+    except Exception as e:
+        sys.exit(f"search failed: {e}")
+    finally:
+        db.close()
+    bench(result, args.rounds)
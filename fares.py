@@ -0,0 +1,135 @@
+"""
+Distance-based fares.
+
+fare = max(MIN_FARE, band_fare(km) * class_multiplier)
+
+band_fare is the sum over tariff bands of (km inside the band x rate). It
+is precomputed once per process for every whole km up to MAX_KM, so
+pricing N (train, class) pairs is one array gather and one multiply.
+Trips with an unknown distance keep the flat BerthClass.price. Holds and
+waitlist entries store the fare quoted for their stops (fare()), and the
+booking charges that.
+
+Set FARE_MODE=flat to price from BerthClass.price only, or point
+FARE_TARIFF_FILE at a JSON file with the DEFAULT_TARIFF layout.
+"""
+import json
+import numpy as np
+import os
+import threading
+import warmup
+
+FARE_MODE = os.getenv("FARE_MODE", "distance")
+FARE_TARIFF_FILE = os.getenv("FARE_TARIFF_FILE")
+
+DEFAULT_TARIFF = {
+    # [band upper bound in km (null = open ended), rate per km]
+    "bands": [[50, 0.40], [150, 0.30], [300, 0.22], [None, 0.16]],
+    "min_fare": 8.0,
+    "max_km": 2000,
+    # matched as substrings of the lower-cased class_type, first hit wins
+    "class_multipliers": [
+        ["executive", 1.8],
+        ["1st", 1.5],
+        ["first", 1.5],
+        ["chair", 1.1],
+        ["2nd", 1.0],
+        ["second", 1.0],
+    ],
+}
+
+
+class Tariff:
+    def __init__(self, spec):
+        self.min_fare = float(spec["min_fare"])
+        self.max_km = int(spec["max_km"])
+        self.class_multipliers = [(k.lower(), float(v)) for k, v in spec["class_multipliers"]]
+        self._multiplier_cache = {}
+
+        # rate for each km step 1..max_km, then cumulative fare per whole km
+        rates = np.empty(self.max_km, dtype=np.float64)
+        lower = 0
+        for upper, rate in spec["bands"]:
+            upper = self.max_km if upper is None else min(int(upper), self.max_km)
+            rates[lower:upper] = rate
+            lower = upper
+        rates[lower:] = spec["bands"][-1][1]
+        self.last_rate = float(rates[-1])
+        self.cumulative = np.concatenate(([0.0], np.cumsum(rates)))
+
+    def multiplier(self, class_type: str) -> float:
+        m = self._multiplier_cache.get(class_type)
+        if m is None:
+            lowered = class_type.lower()
+            m = next((v for k, v in self.class_multipliers if k in lowered), 1.0)
+            self._multiplier_cache[class_type] = m
+        return m
+
+    def quote(self, km, multipliers, flat_prices):
+        """
+        Vectorized fares. km < 0 marks an unknown distance and keeps the
+        matching flat price.
+        """
+        km = np.asarray(km, dtype=np.int64)
+        multipliers = np.asarray(multipliers, dtype=np.float64)
+        flat_prices = np.asarray(flat_prices, dtype=np.float64)
+
+        clipped = np.clip(km, 0, self.max_km)
+        base = self.cumulative[clipped] + np.maximum(km - self.max_km, 0) * self.last_rate
+        fares = np.maximum(base * multipliers, self.min_fare)
+        return np.where(km < 0, flat_prices, np.round(fares, 2))
+
+
+# ---------------- Cached tariff ----------------
+_tariff = None
+_tariff_lock = threading.Lock()
+
+
+def get_tariff() -> Tariff:
+    global _tariff
+    if _tariff is None:
+        with _tariff_lock:
+            if _tariff is None:
+                spec = DEFAULT_TARIFF
+                if FARE_TARIFF_FILE:
+                    with open(FARE_TARIFF_FILE) as f:
+                        spec = {**DEFAULT_TARIFF, **json.load(f)}
+                _tariff = Tariff(spec)
+    return _tariff
+
+
+@warmup.task
+def warm_tariff(db):
+    get_tariff()
+
+
+# ---------------- Pricing search results and bookings ----------------
+def trip_km(rs_from, rs_to) -> int:
+    if rs_from.distance_from_start_km is None or rs_to.distance_from_start_km is None:
+        return -1
+    return max(rs_to.distance_from_start_km - rs_from.distance_from_start_km, 0)
+
+
+def price_classes(pending):
+    """
+    pending: [(ClassAvailability, km), ...] with price holding the flat
+    BerthClass.price. Rewrites every price in one vectorized pass.
+    """
+    if not pending or FARE_MODE == "flat":
+        return
+    tariff = get_tariff()
+    prices = tariff.quote(
+        [km for _, km in pending],
+        [tariff.multiplier(c.class_type) for c, _ in pending],
+        [c.price for c, _ in pending],
+    )
+    for (c, _), price in zip(pending, prices.tolist()):
+        c.price = price
+
+
+def fare(km, class_type: str, flat_price) -> float:
+    """One trip's fare, the same number price_classes() gives search."""
+    if FARE_MODE == "flat":
+        return float(flat_price)
+    tariff = get_tariff()
+    return tariff.quote([km], [tariff.multiplier(class_type)], [flat_price]).tolist()[0]
@@ -0,0 +1,136 @@
+"""
+Folded station keys.
+
+fold() lower-cases text and maps accented letters to plain ASCII. A
+translation table covers the Polish alphabet, including ł/Ł, which have
+no Unicode decomposition. Other accented letters go through NFKD with the
+combining marks stripped. Results are memoized, because the same station
+names and user inputs are folded over and over.
+
+Every Station's name, Polish name, code and aliases are folded once and
+stored in polRail_station_keys_2 (StationKey). Exact station matching is
+then one indexed equality lookup instead of a scan over all stations.
+Keys are rebuilt after ORM flushes that touch stations, by the timetable
+importer, and by `python folding.py rebuild` for backfills.
+"""
+from collections import namedtuple
+from functools import lru_cache
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from models import Station, StationKey
+import cache
+import logging
+import unicodedata
+
+logger = logging.getLogger("train_search")
+
+_POLISH = str.maketrans({
+    "ą": "a", "ć": "c", "ę": "e", "ł": "l", "ń": "n", "ó": "o", "ś": "s", "ź": "z", "ż": "z",
+    "Ą": "a", "Ć": "c", "Ę": "e", "Ł": "l", "Ń": "n", "Ó": "o", "Ś": "s", "Ź": "z", "Ż": "z",
+})
+
+KIND_NAME = "name"
+KIND_NAME_PL = "name_pl"
+KIND_CODE = "code"
+KIND_ALIAS = "alias"
+
+
+@lru_cache(maxsize=65536)
+def fold(s: str) -> str:
+    folded = (s or "").translate(_POLISH)
+    if not folded.isascii():
+        folded = "".join(c for c in unicodedata.normalize("NFKD", folded) if not unicodedata.combining(c))
+    return folded.lower().strip()
+
+
+def station_keys(name, name_pl, code, aliases):
+    """{(kind, folded key)} for one station row."""
+    keys = {(KIND_NAME, fold(name)), (KIND_NAME_PL, fold(name_pl)), (KIND_CODE, fold(code))}
+    if aliases:
+        keys.update((KIND_ALIAS, fold(a)) for a in aliases.split("|"))
+    return {(kind, key) for kind, key in keys if key}
+
+
+# ---------------- Persisted keys ----------------
+def rebuild_station_keys(conn, station_ids=None):
+    """Rewrite the keys of station_ids (all stations when None) on conn."""
+    rows = select(
+        Station.station_id, Station.station_name, Station.station_name_PL,
+        Station.station_id_code, Station.station_name_comb_PL,
+    )
+    clear = delete(StationKey)
+    if station_ids is not None:
+        station_ids = list(station_ids)
+        if not station_ids:
+            return 0
+        rows = rows.where(Station.station_id.in_(station_ids))
+        clear = clear.where(StationKey.station_id.in_(station_ids))
+
+    keys = [
+        {"station_id": sid, "kind": kind, "key": key}
+        for sid, name, name_pl, code, aliases in conn.execute(rows)
+        for kind, key in station_keys(name, name_pl, code, aliases)
+    ]
+    conn.execute(clear)
+    if keys:
+        conn.execute(insert(StationKey), keys)
+    return len(keys)
+
+
+def lookup_station(db: Session, text: str):
+    """The matching Station with the lowest id, or None. One indexed query."""
+    key = fold(text)
+    if not key:
+        return None
+    try:
+        return (
+            db.query(Station)
+            .join(StationKey, StationKey.station_id == Station.station_id)
+            .filter(StationKey.key == key)
+            .order_by(Station.station_id)
+            .first()
+        )
+    except SQLAlchemyError:
+        # Keys table not created yet: callers fall back to scanning stations
+        db.rollback()
+        logger.warning("station keys table missing, run `python folding.py rebuild`")
+        return None
+
+
+StationRef = namedtuple("StationRef", "station_id station_name_PL")
+
+
+def lookup_station_ref(db: Session, text: str):
+    """lookup_station() through the shared lookup cache, as a StationRef."""
+    def load():
+        station = lookup_station(db, text)
+        return None if station is None else {"station_id": station.station_id, "station_name_PL": station.station_name_PL}
+
+    found = cache.lookup_cache.get_or_compute(("station", fold(text)), load) if cache.lookup_cache.enabled else load()
+    return None if found is None else StationRef(found["station_id"], found["station_name_PL"])
+
+
+# Keep keys in step with stations written through the ORM
+@event.listens_for(Session, "after_flush")
+def _station_keys_after_flush(session, flush_context):
+    changed = {
+        obj.station_id
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if isinstance(obj, Station) and obj.station_id is not None
+    }
+    if changed:
+        rebuild_station_keys(session.connection(), changed)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Maintain folded station keys")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    with engine.begin() as conn:
+        StationKey.__table__.create(conn, checkfirst=True)
+        print(f"{rebuild_station_keys(conn)} station keys written")
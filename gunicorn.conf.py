@@ -0,0 +1,39 @@
+# gunicorn -c gunicorn.conf.py main:app
+#
+# preload_app imports main:app once in the master. when_ready then builds the
+# station/timetable caches there before any worker is forked, so every
+# worker starts warm and shares those pages copy-on-write. If warm-up fails
+# (database unreachable at deploy), the master still starts: each worker
+# retries in its lifespan and /health/ready answers 503 until it succeeds.
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# Each worker has its own DB pool and background threads; scale with WEB_CONCURRENCY
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+preload_app = True
+
+
+def when_ready(server):
+    import warmup
+    try:
+        state = warmup.warm_up()
+    except Exception:
+        server.log.exception("warm-up in master failed, workers will retry")
+        return
+    server.log.info(
+        "warm-up done in master: import %.3fs, warm-up %.3fs %s",
+        state["import_seconds"], state["warmup_seconds"], state["tasks"]
+    )
+    # Keep the cyclic GC from touching (and so copying) inherited objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections opened by the master during warm-up must not be shared
+    from database import engine
+    import db_routing
+    engine.dispose(close=False)
+    for replica in db_routing.router.replicas:
+        replica.engine.dispose(close=False)
@@ -0,0 +1,168 @@
+"""
+Live seat availability over Server-Sent Events.
+
+Clients that watch a few trains subscribe once to GET /availability/stream
+instead of polling /search_trains. Each watched (train, date, class)
+resolves to its TrainSeatAvailability row.
+
+Updates come from the change log: the worker's CacheRefresher already
+polls it every CACHE_REFRESH_INTERVAL, and an adapter registered here
+gets the changed availability ids. If any of them are watched, it reads
+their counts in one query and hands them to the event loop. Bursts are
+coalesced along the way:
+  - the refresher groups every change since the last poll
+  - values equal to the last ones published are dropped
+  - each subscription keeps only the latest value per row until its
+    stream sends it
+
+An idle subscription is one coroutine waiting on an asyncio.Event, plus a
+keep-alive comment every LIVE_HEARTBEAT seconds. Nothing is done per
+subscriber unless one of its rows changed.
+"""
+from models import TrainSeatAvailability
+from sqlalchemy import select
+import asyncio
+import change_tracking
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger("train_search")
+
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "15"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "50000"))
+LIVE_MAX_KEYS = int(os.getenv("LIVE_MAX_KEYS", "20"))
+
+
+class _Subscription:
+    __slots__ = ("labels", "pending", "event")
+
+    def __init__(self, labels, snapshot):
+        self.labels = labels          # availability_id -> fields identifying the key to the client
+        self.pending = dict(snapshot)  # availability_id -> (available, waitlist) not sent yet
+        self.event = asyncio.Event()
+        self.event.set()
+
+
+def _event(data) -> str:
+    return f"event: availability\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+class AvailabilityHub:
+    def __init__(self):
+        self._loop = None
+        self._closed = False
+        self._subscribers = {}   # availability_id -> {_Subscription}; changed under _lock
+        self._last = {}          # availability_id -> last published (available, waitlist); loop only
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def start(self, loop):
+        self._loop = loop
+        self._closed = False
+
+    def stop(self):
+        """End every stream; called on the event loop at shutdown."""
+        self._closed = True
+        with self._lock:
+            subscriptions = {s for subs in self._subscribers.values() for s in subs}
+        for sub in subscriptions:
+            sub.event.set()
+
+    # ---------------- Event loop side ----------------
+    def _subscribe(self, labels, snapshot):
+        sub = _Subscription(labels, snapshot)
+        with self._lock:
+            for availability_id in labels:
+                self._subscribers.setdefault(availability_id, set()).add(sub)
+            self.count += 1
+        for availability_id, value in snapshot.items():
+            self._last.setdefault(availability_id, value)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            for availability_id in sub.labels:
+                subs = self._subscribers.get(availability_id)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[availability_id]
+                        self._last.pop(availability_id, None)
+            self.count -= 1
+
+    def _publish(self, rows):
+        for availability_id, value in rows.items():
+            if self._last.get(availability_id) == value:
+                continue
+            self._last[availability_id] = value
+            for sub in self._subscribers.get(availability_id, ()):
+                sub.pending[availability_id] = value
+                sub.event.set()
+
+    async def stream(self, labels, snapshot):
+        """SSE body: the current values first, then every change."""
+        sub = self._subscribe(labels, snapshot)
+        try:
+            while not self._closed:
+                try:
+                    await asyncio.wait_for(sub.event.wait(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                sub.event.clear()
+                pending, sub.pending = sub.pending, {}
+                for availability_id, (available, waitlist) in pending.items():
+                    yield _event({**sub.labels[availability_id], "available": available, "waitlist": waitlist})
+        finally:
+            self._unsubscribe(sub)
+
+    # ---------------- Refresher thread side ----------------
+    def watched(self, ids=None):
+        """The subset of ids (all watched ids when None) that someone is subscribed to."""
+        with self._lock:
+            if ids is None:
+                return set(self._subscribers)
+            return {i for i in ids if i in self._subscribers}
+
+    def publish_threadsafe(self, rows):
+        loop = self._loop
+        if rows and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._publish, rows)
+
+
+hub = AvailabilityHub()
+
+
+def _load(db, ids):
+    return {
+        availability_id: (available, waitlist)
+        for availability_id, available, waitlist in db.execute(
+            select(
+                TrainSeatAvailability.availability_id,
+                TrainSeatAvailability.available_seats,
+                TrainSeatAvailability.waitlist_count,
+            ).where(TrainSeatAvailability.availability_id.in_(list(ids)))
+        )
+    }
+
+
+# ---------------- Change feed ----------------
+class _AvailabilityFeed:
+    tables = {TrainSeatAvailability.__tablename__}
+    # Not a cache: nothing to catch up on, so the feed may start at the current version
+    version = None
+
+    def apply_changes(self, db, changes, version: int):
+        ids = hub.watched(changes[TrainSeatAvailability.__tablename__])
+        if ids:
+            hub.publish_threadsafe(_load(db, ids))
+
+    def reload(self, db):
+        ids = hub.watched()
+        if ids:
+            hub.publish_threadsafe(_load(db, ids))
+
+
+change_tracking.refresher.register(_AvailabilityFeed())
@@ -1,21 +1,111 @@
-from fastapi import FastAPI, Depends, Query, HTTPException
+import warmup  # first: times the imports below
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Query, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from datetime import date
+import asyncio
+from typing import List
 from database import SessionLocal, Base, engine
+from models import Train, BerthClass, SeatHold, Booking
 import crud
+import station_index
+import search_logging
+import db_routing
+import change_tracking
+import query_budget
+import analytics
+import seat_holds
+import booking_writer
+import waitlist
+import live_availability
+import singleflight
+import admission
+import profiling
+import cache
+import encoding
+import logging
 from schemas import (
     TrainAvailability,
     BookingRequest,
     BookingSuccessResponse,
     BookingFailureResponse,
-    SearchResponse
+    SearchResponse,
+    StationSuggestion,
+    OccupancyResponse,
+    HoldRequest,
+    HoldResponse,
+    ConfirmHoldRequest,
+    WaitlistRequest,
+    WaitlistResponse,
+    CancelBookingsRequest,
+    CancelBookingsResponse
 )
 
+warmup.mark_imported()
+
+logger = logging.getLogger("train_search")
+
 # ------------------- Create tables -------------------
+# Done by `python migrate.py` at deploy, which also upgrades existing tables
 #Base.metadata.create_all(bind=engine)
 
+# ------------------- Lifespan -------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    search_logging.setup_logging()
+    db_routing.start_heartbeat()
+    # Already done in the gunicorn master with preload_app; otherwise warm up
+    # here while /health/live answers and /health/ready reports 503
+    warmup.warm_up_in_background()
+    change_tracking.refresher.start()
+    analytics.start()
+    seat_holds.scheduler.start()
+    live_availability.hub.start(asyncio.get_running_loop())
+    yield
+    live_availability.hub.stop()
+    booking_writer.writer.stop()
+    seat_holds.scheduler.stop()
+    analytics.stop()
+    change_tracking.refresher.stop()
+    db_routing.stop_heartbeat()
+    search_logging.shutdown_logging()
+
+
 # ------------------- FastAPI app -------------------
-app = FastAPI(title="Railway Booking System")
+app = FastAPI(title="Railway Booking System", lifespan=lifespan)
+
+
+# ------------------- Admission control -------------------
+# Registered before request_context_middleware so that one stays outermost
+# and rejected requests still get an X-Request-ID
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    cls = admission.classify(request.method, request.url.path) if admission.ADMISSION_CONTROL else None
+    if cls is None:
+        return await call_next(request)
+    try:
+        return await admission.admit(cls, lambda: call_next(request))
+    except admission.Rejected as e:
+        logger.warning("request shed", extra={"endpoint_class": e.endpoint_class, "reason": e.reason})
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry shortly"},
+            headers={"Retry-After": admission.retry_after_header(e)}
+        )
+
+
+# ------------------- Request context -------------------
+# Correlation id for logs, plus SQL statement accounting when enabled
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    request_id = search_logging.start_request(request.headers.get("X-Request-ID"))
+    recorder = query_budget.start_recording() if query_budget.QUERY_ACCOUNTING else None
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    if recorder is not None:
+        response.headers[query_budget.QUERY_COUNT_HEADER] = str(recorder.count)
+    return response
 
 # ------------------- Dependency -------------------
 def get_db():
@@ -25,9 +115,25 @@ def get_db():
     finally:
         db.close()
 
+
+# Read-only endpoints: replica when one is healthy and caught up, else primary
+def read_session(request: Request) -> Session:
+    if db_routing.is_pinned(request):
+        return SessionLocal()
+    return db_routing.router.read_session()
+
+
+def get_read_db(request: Request):
+    db = read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
 # ------------------- Search Trains -------------------
 @app.get("/search_trains", response_model= SearchResponse)
 def search_trains(
+    request: Request,
     from_station: str = Query(..., description="Source station name"),
     to_station: str = Query(..., description="Destination station name"),
     travel_date: date = Query(..., description="Date of journey"),
@@ -42,10 +148,11 @@ def search_trains(
     return_train_number: str = Query(None, description="Train number for return journey"),
     return_train_name: str = Query(None, description="Name of the train for return journey"),
     return_train_type: str = Query(None, description="Train type for return journey"),
-    db: Session = Depends(get_db)
+    cursor: str = Query(None, description="next_cursor/prev_cursor from an earlier response"),
+    page_size: int = Query(3, ge=1, le=50, description="Departures per page on each side of time"),
+    db: Session = Depends(get_read_db)
 ):
-    trains = crud.search_trains(
-        db=db,
+    params = dict(
         from_station_name=from_station,
         to_station_name=to_station,
         travel_date=travel_date,
@@ -59,12 +166,292 @@ def search_trains(
         return_train_class=return_train_class,
         return_train_number=return_train_number,
         return_train_name=return_train_name,
-        return_train_type=return_train_type
+        return_train_type=return_train_type,
+        cursor=cursor,
+        page_size=page_size
+    )
+    variant = encoding.negotiate(request)
+    headers = {}
+
+    if profiling.ENABLED and profiling.should_profile(request):
+        # Run (not join) the search so the capture covers the real work
+        capture_id = profiling.capture_id_for(search_logging.request_id_var.get())
+        with profiling.capture("search_trains", capture_id, params=params) as captured:
+            trains = crud.search_trains(db=db, **params)
+        if captured:
+            headers[profiling.PROFILE_ID_HEADER] = capture_id
+        encoded = encoding.encode(encoding.to_response_data(trains, SearchResponse), variant)
+    else:
+        pinned = db_routing.is_pinned(request)
+        key = crud.search_key(params)
+        run = lambda: crud.search_trains(db=db, **params)
+
+        # Shared result cache; pinned clients just wrote, so they skip it.
+        # Each encoding of a cached result is built once and cached beside it.
+        use_cache = cache.search_cache.enabled and not pinned
+        encoded = cache.search_cache.get_bytes((key, variant)) if use_cache else None
+        if encoded is None:
+            trains = cache.search_cache.get(key) if use_cache else None
+            if trains is None:
+                compute = (lambda: cache.search_cache.get_or_compute(key, run)) if use_cache else run
+                if singleflight.SEARCH_COALESCING:
+                    # Identical concurrent searches share one run; pinned clients read
+                    # the primary, so they never share a replica result
+                    trains = singleflight.search_flight.do((pinned, key), compute)
+                else:
+                    trains = compute()
+            encoded = encoding.encode(encoding.to_response_data(trains, SearchResponse), variant)
+            if use_cache:
+                cache.search_cache.set_bytes((key, variant), encoded)
+
+    reply = encoding.respond(variant, encoded)
+    reply.headers.update(headers)
+    return reply
+
+# ------------------- Station Autocomplete -------------------
+@app.get("/stations/suggest", response_model=List[StationSuggestion])
+def suggest_stations(
+    q: str = Query(..., min_length=1, description="Station name, code or alias prefix"),
+    limit: int = Query(10, ge=1, le=station_index.MAX_SUGGESTIONS, description="Max suggestions"),
+    db: Session = Depends(get_read_db)
+):
+    return station_index.get_station_index(db).suggest(q, limit)
+
+
+# ------------------- Seat Holds -------------------
+# Writes go to the primary, and the caller is pinned there so its next
+# search sees the seats it just took.
+def _class_availability(db, train_number, travel_class, travel_date):
+    """(BerthClass, TrainSeatAvailability) for a booking request, or 404."""
+    train = db.query(Train).filter(Train.train_no == train_number).first()
+    if not train:
+        raise HTTPException(status_code=404, detail=f"Train {train_number} not found")
+
+    bc = (
+        db.query(BerthClass)
+        .filter(BerthClass.train_id == train.train_id, BerthClass.class_type.ilike(f"%{travel_class}%"))
+        .first()
+    )
+    avail = crud.find_exact_availability(db, bc.berth_class_id, travel_date) if bc else None
+    if not avail:
+        raise HTTPException(status_code=404, detail=f"No '{travel_class}' seats on train {train_number} on {travel_date}")
+    return bc, avail
+
+
+@app.post("/holds", response_model=HoldResponse, status_code=201)
+def create_hold(hold: HoldRequest, response: Response, db: Session = Depends(get_db)):
+    bc, avail = _class_availability(db, hold.train_number, hold.travel_class, hold.travel_date)
+    fare = crud.quote_fare(db, bc, hold.from_station, hold.to_station)
+
+    try:
+        if booking_writer.GROUP_COMMIT:
+            placed = booking_writer.writer.place_hold(avail, hold.travel_date, hold.seats, fare)
+        else:
+            placed = seat_holds.place_hold(db, avail, hold.travel_date, hold.seats, fare)
+    except seat_holds.HoldError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    db_routing.pin_primary(response)
+    return HoldResponse(
+        hold_id=placed.hold_id,
+        train_number=hold.train_number,
+        travel_date=placed.travel_date,
+        class_type=bc.class_type,
+        seats=placed.seats,
+        ticket_price=fare,
+        expires_at=placed.expires_at
+    )
+
+
+@app.post("/holds/{hold_id}/confirm", response_model=BookingSuccessResponse)
+def confirm_hold(hold_id: str, body: ConfirmHoldRequest, response: Response, db: Session = Depends(get_db)):
+    hold = db.get(SeatHold, hold_id)
+    if hold and len(body.passengers) != hold.seats:
+        raise HTTPException(status_code=400, detail=f"Hold is for {hold.seats} passengers, got {len(body.passengers)}")
+
+    try:
+        booking = seat_holds.confirm_hold(db, hold_id, body.contact_info)
+    except seat_holds.HoldError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    db_routing.pin_primary(response)
+    train = db.get(Train, booking.train_id)
+    bc = db.get(BerthClass, booking.berth_class_id)
+    # Holds placed before fares were stored charge the flat class price
+    ticket_price = booking.fare if booking.fare is not None else float(bc.price)
+    return BookingSuccessResponse(
+        status="success",
+        train_name=train.train_name,
+        train_no=train.train_no,
+        travel_date=booking.travel_date,
+        class_type=bc.class_type,
+        ticket_price=ticket_price,
+        passengers=booking.seats,
+        total_price=round(ticket_price * booking.seats, 2),
+        booking_id=booking.booking_id,
+        booking_token=booking.token
     )
-    if not trains:
-        raise HTTPException(status_code=404, detail="No trains found for this route")
-    return trains
 
 
+@app.delete("/holds/{hold_id}", status_code=204)
+def release_hold(hold_id: str, response: Response, db: Session = Depends(get_db)):
+    try:
+        seat_holds.release_hold(db, hold_id)
+    except seat_holds.HoldError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    db_routing.pin_primary(response)
+    response.status_code = 204
+    return response
+
+
+# ------------------- Waitlist & Cancellation -------------------
+def _waitlist_response(db, entry, train_number=None, token=None):
+    booking_token = db.get(Booking, entry.booking_id).token if entry.booking_id else None
+    if train_number is None:
+        train_number = db.get(Train, entry.train_id).train_no
+    bc = db.get(BerthClass, entry.berth_class_id)
+    return WaitlistResponse(
+        waitlist_id=entry.waitlist_id,
+        train_number=train_number,
+        travel_date=entry.travel_date,
+        class_type=bc.class_type,
+        seats=entry.seats,
+        ticket_price=entry.fare if entry.fare is not None else float(bc.price),
+        priority=entry.priority,
+        status=entry.status,
+        position=waitlist.position(db, entry),
+        token=token,
+        booking_id=entry.booking_id,
+        booking_token=booking_token
+    )
+
+
+@app.post("/waitlist", response_model=WaitlistResponse, status_code=201)
+def join_waitlist(body: WaitlistRequest, response: Response, db: Session = Depends(get_db)):
+    bc, avail = _class_availability(db, body.train_number, body.travel_class, body.travel_date)
+    fare = crud.quote_fare(db, bc, body.from_station, body.to_station)
+    try:
+        entry = waitlist.join(db, avail, body.travel_date, body.seats, body.contact_info, fare)
+    except waitlist.WaitlistError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    db_routing.pin_primary(response)
+    return _waitlist_response(db, entry, body.train_number, token=entry.token)
+
+
+@app.get("/waitlist/{waitlist_id}", response_model=WaitlistResponse)
+def get_waitlist_entry(
+    waitlist_id: int,
+    token: str = Query(..., description="Token returned when joining"),
+    db: Session = Depends(get_db)
+):
+    try:
+        entry = waitlist.get_entry(db, waitlist_id, token)
+    except waitlist.WaitlistError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return _waitlist_response(db, entry)
+
+
+@app.delete("/waitlist/{waitlist_id}", status_code=204)
+def leave_waitlist(
+    waitlist_id: int,
+    response: Response,
+    token: str = Query(..., description="Token returned when joining"),
+    db: Session = Depends(get_db)
+):
+    try:
+        waitlist.leave(db, waitlist_id, token)
+    except waitlist.WaitlistError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    db_routing.pin_primary(response)
+    response.status_code = 204
+    return response
+
+
+@app.post("/bookings/cancel", response_model=CancelBookingsResponse)
+def cancel_bookings(body: CancelBookingsRequest, response: Response, db: Session = Depends(get_db)):
+    try:
+        cancelled, promoted = waitlist.cancel_bookings(db, {b.booking_id: b.booking_token for b in body.bookings})
+    except waitlist.WaitlistError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    db_routing.pin_primary(response)
+    return CancelBookingsResponse(cancelled=cancelled, promoted=promoted)
+
+
+# ------------------- Live Availability -------------------
+# Long-lived and idle most of the time: not admission-controlled. The
+# snapshot is read with a session closed before streaming starts; a
+# Depends() session would hold a pooled connection for the whole stream.
+@app.get("/availability/stream")
+def availability_stream(
+    request: Request,
+    watch: List[str] = Query(..., description="train_number:YYYY-MM-DD:class, repeatable")
+):
+    if len(watch) > live_availability.LIVE_MAX_KEYS:
+        raise HTTPException(status_code=400, detail=f"At most {live_availability.LIVE_MAX_KEYS} watch keys per stream")
+    if live_availability.hub.count >= live_availability.LIVE_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many live subscribers, try again later")
+
+    keys = []
+    for key in watch:
+        try:
+            train_number, travel_date, travel_class = key.split(":", 2)
+            keys.append((int(train_number), date.fromisoformat(travel_date), travel_class))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid watch key '{key}', expected train_number:YYYY-MM-DD:class")
+
+    labels, snapshot = {}, {}
+    db = read_session(request)
+    try:
+        for train_number, travel_date, travel_class in keys:
+            bc, avail = _class_availability(db, train_number, travel_class, travel_date)
+            labels[avail.availability_id] = {"train_number": train_number, "travel_date": travel_date, "class_type": bc.class_type}
+            snapshot[avail.availability_id] = (avail.available_seats, avail.waitlist_count)
+    finally:
+        db.close()
+
+    return StreamingResponse(
+        live_availability.hub.stream(labels, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ------------------- Occupancy Analytics -------------------
+# Served from the background snapshot only; never reads the booking/search tables
+@app.get("/analytics/occupancy", response_model=OccupancyResponse, response_model_exclude_none=True)
+def occupancy(
+    group_by: str = Query("route_id,travel_date", description=f"Comma-separated subset of {', '.join(analytics.GROUP_COLUMNS)}"),
+    date_from: date = Query(None, description="First travel date"),
+    date_to: date = Query(None, description="Last travel date"),
+    route_id: int = Query(None, description="Only this route"),
+    train_id: int = Query(None, description="Only this train"),
+    class_type: str = Query(None, description="Only classes containing this text")
+):
+    columns = [c.strip() for c in group_by.split(",") if c.strip()]
+    invalid = [c for c in columns if c not in analytics.GROUP_COLUMNS]
+    if invalid or len(set(columns)) != len(columns):
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be a comma-separated subset of {', '.join(analytics.GROUP_COLUMNS)}"
+        )
+
+    snapshot = analytics.get_snapshot()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Occupancy snapshot is not ready yet")
+
+    rows = snapshot.occupancy(columns, date_from, date_to, route_id, train_id, class_type)
+    return {"snapshot_at": snapshot.taken_at, "rows": rows}
+
+# ------------------- Health -------------------
+@app.get("/health/live")
+def health_live():
+    return {"status": "ok"}
 
 
+@app.get("/health/ready")
+def health_ready():
+    status = warmup.status()
+    status["admission"] = admission.controller.status()
+    status["booking_writer"] = booking_writer.writer.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
@@ -0,0 +1,148 @@
+"""
+Idempotent schema upgrade for existing databases.
+
+The app never runs create_all() itself, so tables and columns added since
+the first deployment must be created here before new code serves traffic:
+
+    python migrate.py
+
+render.yaml runs it before gunicorn on every deploy. Each step checks
+what is already there, so running it again is a no-op:
+
+  - tables defined in models.py but missing are created, with their indexes
+  - columns missing from existing tables are added with ALTER TABLE. New
+    NOT NULL columns carry a server default, so existing rows get a value
+  - indexes missing from existing tables are created. UNIQUE constraints
+    an index has replaced (bookings.hold_id) are dropped first
+  - backfills fill in values the new columns could not get from a default
+  - a station key table created in this run is filled (folding.py)
+  - the change-log triggers are (re)installed (change_tracking.py)
+
+Foreign keys of added columns are not added to existing tables; the ORM
+does not depend on them.
+"""
+from sqlalchemy import bindparam, func, inspect, select, text, update
+from sqlalchemy.schema import CreateColumn
+from database import Base, engine
+from models import Booking, StationKey, TrainSeatAvailability, WaitlistEntry
+import change_tracking
+import folding
+import logging
+import sys
+import waitlist
+
+
+def _add_column(conn, table, column):
+    preparer = conn.dialect.identifier_preparer
+    definition = CreateColumn(column).compile(dialect=conn.dialect)
+    # SQL Server has no COLUMN keyword in ALTER TABLE ... ADD
+    add = "ADD" if conn.dialect.name == "mssql" else "ADD COLUMN"
+    conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} {add} {definition}"))
+
+
+# Column lists whose UNIQUE constraint became a filtered unique index
+_REPLACED_UNIQUES = {
+    Booking.__tablename__: [["hold_id"]],
+}
+
+
+def _drop_replaced_uniques(conn, inspector, table):
+    replaced = _REPLACED_UNIQUES.get(table.name)
+    # SQLite cannot drop a constraint, and allows many NULLs under one anyway
+    if not replaced or conn.dialect.name == "sqlite":
+        return []
+    preparer = conn.dialect.identifier_preparer
+    dropped = []
+    for unique in inspector.get_unique_constraints(table.name):
+        if unique["name"] and unique["column_names"] in replaced:
+            conn.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"DROP CONSTRAINT {preparer.quote(unique['name'])}"
+            ))
+            dropped.append(unique["name"])
+    return dropped
+
+
+def _backfill(conn):
+    """Values existing rows need beyond column defaults. Safe to repeat."""
+    # Bookings made before availability_id existed: their row for the date,
+    # so cancelling them gives the seats back
+    availability = (
+        select(func.min(TrainSeatAvailability.availability_id))
+        .where(
+            TrainSeatAvailability.berth_class_id == Booking.berth_class_id,
+            TrainSeatAvailability.travel_date == Booking.travel_date
+        )
+        .scalar_subquery()
+    )
+    filled = conn.execute(
+        update(Booking)
+        .where(Booking.availability_id.is_(None), availability.is_not(None))
+        .values(availability_id=availability)
+    ).rowcount
+    done = {f"{Booking.__tablename__}.availability_id": filled}
+
+    # Bookings and waitlist entries from before tokens existed get one
+    for model in (Booking, WaitlistEntry):
+        table = model.__table__
+        pk = table.primary_key.columns.values()[0]
+        ids = conn.execute(select(pk).where(table.c.token.is_(None))).scalars().all()
+        if ids:
+            conn.execute(
+                table.update().where(pk == bindparam("_id")).values(token=bindparam("_token")),
+                [{"_id": i, "_token": waitlist.new_token()} for i in ids]
+            )
+        done[f"{table.name}.token"] = len(ids)
+    return done
+
+
+def upgrade(bind=engine):
+    """Bring the schema up to models.py. Returns a summary of what changed."""
+    done = {"tables": [], "columns": [], "indexes": [], "constraints": []}
+    with bind.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                table.create(conn)
+                done["tables"].append(table.name)
+                continue
+
+            inspector = inspect(conn)
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    _add_column(conn, table, column)
+                    done["columns"].append(f"{table.name}.{column.name}")
+
+            done["constraints"].extend(_drop_replaced_uniques(conn, inspector, table))
+            indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    done["indexes"].append(index.name)
+
+        done["backfill"] = _backfill(conn)
+        if StationKey.__tablename__ in done["tables"]:
+            done["station_keys"] = folding.rebuild_station_keys(conn)
+
+    try:
+        change_tracking.install_triggers(bind)
+        done["triggers"] = True
+    except NotImplementedError as e:
+        # Caches then only pick up changes on restart
+        logging.getLogger("train_search").warning(str(e))
+        done["triggers"] = False
+    return done
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    summary = upgrade()
+    print(
+        f"created tables: {', '.join(summary['tables']) or 'none'}; "
+        f"added columns: {', '.join(summary['columns']) or 'none'}; "
+        f"added indexes: {', '.join(summary['indexes']) or 'none'}; "
+        f"dropped constraints: {', '.join(summary['constraints']) or 'none'}; "
+        f"backfilled: {summary['backfill']}; "
+        f"change triggers: {'installed' if summary['triggers'] else 'not available'}"
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, Time
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, Time, DateTime, Boolean, Index, Numeric, func
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -19,6 +19,17 @@ class Station(Base):
     route_stations = relationship("RouteStation", back_populates="station")
 
 
+# ------------------- Station Keys -------------------
+# Folded (lower-case, ASCII) names, codes and aliases, one row per key;
+# maintained by folding.py so station matching is an indexed equality lookup
+class StationKey(Base):
+    __tablename__ = "polRail_station_keys_2"
+    key_id = Column(Integer, primary_key=True, index=True)
+    station_id = Column(Integer, ForeignKey("polRail_stations_2.station_id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String(10), nullable=False)
+    key = Column(String(100), nullable=False, index=True)
+
+
 # ------------------- Trains -------------------
 class Train(Base):
     __tablename__ = "polRail_trains_2"
@@ -31,6 +42,8 @@ class Train(Base):
     # relationships
     berth_classes = relationship("BerthClass", back_populates="train", cascade="all, delete-orphan")
     schedules = relationship("TrainSchedule", back_populates="train", cascade="all, delete-orphan")
+    service_calendars = relationship("TrainServiceCalendar", back_populates="train", cascade="all, delete-orphan")
+    service_exceptions = relationship("TrainServiceException", back_populates="train", cascade="all, delete-orphan")
     route_stations = relationship("RouteStation", back_populates="train", cascade="all, delete-orphan")
     availabilities = relationship("TrainSeatAvailability", back_populates="train")
 
@@ -49,6 +62,10 @@ class Route(Base):
 # ------------------- Route Stations -------------------
 class RouteStation(Base):
     __tablename__ = "polRail_route_stations_2"
+    # Keyset paging of departures from a station: (departure_time, train_id) range scans
+    __table_args__ = (
+        Index("ix_route_stations_station_departure", "station_id", "departure_time", "train_id"),
+    )
     route_station_id = Column(Integer, primary_key=True, index=True)
     train_id = Column(Integer, ForeignKey("polRail_trains_2.train_id", ondelete="NO ACTION"))
     station_id = Column(Integer, ForeignKey("polRail_stations_2.station_id", ondelete="CASCADE"))
@@ -84,6 +101,8 @@ class TrainSeatAvailability(Base):
     berth_class_id = Column(Integer, ForeignKey("polRail_berth_classes_2.berth_class_id", ondelete="CASCADE"))
     available_seats = Column(Integer, nullable=False)
     travel_date = Column(Date, nullable=False) 
+    # WAITING waitlist entries, kept in step by waitlist.py so searches never COUNT
+    waitlist_count = Column(Integer, nullable=False, default=0, server_default="0")
     #total_berths = Column(Integer, nullable=False)
     # relationships
     train = relationship("Train", back_populates="availabilities")
@@ -102,6 +121,119 @@ class TrainSchedule(Base):
     # relationships
     train = relationship("Train", back_populates="schedules")
 
+
+# ------------------- Train Service Calendar -------------------
+# Operating days per train. A train without calendar rows runs every day.
+class TrainServiceCalendar(Base):
+    __tablename__ = "polRail_train_service_calendar_2"
+    calendar_id = Column(Integer, primary_key=True, index=True)
+    train_id = Column(Integer, ForeignKey("polRail_trains_2.train_id", ondelete="CASCADE"), nullable=False, index=True)
+    days_of_week = Column(String(7), nullable=False)  # Mon..Sun, e.g. "1111100"
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    # relationships
+    train = relationship("Train", back_populates="service_calendars")
+
+
+# ------------------- Train Service Exceptions -------------------
+# Single-day overrides of the calendar (holidays, extra runs)
+class TrainServiceException(Base):
+    __tablename__ = "polRail_train_service_exceptions_2"
+    exception_id = Column(Integer, primary_key=True, index=True)
+    train_id = Column(Integer, ForeignKey("polRail_trains_2.train_id", ondelete="CASCADE"), nullable=False, index=True)
+    service_date = Column(Date, nullable=False)
+    runs = Column(Boolean, nullable=False)  # True = extra run, False = cancelled
+    # relationships
+    train = relationship("Train", back_populates="service_exceptions")
+
+
+# ------------------- Seat Holds -------------------
+# Seats taken out of TrainSeatAvailability for a short checkout window.
+# HELD -> CONFIRMED (became a booking) | RELEASED (given back) | EXPIRED (TTL ran out)
+class SeatHold(Base):
+    __tablename__ = "polRail_seat_holds_2"
+    hold_id = Column(String(32), primary_key=True)
+    availability_id = Column(Integer, ForeignKey("polRail_train_seat_availability_2.availability_id"), nullable=False)
+    train_id = Column(Integer, ForeignKey("polRail_trains_2.train_id"), nullable=False)
+    berth_class_id = Column(Integer, ForeignKey("polRail_berth_classes_2.berth_class_id"), nullable=False)
+    travel_date = Column(Date, nullable=False)
+    seats = Column(Integer, nullable=False)
+    # Per-seat fare quoted for the hold's stops (fares.py); the booking charges it
+    fare = Column(Numeric(10, 2, asdecimal=False))
+    status = Column(String(20), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+# ------------------- Bookings -------------------
+# CONFIRMED -> CANCELLED. Made from a hold, or promoted from the waitlist.
+class Booking(Base):
+    __tablename__ = "polRail_bookings_2"
+    booking_id = Column(Integer, primary_key=True, index=True)
+    hold_id = Column(String(32), ForeignKey("polRail_seat_holds_2.hold_id"))
+    availability_id = Column(Integer, ForeignKey("polRail_train_seat_availability_2.availability_id"))
+    train_id = Column(Integer, ForeignKey("polRail_trains_2.train_id"), nullable=False)
+    berth_class_id = Column(Integer, ForeignKey("polRail_berth_classes_2.berth_class_id"), nullable=False)
+    travel_date = Column(Date, nullable=False)
+    seats = Column(Integer, nullable=False)
+    # Per-seat fare charged; NULL on bookings from before fares were stored
+    fare = Column(Numeric(10, 2, asdecimal=False))
+    contact_info = Column(String(200), nullable=False)
+    status = Column(String(20), nullable=False)
+    # Secret returned to the traveller only; required to cancel
+    token = Column(String(64))
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        # One booking per hold. Filtered, because promoted bookings have no
+        # hold and SQL Server lets a UNIQUE constraint hold only one NULL
+        Index(
+            "ux_bookings_hold_id", hold_id, unique=True,
+            mssql_where=hold_id.isnot(None),
+            postgresql_where=hold_id.isnot(None),
+            sqlite_where=hold_id.isnot(None)
+        ),
+    )
+
+
+# ------------------- Waitlist -------------------
+# Demand for a sold-out (train, date, class). Served by priority (lower
+# first), then arrival. WAITING -> PROMOTED (booking_id set) | CANCELLED
+class WaitlistEntry(Base):
+    __tablename__ = "polRail_waitlist_2"
+    waitlist_id = Column(Integer, primary_key=True, index=True)
+    availability_id = Column(Integer, ForeignKey("polRail_train_seat_availability_2.availability_id"), nullable=False)
+    train_id = Column(Integer, ForeignKey("polRail_trains_2.train_id"), nullable=False)
+    berth_class_id = Column(Integer, ForeignKey("polRail_berth_classes_2.berth_class_id"), nullable=False)
+    travel_date = Column(Date, nullable=False)
+    seats = Column(Integer, nullable=False)
+    # Per-seat fare quoted on joining; the promoted booking charges it
+    fare = Column(Numeric(10, 2, asdecimal=False))
+    priority = Column(Integer, nullable=False, default=5)
+    contact_info = Column(String(200), nullable=False)
+    status = Column(String(20), nullable=False)
+    booking_id = Column(Integer, ForeignKey("polRail_bookings_2.booking_id"))
+    # Secret returned on joining; required to read or leave the entry
+    token = Column(String(64))
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        # The promotion scan: WAITING entries of one row in service order
+        Index("ix_waitlist_queue", "availability_id", "status", "priority", "waitlist_id"),
+    )
+
+
+# ------------------- Change Log -------------------
+# One row per insert/update/delete on the polRail_*_2 tables, written by the
+# triggers in change_tracking.py. Workers poll it to refresh in-memory caches.
+class ChangeLog(Base):
+    __tablename__ = "polRail_change_log_2"
+    change_id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String(100), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    op = Column(String(1), nullable=False)  # I / U / D
+    changed_at = Column(DateTime, nullable=False, server_default=func.now())
+
 '''
 # ------------------- Passengers -------------------
 class Passenger(Base):
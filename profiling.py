@@ -0,0 +1,219 @@
+"""
+On-demand profiling of single search requests.
+
+A request is profiled when it sends X-Profile: <PROFILE_TOKEN>, or when
+PROFILE_SAMPLE_RATE picks it at random. The search then runs under cProfile
+and a stack sampler, and its SQL statements are recorded. Four files are
+written to PROFILE_DIR, named <timestamp>-<request id>:
+
+    <id>.pstats   cProfile stats            python -m pstats <file>
+    <id>.folded   sampled folded stacks     flamegraph.pl / speedscope
+    <id>.json     wall time, SQL statements and their timings
+    <id>.txt      top functions plus the SQL report (python profiling.py show <id>)
+
+When neither setting is on, ENABLED is False and requests skip the checks
+and capture entirely.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import query_budget
+
+logger = logging.getLogger("train_search")
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.002"))
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+def should_profile(request) -> bool:
+    if PROFILE_TOKEN and hmac.compare_digest(request.headers.get(PROFILE_HEADER, "").encode(), PROFILE_TOKEN.encode()):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+# ---------------- Stack sampler ----------------
+class StackSampler:
+    """Samples one thread's Python stack every interval into folded-stack counts."""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                key = ";".join(reversed(names))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+# ---------------- Capture ----------------
+def capture_id_for(request_id: str) -> str:
+    # Request ids can come from clients; keep them to safe file name characters
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", request_id or "")[:64]
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{safe or os.getpid()}"
+
+
+# cProfile allows one active profiler per interpreter
+_capture_lock = threading.Lock()
+
+
+@contextmanager
+def capture(name: str, capture_id: str, **meta):
+    """
+    Profile the block on the current thread and write the capture files.
+    Yields False (and profiles nothing) if another capture is running.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        yield False
+        return
+    try:
+        with _capture(name, capture_id, meta):
+            yield True
+    finally:
+        _capture_lock.release()
+
+
+@contextmanager
+def _capture(name, capture_id, meta):
+    outer = query_budget.current_recorder()
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    started = time.perf_counter()
+    error = None
+
+    with query_budget.record_queries() as recorder:
+        sampler.start()
+        profiler.enable()
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            profiler.disable()
+            sampler.stop()
+            wall = time.perf_counter() - started
+            # Keep X-Query-Count right when accounting is on as well
+            if outer is not None:
+                outer.statements.extend(recorder.statements)
+            try:
+                _write(name, capture_id, profiler, sampler, recorder, wall, error, meta)
+            except OSError:
+                logger.warning("could not write profile capture", exc_info=True)
+
+
+def _write(name, capture_id, profiler, sampler, recorder, wall, error, meta):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, capture_id)
+
+    profiler.dump_stats(base + ".pstats")
+    with open(base + ".folded", "w") as f:
+        f.write(sampler.folded())
+
+    summary = {
+        "id": capture_id,
+        "name": name,
+        "captured_at": datetime.now(timezone.utc).isoformat(),
+        "wall_seconds": round(wall, 6),
+        "error": error,
+        "samples": sum(sampler.stacks.values()),
+        "sql_count": recorder.count,
+        "sql_seconds": round(recorder.total_seconds, 6),
+        "sql": [
+            {"statement": " ".join(sql.split()), "ms": round(seconds * 1000, 3)}
+            for sql, _, seconds in recorder.statements
+        ],
+        **meta,
+    }
+    with open(base + ".json", "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+
+    out = io.StringIO()
+    pstats.Stats(base + ".pstats", stream=out).sort_stats("cumulative").print_stats(30)
+    with open(base + ".txt", "w") as f:
+        f.write(f"{name} {capture_id}: {wall * 1000:.1f} ms wall\n\n")
+        f.write(recorder.report() + "\n\n")
+        f.write(out.getvalue())
+
+    logger.info(
+        "profile captured",
+        extra={"profile_id": capture_id, "wall_seconds": summary["wall_seconds"], "sql_count": recorder.count}
+    )
+    _prune()
+
+
+def _prune():
+    """Keep the newest PROFILE_KEEP captures."""
+    summaries = sorted(
+        (e for e in os.scandir(PROFILE_DIR) if e.name.endswith(".json")),
+        key=lambda e: e.stat().st_mtime,
+        reverse=True
+    )
+    for entry in summaries[PROFILE_KEEP:]:
+        stem = entry.path[:-len(".json")]
+        for ext in (".json", ".pstats", ".folded", ".txt"):
+            try:
+                os.remove(stem + ext)
+            except FileNotFoundError:
+                pass
+
+
+# ---------------- CLI ----------------
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect profile captures")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List captures, newest first")
+    show = sub.add_parser("show", help="Print a capture's report")
+    show.add_argument("capture_id")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for entry in sorted(
+            (e for e in os.scandir(PROFILE_DIR) if e.name.endswith(".json")),
+            key=lambda e: e.stat().st_mtime, reverse=True
+        ):
+            with open(entry.path) as f:
+                s = json.load(f)
+            print(f"{s['id']}  {s['captured_at']}  {s['wall_seconds'] * 1000:8.1f} ms  {s['sql_count']:>4} sql  {s['name']}")
+    else:
+        with open(os.path.join(PROFILE_DIR, args.capture_id + ".txt")) as f:
+            print(f.read())
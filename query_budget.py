@@ -0,0 +1,100 @@
+"""
+Per-request SQL statement accounting.
+
+A before_cursor_execute / after_cursor_execute listener pair on every
+Engine times each statement and appends it to the recorder bound to the
+current context, if any. Outside a recording each listener is one
+ContextVar lookup.
+
+    with record_queries() as rec:
+        crud.search_trains(db, ...)
+    print(rec.count, rec.statements)
+
+    with assert_max_queries(12):
+        crud.search_trains(db, ...)
+
+With QUERY_ACCOUNTING=1 the app records every request and returns the
+count in an X-Query-Count header, so HTTP tests can hold endpoints to a
+ceiling too.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import os
+import time
+
+QUERY_ACCOUNTING = os.getenv("QUERY_ACCOUNTING", "0") == "1"
+QUERY_COUNT_HEADER = "X-Query-Count"
+
+_current: ContextVar["QueryRecorder | None"] = ContextVar("query_recorder", default=None)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.statements = []   # (sql, params, seconds)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_seconds(self):
+        return sum(s for _, _, s in self.statements)
+
+    def report(self):
+        lines = [f"{self.count} statements, {self.total_seconds * 1000:.1f} ms"]
+        for i, (sql, params, seconds) in enumerate(self.statements, 1):
+            lines.append(f"  {i:>3}. [{seconds * 1000:.2f} ms] {' '.join(sql.split())}")
+        return "\n".join(lines)
+
+
+# ---------------- Engine events ----------------
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorder = _current.get()
+    if recorder is not None:
+        starts = conn.info.get("query_start")
+        elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+        recorder.statements.append((statement, parameters, elapsed))
+
+
+# ---------------- Public API ----------------
+def start_recording() -> QueryRecorder:
+    """Bind a fresh recorder to the current context (one request)."""
+    recorder = QueryRecorder()
+    _current.set(recorder)
+    return recorder
+
+
+def current_recorder():
+    return _current.get()
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Fail if the block issues more than `limit` SQL statements."""
+    with record_queries() as recorder:
+        yield recorder
+    if recorder.count > limit:
+        raise QueryBudgetExceeded(f"query budget of {limit} exceeded: {recorder.report()}")
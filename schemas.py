@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import List
-from datetime import date, time
+from datetime import date, datetime, time
 from typing import Optional
 
 
@@ -38,6 +38,40 @@ class BookingRequest(BaseModel):
     passengers: List[PassengerInfo]
 
 
+class HoldRequest(BaseModel):
+    train_number: int
+    travel_date: date
+    travel_class: str
+    seats: int = Field(..., ge=1)
+    # The stops searched for, so the fare matches search; else the whole run
+    from_station: Optional[str] = None
+    to_station: Optional[str] = None
+
+
+class ConfirmHoldRequest(BaseModel):
+    contact_info: str
+    passengers: List[PassengerInfo]
+
+
+class WaitlistRequest(BaseModel):
+    train_number: int
+    travel_date: date
+    travel_class: str
+    seats: int = Field(..., ge=1)
+    contact_info: str
+    from_station: Optional[str] = None
+    to_station: Optional[str] = None
+
+
+class BookingRef(BaseModel):
+    booking_id: int
+    booking_token: str
+
+
+class CancelBookingsRequest(BaseModel):
+    bookings: List[BookingRef] = Field(..., min_length=1, max_length=500)
+
+
 # ---------- Response Models ----------
 
 class BookingSuccessResponse(BaseModel):
@@ -49,6 +83,9 @@ class BookingSuccessResponse(BaseModel):
     ticket_price: float
     passengers: int
     total_price: float
+    booking_id: Optional[int] = None
+    # Needed to cancel the booking
+    booking_token: Optional[str] = None
 
 
 class BookingFailureResponse(BaseModel):
@@ -59,6 +96,41 @@ class BookingFailureResponse(BaseModel):
     message: str
 
 
+class HoldResponse(BaseModel):
+    hold_id: str
+    train_number: int
+    travel_date: date
+    class_type: str
+    seats: int
+    # Per seat, as search quoted it; confirming charges this
+    ticket_price: float
+    expires_at: datetime
+
+
+class WaitlistResponse(BaseModel):
+    waitlist_id: int
+    train_number: int
+    travel_date: date
+    class_type: str
+    seats: int
+    # Per seat; charged if promoted
+    ticket_price: float
+    priority: int
+    status: str
+    # Place in the queue while WAITING
+    position: Optional[int] = None
+    # Needed to read or leave the entry; returned when joining only
+    token: Optional[str] = None
+    # Set once PROMOTED
+    booking_id: Optional[int] = None
+    booking_token: Optional[str] = None
+
+
+class CancelBookingsResponse(BaseModel):
+    cancelled: int
+    promoted: int
+
+
 
 class ClassAvailability(BaseModel):
     class_type: str
@@ -66,6 +138,8 @@ class ClassAvailability(BaseModel):
     booked: int
     available: int
     price: float
+    # Length of the waitlist for this class and date
+    waitlist: int = 0
 
 
 class TrainAvailability(BaseModel):
@@ -84,11 +158,36 @@ class TrainAvailability(BaseModel):
 class SearchResponse(BaseModel):
     onward: List[TrainAvailability]
     return_: List[TrainAvailability] = Field(..., alias="return")
+    # Opaque keyset cursors for more onward departures; pass back as ?cursor=
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
     class Config:
         populate_by_name = True
         allow_population_by_field_name = True   
 
+class StationSuggestion(BaseModel):
+    station_id: int
+    station_name: str
+    station_name_PL: str
+    station_id_code: str
+
+
+class OccupancyRow(BaseModel):
+    route_id: Optional[int] = None
+    train_id: Optional[int] = None
+    class_type: Optional[str] = None
+    travel_date: Optional[date] = None
+    sold: int
+    total_berths: int
+    load_factor: float
+
+
+class OccupancyResponse(BaseModel):
+    snapshot_at: datetime
+    rows: List[OccupancyRow]
+
+
 class RoundTripResponse(BaseModel):
     onward: List[TrainAvailability]
     return_trains: List[TrainAvailability]
@@ -0,0 +1,391 @@
+"""
+ORM-free read path for train search.
+
+The ORM path loads full Train, RouteStation, BerthClass and
+TrainSeatAvailability objects, each tracked in the session's identity map,
+and it issues several queries per candidate train. Search only reads a few
+columns of each. This path uses Core select()s with explicit column lists
+and gets plain rows back:
+
+  - candidate trains are a Bundle of four columns
+  - the boarding and alighting stops of every candidate come from one query
+  - the requested classes and their seats for the date come from one
+    query, plus one more only for classes without a row for that date
+
+Each of these is a fixed statement shape built with lambda_stmt(), so a
+request binds values into statements that were built, cache-keyed and
+compiled once per process; warm_statements() compiles the common shapes
+during warm-up. Trains picked by number, name or type come in as
+train_ids, which keeps those filters out of the shapes.
+
+Results are the same TrainAvailability models as before. SEARCH_CORE=0
+switches back to the ORM path. `python search_core.py bench` runs both
+paths on the same database and compares CPU time and allocations per
+request.
+"""
+from sqlalchemy import and_, func, lambda_stmt, or_, select
+from sqlalchemy.orm import Bundle, aliased
+from models import Train, RouteStation, Station, BerthClass, TrainSeatAvailability
+from schemas import TrainAvailability, ClassAvailability
+from datetime import date, time
+import fares
+import folding
+import os
+import warmup
+
+SEARCH_CORE = os.getenv("SEARCH_CORE", "1") not in ("0", "false", "no")
+
+# A candidate train as a plain row: .train_id, .train_name, .train_no, .train_type
+TRAIN = Bundle("train", Train.train_id, Train.train_name, Train.train_no, Train.train_type)
+
+_STATION_COLUMNS = (
+    Station.station_id, Station.station_name, Station.station_name_PL,
+    Station.station_id_code, Station.station_name_comb_PL,
+)
+_STOP_COLUMNS = (
+    RouteStation.train_id, RouteStation.station_id, RouteStation.stop_number,
+    RouteStation.arrival_time, RouteStation.departure_time, RouteStation.distance_from_start_km,
+)
+_CLASS_COLUMNS = (
+    BerthClass.train_id, BerthClass.berth_class_id, BerthClass.class_type,
+    BerthClass.total_berths, BerthClass.price,
+)
+_SEAT_COLUMNS = (
+    TrainSeatAvailability.berth_class_id, TrainSeatAvailability.available_seats,
+    TrainSeatAvailability.waitlist_count,
+)
+
+
+# ---------------- Candidates ----------------
+# Statements are lambda_stmt()s: each shape is built and cache-keyed once
+# per process, later calls only bind their values. The lambdas close over
+# plain values (id lists become expanding IN parameters); criteria that
+# differ between calls are added with += so each combination is one shape.
+_FROM_STOP = aliased(RouteStation)
+_TO_STOP = aliased(RouteStation)
+_FIRST_STOP = aliased(RouteStation)
+
+
+def routes(db, from_ids, to_ids):
+    """Routes stopping at one of from_ids and later at one of to_ids."""
+    return db.scalars(lambda_stmt(lambda: (
+        select(_FROM_STOP.route_id)
+        .join(_TO_STOP, _FROM_STOP.route_id == _TO_STOP.route_id)
+        .where(
+            _FROM_STOP.station_id.in_(from_ids),
+            _TO_STOP.station_id.in_(to_ids),
+            _FROM_STOP.stop_number < _TO_STOP.stop_number
+        )
+        .distinct()
+    ))).all()
+
+
+def _candidates(stmt, route_ids, running, train_ids):
+    """stmt narrowed to trains on route_ids, and in running / train_ids unless None."""
+    stmt += lambda s: s.where(Train.route_id.in_(route_ids))
+    if running is not None:
+        stmt += lambda s: s.where(Train.train_id.in_(running))
+    if train_ids is not None:
+        stmt += lambda s: s.where(Train.train_id.in_(train_ids))
+    return stmt
+
+
+def trains(db, route_ids, running=None, train_ids=None):
+    """Distinct TRAIN rows of the candidate trains."""
+    stmt = lambda_stmt(lambda: select(TRAIN).distinct())
+    return db.scalars(_candidates(stmt, route_ids, running, train_ids)).all()
+
+
+def departures(from_ids, route_ids, running=None, train_ids=None):
+    """
+    (TRAIN, departure_time) of the candidate trains where they are
+    boarded, like crud._boarding_stop; narrow it with before(), after()
+    or page().
+    """
+    stmt = lambda_stmt(lambda: (
+        select(TRAIN, RouteStation.departure_time)
+        .join_from(Train, RouteStation, RouteStation.train_id == Train.train_id)
+    ))
+    stmt = _candidates(stmt, route_ids, running, train_ids)
+    if len(from_ids) == 1:
+        station_id = from_ids[0]
+        stmt += lambda s: s.where(RouteStation.station_id == station_id)
+    else:
+        stmt += lambda s: s.where(
+            RouteStation.station_id.in_(from_ids),
+            RouteStation.stop_number == (
+                select(func.min(_FIRST_STOP.stop_number))
+                .where(_FIRST_STOP.train_id == RouteStation.train_id, _FIRST_STOP.station_id.in_(from_ids))
+                .scalar_subquery()
+            )
+        )
+    return stmt
+
+
+def before(db, stmt, t, limit):
+    """Up to limit departures before t, latest first."""
+    return db.execute(stmt + (lambda s: (
+        s.where(RouteStation.departure_time < t)
+        .order_by(RouteStation.departure_time.desc(), Train.train_id.desc())
+        .limit(limit)
+    ))).all()
+
+
+def after(db, stmt, t, limit):
+    """Up to limit departures at or after t, earliest first."""
+    return db.execute(stmt + (lambda s: (
+        s.where(RouteStation.departure_time >= t)
+        .order_by(RouteStation.departure_time.asc(), Train.train_id.asc())
+        .limit(limit)
+    ))).all()
+
+
+def page(db, stmt, t, train_id, forward, limit):
+    """Up to limit departures after (forward) or before the keyset (t, train_id), nearest first."""
+    if forward:
+        return db.execute(stmt + (lambda s: (
+            s.where(or_(
+                RouteStation.departure_time > t,
+                and_(RouteStation.departure_time == t, Train.train_id > train_id)
+            ))
+            .order_by(RouteStation.departure_time.asc(), Train.train_id.asc())
+            .limit(limit)
+        ))).all()
+    return db.execute(stmt + (lambda s: (
+        s.where(or_(
+            RouteStation.departure_time < t,
+            and_(RouteStation.departure_time == t, Train.train_id < train_id)
+        ))
+        .order_by(RouteStation.departure_time.desc(), Train.train_id.desc())
+        .limit(limit)
+    ))).all()
+
+
+def stations(db):
+    """Every station as a row with the attributes match_station() reads."""
+    return db.execute(lambda_stmt(lambda: select(*_STATION_COLUMNS))).all()
+
+
+# ---------------- Stops ----------------
+def trips(db, train_ids, from_ids, to_ids):
+    """
+    train_id -> (boarding, alighting) stop rows, picked like
+    crud._trip_stops: the first stop in from_ids, then the first later stop
+    in to_ids. Trains that do not run from -> to are left out.
+    """
+    from_ids, to_ids = set(from_ids), set(to_ids)
+    station_ids = list(from_ids | to_ids)
+    rows = db.execute(lambda_stmt(lambda: (
+        select(*_STOP_COLUMNS)
+        .where(RouteStation.train_id.in_(train_ids), RouteStation.station_id.in_(station_ids))
+        .order_by(RouteStation.train_id, RouteStation.stop_number)
+    ))).all()
+
+    boarding, found = {}, {}
+    for stop in rows:
+        train_id = stop.train_id
+        if train_id in found:
+            continue
+        if train_id not in boarding:
+            if stop.station_id in from_ids:
+                boarding[train_id] = stop
+        elif stop.station_id in to_ids and stop.stop_number > boarding[train_id].stop_number:
+            found[train_id] = (boarding[train_id], stop)
+    return found
+
+
+# ---------------- Classes and seats ----------------
+def _seats(db, berth_class_ids, travel_date):
+    """berth_class_id -> (available_seats, waitlist_count), like crud.find_availability."""
+    seats = {
+        r.berth_class_id: (r.available_seats, r.waitlist_count)
+        for r in db.execute(lambda_stmt(lambda: (
+            select(*_SEAT_COLUMNS).where(
+                TrainSeatAvailability.berth_class_id.in_(berth_class_ids),
+                TrainSeatAvailability.travel_date == travel_date
+            )
+        )))
+    }
+
+    # No row for the date: any row of the class, as find_availability does
+    missing = [i for i in berth_class_ids if i not in seats]
+    if missing:
+        for r in db.execute(lambda_stmt(lambda: (
+            select(*_SEAT_COLUMNS).where(TrainSeatAvailability.availability_id.in_(
+                select(func.min(TrainSeatAvailability.availability_id))
+                .where(TrainSeatAvailability.berth_class_id.in_(missing))
+                .group_by(TrainSeatAvailability.berth_class_id)
+            ))
+        ))):
+            seats[r.berth_class_id] = (r.available_seats, r.waitlist_count)
+    return seats
+
+
+def classes(db, train_ids, travel_date, class_name=None, first_only=False):
+    """train_id -> [ClassAvailability] for classes matching class_name (all when None)."""
+    stmt = lambda_stmt(lambda: (
+        select(*_CLASS_COLUMNS)
+        .where(BerthClass.train_id.in_(train_ids))
+        .order_by(BerthClass.train_id, BerthClass.berth_class_id)
+    ))
+    if class_name:
+        pattern = f"%{class_name}%"
+        stmt += lambda s: s.where(func.lower(BerthClass.class_type).like(func.lower(pattern)))
+
+    picked = {}
+    for row in db.execute(stmt):
+        rows = picked.setdefault(row.train_id, [])
+        if not (first_only and rows):
+            rows.append(row)
+
+    seats = _seats(db, [r.berth_class_id for rows in picked.values() for r in rows], travel_date) if picked else {}
+    result = {}
+    for train_id, rows in picked.items():
+        result[train_id] = []
+        for bc in rows:
+            available, waitlist = seats.get(bc.berth_class_id, (0, 0))
+            result[train_id].append(ClassAvailability(
+                class_type=bc.class_type,
+                total_berths=bc.total_berths,
+                booked=bc.total_berths - available,
+                available=available,
+                price=bc.price,
+                waitlist=waitlist
+            ))
+    return result
+
+
+# ---------------- Results ----------------
+def results(db, candidates, from_ids, to_ids, names, travel_date, class_name, pending_fares,
+            first_only=True, require_class=False):
+    """
+    TrainAvailability for each candidate that runs from -> to, in
+    candidate order. first_only keeps one matching class per train (the
+    onward rule); require_class drops trains with no matching class (the
+    return rule).
+    """
+    train_ids = [t.train_id for t in candidates]
+    if not train_ids:
+        return []
+    stops = trips(db, train_ids, from_ids, to_ids)
+    by_train = classes(db, list(stops), travel_date, class_name, first_only) if stops else {}
+
+    result = []
+    for train in candidates:
+        if train.train_id not in stops:
+            continue
+        rs_from, rs_to = stops[train.train_id]
+        train_classes = by_train.get(train.train_id, [])
+        if require_class and not train_classes:
+            continue
+
+        km = fares.trip_km(rs_from, rs_to)
+        pending_fares.extend((c, km) for c in train_classes)
+        result.append(TrainAvailability(
+            train_id=train.train_id,
+            train_name=train.train_name,
+            train_number=str(train.train_no),
+            train_type=train.train_type,
+            from_station=names[rs_from.station_id],
+            to_station=names[rs_to.station_id],
+            travel_date=travel_date,
+            departure_time=rs_from.departure_time,
+            arrival_time=rs_to.arrival_time,
+            departure_date=travel_date,
+            classes=train_classes
+        ))
+    return result
+
+
+# ---------------- Warm-up ----------------
+@warmup.task
+def warm_statements(db):
+    """Compile the statements of a plain one-way search, so the first request does not."""
+    folding.lookup_station(db, "0")
+    if not SEARCH_CORE:
+        return
+    stmt = departures([0], [0])
+    routes(db, [0], [0])
+    before(db, stmt, time(), 1)
+    after(db, stmt, time(), 1)
+    trips(db, [0], [0], [0])
+    classes(db, [0], date.today(), "class")
+    _seats(db, [0], date.today())
+
+
+# ---------------- Benchmark ----------------
+def bench(db, params, rounds=200):
+    """Run crud.search_trains through both paths; compare CPU and memory per request."""
+    from fastapi.encoders import jsonable_encoder
+    import crud
+    import gc
+    import search_core   # the module crud reads the switch from, also when run as a script
+    import time
+    import tracemalloc
+
+    saved = search_core.SEARCH_CORE
+    outputs, rows = {}, []
+    try:
+        for name, core in (("orm", False), ("core", True)):
+            search_core.SEARCH_CORE = core
+            outputs[name] = jsonable_encoder(crud.search_trains(db=db, **params))   # warm caches
+            db.expunge_all()
+
+            gc.collect()
+            started = time.process_time()
+            for _ in range(rounds):
+                crud.search_trains(db=db, **params)
+                db.expunge_all()
+            cpu = (time.process_time() - started) / rounds
+
+            # held: still referenced when the request returns (results, identity map)
+            tracemalloc.start()
+            result = crud.search_trains(db=db, **params)
+            held, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del result
+            db.expunge_all()
+            rows.append((name, cpu * 1e3, peak / 1024, held / 1024))
+    finally:
+        search_core.SEARCH_CORE = saved
+
+    print(f"{'path':<8}{'cpu ms/req':>12}{'peak KiB':>12}{'held KiB':>12}")
+    for name, cpu_ms, peak_kib, held_kib in rows:
+        print(f"{name:<8}{cpu_ms:>12.2f}{peak_kib:>12.1f}{held_kib:>12.1f}")
+    (_, orm_cpu, orm_peak, _), (_, core_cpu, core_peak, _) = rows
+    print(f"core saves {(1 - core_cpu / orm_cpu) * 100:.0f}% CPU and {(1 - core_peak / orm_peak) * 100:.0f}% peak memory per request")
+    print("results identical" if outputs["orm"] == outputs["core"] else "RESULTS DIFFER")
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Compare the Core and ORM search paths")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--from-station", default="Krakow")
+    parser.add_argument("--to-station", default="Warsaw")
+    parser.add_argument("--travel-date", default=date.today().isoformat())
+    parser.add_argument("--return-date")
+    parser.add_argument("--train-class", default="2nd")
+    parser.add_argument("--time", default="10:00")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    params = {
+        "from_station_name": args.from_station,
+        "to_station_name": args.to_station,
+        "travel_date": date.fromisoformat(args.travel_date),
+        "train_class": args.train_class,
+        "time": args.time,
+        "return_date": date.fromisoformat(args.return_date) if args.return_date else None,
+        "return_time": args.time if args.return_date else None,
+    }
+    db = SessionLocal()
+    try:
+        bench(db, params, args.rounds)
+    except Exception as e:
+        sys.exit(f"bench failed: {e}")
+    finally:
+        db.close()
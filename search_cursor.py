@@ -0,0 +1,78 @@
+"""
+Opaque keyset cursors for paging through departures.
+
+A cursor records the resolved search: station ids and Polish names, the
+candidate route ids, and the train ids left after any name/number/type
+filter. It also records the (departure_time, train_id) boundary and the
+paging direction. The next page therefore skips station and route
+resolution and runs one index range scan on
+RouteStation(station_id, departure_time, train_id).
+
+Cursors are signed with SEARCH_CURSOR_SECRET, so clients cannot edit them
+to shape queries. Without it a random secret is generated at start-up:
+cursors then stop working across restarts, and across workers unless
+gunicorn preloads the app. Decoded id lists are capped at
+SEARCH_CURSOR_MAX_IDS all the same.
+"""
+from datetime import date, time
+from fastapi import HTTPException
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+
+logger = logging.getLogger("train_search")
+
+SEARCH_CURSOR_SECRET = os.getenv("SEARCH_CURSOR_SECRET", "").encode()
+if not SEARCH_CURSOR_SECRET:
+    SEARCH_CURSOR_SECRET = secrets.token_bytes(32)
+    logger.warning("SEARCH_CURSOR_SECRET is not set, using a random secret; cursors will not survive a restart")
+SEARCH_CURSOR_MAX_IDS = int(os.getenv("SEARCH_CURSOR_MAX_IDS", "1000"))
+SEARCH_CURSOR_MAX_LENGTH = int(os.getenv("SEARCH_CURSOR_MAX_LENGTH", "65536"))
+_SIG_BYTES = 12
+_ID_LISTS = ("from_ids", "to_ids", "route_ids", "train_ids")
+
+NEXT = "n"
+PREV = "p"
+
+
+def _sign(body: bytes) -> bytes:
+    return hmac.new(SEARCH_CURSOR_SECRET, body, hashlib.sha256).digest()[:_SIG_BYTES]
+
+
+def encode(state: dict, direction: str, departure_time: time, train_id: int) -> str:
+    payload = {
+        **state,
+        "dir": direction,
+        "t": departure_time.isoformat(),
+        "id": train_id,
+    }
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(_sign(body) + body).decode().rstrip("=")
+
+
+def decode(cursor: str) -> dict:
+    try:
+        if len(cursor) > SEARCH_CURSOR_MAX_LENGTH:
+            raise ValueError("cursor too long")
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sig, body = raw[:_SIG_BYTES], raw[_SIG_BYTES:]
+        if not hmac.compare_digest(sig, _sign(body)):
+            raise ValueError("bad signature")
+        payload = json.loads(body)
+        payload["t"] = time.fromisoformat(payload["t"])
+        payload["travel_date"] = date.fromisoformat(payload["travel_date"])
+        if payload["dir"] not in (NEXT, PREV):
+            raise ValueError("bad direction")
+        for key in _ID_LISTS:
+            ids = payload.get(key, [])
+            if len(ids) > SEARCH_CURSOR_MAX_IDS or not all(type(i) is int for i in ids):
+                raise ValueError(f"bad {key}")
+        if len(payload["names"]) > SEARCH_CURSOR_MAX_IDS:
+            raise ValueError("bad names")
+        return payload
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid or expired cursor")
@@ -0,0 +1,123 @@
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import uuid
+
+# ---------------- Settings ----------------
+# Fraction of requests whose per-search INFO/DEBUG lines are kept (0.0 - 1.0).
+# WARNING and above are never sampled out.
+SEARCH_LOG_SAMPLE_RATE = float(os.getenv("SEARCH_LOG_SAMPLE_RATE", "1.0"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# ---------------- Per-request context ----------------
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+sampled_var: ContextVar[bool] = ContextVar("log_sampled", default=True)
+
+
+def start_request(request_id: str | None = None) -> str:
+    """Bind a correlation id and a sampling decision to the current request."""
+    rid = request_id or uuid.uuid4().hex
+    request_id_var.set(rid)
+    sampled_var.set(random.random() < SEARCH_LOG_SAMPLE_RATE)
+    return rid
+
+
+# ---------------- Filters / Formatter ----------------
+class RequestContextFilter(logging.Filter):
+    """Attaches the request id and drops low-level lines of unsampled requests."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        if record.levelno < logging.WARNING and not sampled_var.get():
+            return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # Attributes every LogRecord has; anything else came in through extra=
+    _RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self._RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc_info"] = record.exc_text
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the request thread: a full queue drops the record."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def prepare(self, record):
+        # Merge args and render the traceback here (args may be mutated after
+        # we return); JSON encoding and the write happen on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# ---------------- Setup / Teardown ----------------
+_listener: QueueListener | None = None
+
+
+def setup_logging(stream=None):
+    """
+    Route the train_search logger through a bounded queue to a background
+    listener thread that does the JSON formatting and the stderr write.
+    Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    sink = logging.StreamHandler(stream)
+    sink.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = _DroppingQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+
+    logger = logging.getLogger("train_search")
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, sink, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,274 @@
+"""
+Seat holds with expiry.
+
+place_hold() takes seats with one conditional UPDATE
+(available_seats >= n) and records a HELD row, all in one short
+transaction. Held seats are therefore already missing from
+available_seats, and search results reflect them with no extra work.
+No row lock outlives the request.
+Under bursts, the API routes holds through booking_writer, which
+group-commits many of them per transaction. Seats given back go to the
+waitlist first (waitlist.promote) in the same transaction.
+
+Each worker keeps a heap of the holds it created, ordered by expiry. A
+scheduler thread sleeps until the earliest one is due, then releases every
+due hold in one batched transaction. A periodic DB sweep catches holds
+whose worker died or restarted.
+"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from models import SeatHold, Booking, TrainSeatAvailability
+from database import SessionLocal
+import heapq
+import logging
+import os
+import threading
+import uuid
+import waitlist
+
+logger = logging.getLogger("train_search")
+
+HOLD_TTL_SECONDS = int(os.getenv("HOLD_TTL_SECONDS", "600"))
+MAX_SEATS_PER_HOLD = int(os.getenv("MAX_SEATS_PER_HOLD", "10"))
+HOLD_SWEEP_INTERVAL = float(os.getenv("HOLD_SWEEP_INTERVAL", "30"))
+HOLD_RELEASE_BATCH = int(os.getenv("HOLD_RELEASE_BATCH", "500"))
+
+HELD = "HELD"
+CONFIRMED = "CONFIRMED"
+RELEASED = "RELEASED"
+EXPIRED = "EXPIRED"
+
+
+class HoldError(Exception):
+    """Raised with a user-facing message; .status_code maps to the HTTP status."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------- Place / confirm / release ----------------
+def new_hold(availability_id, train_id, berth_class_id, travel_date, seats, fare=None,
+             ttl_seconds=HOLD_TTL_SECONDS) -> SeatHold:
+    """An unsaved HELD row; shared with the group-commit writer."""
+    return SeatHold(
+        hold_id=uuid.uuid4().hex,
+        availability_id=availability_id,
+        train_id=train_id,
+        berth_class_id=berth_class_id,
+        travel_date=travel_date,
+        seats=seats,
+        fare=fare,
+        status=HELD,
+        expires_at=_utcnow() + timedelta(seconds=ttl_seconds),
+        created_at=_utcnow(),
+    )
+
+
+def hold_row(hold: SeatHold) -> dict:
+    """Column values of an unsaved hold, for bulk inserts."""
+    return {c.key: getattr(hold, c.key) for c in SeatHold.__table__.columns}
+
+
+def place_hold(db, availability: TrainSeatAvailability, travel_date, seats: int, fare=None,
+               ttl_seconds: int = HOLD_TTL_SECONDS) -> SeatHold:
+    if seats < 1 or seats > MAX_SEATS_PER_HOLD:
+        raise HoldError(400, f"Seats must be between 1 and {MAX_SEATS_PER_HOLD}")
+
+    taken = db.execute(
+        update(TrainSeatAvailability)
+        .where(
+            TrainSeatAvailability.availability_id == availability.availability_id,
+            TrainSeatAvailability.available_seats >= seats
+        )
+        .values(available_seats=TrainSeatAvailability.available_seats - seats)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not taken:
+        db.rollback()
+        raise HoldError(409, f"Only {availability.available_seats} seats are available")
+
+    hold = new_hold(
+        availability.availability_id, availability.train_id, availability.berth_class_id,
+        travel_date, seats, fare, ttl_seconds
+    )
+    db.add(hold)
+    db.commit()
+    scheduler.schedule(hold.hold_id, hold.expires_at)
+    return hold
+
+
+def confirm_hold(db, hold_id: str, contact_info: str) -> Booking:
+    """HELD -> CONFIRMED plus a booking row. The seats were already taken by the hold."""
+    hold = db.get(SeatHold, hold_id)
+    if hold is None:
+        raise HoldError(404, f"Hold '{hold_id}' not found")
+
+    confirmed = db.execute(
+        update(SeatHold)
+        .where(SeatHold.hold_id == hold_id, SeatHold.status == HELD, SeatHold.expires_at > _utcnow())
+        .values(status=CONFIRMED)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not confirmed:
+        db.rollback()
+        raise HoldError(410, f"Hold '{hold_id}' has expired or is no longer active")
+
+    booking = Booking(
+        hold_id=hold_id,
+        availability_id=hold.availability_id,
+        train_id=hold.train_id,
+        berth_class_id=hold.berth_class_id,
+        travel_date=hold.travel_date,
+        seats=hold.seats,
+        fare=hold.fare,
+        contact_info=contact_info,
+        status=CONFIRMED,
+        token=waitlist.new_token(),
+    )
+    db.add(booking)
+    db.commit()
+    return booking
+
+
+def release_hold(db, hold_id: str):
+    if not _release(db, [hold_id], RELEASED, due_only=False):
+        raise HoldError(404, f"Hold '{hold_id}' not found or no longer active")
+
+
+def release_holds(db, hold_ids) -> int:
+    """Give back the seats of still-HELD holds in one transaction; returns how many."""
+    return _release(db, list(hold_ids), RELEASED, due_only=False)
+
+
+def _release(db, hold_ids, new_status, due_only=True):
+    """
+    Give the seats of still-HELD holds back in one transaction. hold_ids
+    None means every due hold (sweep). Returns the number released.
+    """
+    now = _utcnow()
+    q = select(SeatHold.hold_id).where(SeatHold.status == HELD)
+    if due_only:
+        q = q.where(SeatHold.expires_at <= now)
+    if hold_ids is not None:
+        q = q.where(SeatHold.hold_id.in_(hold_ids))
+    candidates = db.execute(q.limit(HOLD_RELEASE_BATCH).with_for_update()).scalars().all()
+    if not candidates:
+        db.rollback()
+        return 0
+
+    # Only holds this UPDATE moved out of HELD give seats back: the lock above
+    # is not honoured everywhere (SQLite), so a confirm may have won meanwhile
+    rows = _mark_released(db, candidates, new_status)
+    if not rows:
+        db.rollback()
+        return 0
+
+    per_row = {}
+    for _, availability_id, seats in rows:
+        per_row[availability_id] = per_row.get(availability_id, 0) + seats
+    table = TrainSeatAvailability.__table__
+    db.execute(
+        table.update()
+        .where(table.c.availability_id == bindparam("_id"))
+        .values(available_seats=table.c.available_seats + bindparam("_seats")),
+        [{"_id": aid, "_seats": seats} for aid, seats in per_row.items()]
+    )
+    waitlist.promote(db, per_row)
+    db.commit()
+    return len(rows)
+
+
+def _mark_released(db, hold_ids, new_status):
+    """HELD -> new_status; (hold_id, availability_id, seats) of the holds actually changed."""
+    moved = (
+        update(SeatHold)
+        .where(SeatHold.hold_id.in_(hold_ids), SeatHold.status == HELD)
+        .values(status=new_status)
+        .execution_options(synchronize_session=False)
+    )
+    if db.get_bind().dialect.update_returning:
+        # OUTPUT on SQL Server; fine here, the holds table has no triggers
+        return db.execute(moved.returning(SeatHold.hold_id, SeatHold.availability_id, SeatHold.seats)).all()
+
+    rows = []
+    for hold_id in hold_ids:
+        if db.execute(moved.where(SeatHold.hold_id == hold_id)).rowcount:
+            rows.append(db.execute(
+                select(SeatHold.hold_id, SeatHold.availability_id, SeatHold.seats).where(SeatHold.hold_id == hold_id)
+            ).one())
+    return rows
+
+
+# ---------------- Expiry scheduler ----------------
+class HoldExpiryScheduler:
+    def __init__(self):
+        self._heap = []              # (expires_at, hold_id)
+        self._cond = threading.Condition()
+        self._stopped = True
+        self._thread = None
+        self._next_sweep = None
+
+    def schedule(self, hold_id, expires_at):
+        with self._cond:
+            heapq.heappush(self._heap, (expires_at, hold_id))
+            # Wake the thread only if this hold is now the earliest
+            if self._heap[0][1] == hold_id:
+                self._cond.notify()
+
+    def _due(self):
+        now = _utcnow()
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < HOLD_RELEASE_BATCH:
+            due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                due = self._due()
+                sweep = _utcnow() >= self._next_sweep
+                if not due and not sweep:
+                    wait = (self._next_sweep - _utcnow()).total_seconds()
+                    if self._heap:
+                        wait = min(wait, (self._heap[0][0] - _utcnow()).total_seconds())
+                    self._cond.wait(max(wait, 0.01))
+                    continue
+
+            db = SessionLocal()
+            try:
+                released = _release(db, due, EXPIRED) if due else 0
+                if sweep:
+                    self._next_sweep = _utcnow() + timedelta(seconds=HOLD_SWEEP_INTERVAL)
+                    released += _release(db, None, EXPIRED)
+                if released:
+                    logger.info("seat holds expired", extra={"released": released})
+            except SQLAlchemyError:
+                db.rollback()
+                logger.warning("seat hold expiry failed, retrying on next sweep", exc_info=True)
+            finally:
+                db.close()
+
+    def start(self):
+        with self._cond:
+            if not self._stopped:
+                return
+            self._stopped = False
+            self._next_sweep = _utcnow()
+        self._thread = threading.Thread(target=self._run, name="seat-hold-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+
+scheduler = HoldExpiryScheduler()
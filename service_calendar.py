@@ -0,0 +1,226 @@
+"""
+Service-day calendar.
+
+Every train with calendar rows gets one Python int bitmask: bit i set means
+it runs on (base + i days). Weekly patterns are expanded over each rule's
+date range, and single-day exceptions set or clear bits. Trains without
+calendar rows run every day, as before. A train with exceptions but no
+weekly rules still runs every day except its cancellations; its mask is
+inverted and holds the days it does not run.
+
+search_trains asks running_trains(route_ids, day) before it queries any
+train rows. That call is one dict lookup and one bit test per candidate
+train.
+"""
+from datetime import date
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from models import Train, TrainServiceCalendar, TrainServiceException
+import change_tracking
+import logging
+import threading
+import warmup
+
+logger = logging.getLogger("train_search")
+
+
+# ---------------- Mask building ----------------
+def _weekly_mask(days_of_week: str, start: date, end: date, base: int) -> int:
+    """Bits for every day in [start, end] whose weekday is set in days_of_week (Mon..Sun)."""
+    n = (end - start).days + 1
+    if n <= 0:
+        return 0
+    first = start.weekday()
+    week = "".join(days_of_week[(first + i) % 7] for i in range(7))
+    days = (week * (n // 7 + 1))[:n]
+    # bit 0 is `start`, so reverse before parsing
+    return int(days[::-1], 2) << (start.toordinal() - base)
+
+
+def build_train_mask(rules, exceptions):
+    """
+    rules: [(days_of_week, start, end)], exceptions: [(service_date, runs)]
+    -> (base, mask, inverted). Without rules the train runs every day, so
+    the mask is inverted: set bits are the days it does not run.
+    """
+    dates = [r[1] for r in rules] + [e[0] for e in exceptions]
+    base = min(dates).toordinal()
+    inverted = not rules
+    mask = 0
+    for days_of_week, start, end in rules:
+        mask |= _weekly_mask(days_of_week.ljust(7, "0"), start, end, base)
+    # date order, so the last exception for a day wins
+    for service_date, runs in sorted(exceptions):
+        bit = 1 << (service_date.toordinal() - base)
+        mask = mask | bit if runs != inverted else mask & ~bit
+    return base, mask, inverted
+
+
+# ---------------- Calendar ----------------
+class ServiceCalendar:
+    """Immutable snapshot; refreshes build a new one and swap it in."""
+
+    def __init__(self, route_trains, masks, calendar_rows, exception_rows, version=0):
+        self.route_trains = route_trains        # route_id -> (train_id, ...)
+        self.masks = masks                      # train_id -> (base_ordinal, mask, inverted)
+        self.calendar_rows = calendar_rows      # calendar_id -> train_id
+        self.exception_rows = exception_rows    # exception_id -> train_id
+        self.version = version
+
+    def runs_on(self, train_id: int, day: date) -> bool:
+        entry = self.masks.get(train_id)
+        if entry is None:
+            return True
+        base, mask, inverted = entry
+        i = day.toordinal() - base
+        return (i >= 0 and (mask >> i) & 1 == 1) != inverted
+
+    def running_trains(self, route_ids, day: date):
+        """
+        Train ids on route_ids that run on day, or None when no calendar
+        removes any of them (callers can then skip the extra filter).
+        """
+        if not self.masks:
+            return None
+        candidates = [t for r in route_ids for t in self.route_trains.get(r, ())]
+        running = [t for t in candidates if self.runs_on(t, day)]
+        if len(running) == len(candidates):
+            return None
+        return running
+
+
+def _load(db: Session, train_ids=None):
+    """Rules and exceptions grouped by train, optionally for some trains only."""
+    cal_q = select(
+        TrainServiceCalendar.calendar_id, TrainServiceCalendar.train_id,
+        TrainServiceCalendar.days_of_week, TrainServiceCalendar.start_date, TrainServiceCalendar.end_date,
+    )
+    exc_q = select(
+        TrainServiceException.exception_id, TrainServiceException.train_id,
+        TrainServiceException.service_date, TrainServiceException.runs,
+    )
+    if train_ids is not None:
+        cal_q = cal_q.where(TrainServiceCalendar.train_id.in_(train_ids))
+        exc_q = exc_q.where(TrainServiceException.train_id.in_(train_ids))
+
+    rules, exceptions, calendar_rows, exception_rows = {}, {}, {}, {}
+    for cid, tid, dow, start, end in db.execute(cal_q):
+        rules.setdefault(tid, []).append((dow, start, end))
+        calendar_rows[cid] = tid
+    for eid, tid, service_date, runs in db.execute(exc_q):
+        exceptions.setdefault(tid, []).append((service_date, bool(runs)))
+        exception_rows[eid] = tid
+
+    masks = {
+        tid: build_train_mask(rules.get(tid, []), exceptions.get(tid, []))
+        for tid in set(rules) | set(exceptions)
+    }
+    return masks, calendar_rows, exception_rows
+
+
+def _build(db: Session) -> ServiceCalendar:
+    version = change_tracking.current_version(db)
+    route_trains = {}
+    for tid, rid in db.execute(select(Train.train_id, Train.route_id)):
+        route_trains.setdefault(rid, []).append(tid)
+    try:
+        masks, calendar_rows, exception_rows = _load(db)
+    except SQLAlchemyError:
+        # Calendar tables not created yet: every train runs every day
+        db.rollback()
+        logger.warning("service calendar tables missing, calendar filtering disabled")
+        masks, calendar_rows, exception_rows = {}, {}, {}
+    return ServiceCalendar(
+        {r: tuple(ts) for r, ts in route_trains.items()}, masks, calendar_rows, exception_rows, version
+    )
+
+
+# ---------------- Process-wide calendar ----------------
+_calendar = None
+_calendar_lock = threading.Lock()
+
+
+def get_service_calendar(db: Session) -> ServiceCalendar:
+    global _calendar
+    if _calendar is None:
+        with _calendar_lock:
+            if _calendar is None:
+                _calendar = _build(db)
+    return _calendar
+
+
+@warmup.task
+def warm_service_calendar(db: Session):
+    get_service_calendar(db)
+
+
+# ---------------- Incremental refresh ----------------
+class _ServiceCalendarRefresh:
+    tables = {
+        Train.__tablename__,
+        TrainServiceCalendar.__tablename__,
+        TrainServiceException.__tablename__,
+    }
+
+    @property
+    def version(self):
+        return _calendar.version if _calendar is not None else None
+
+    def apply_changes(self, db: Session, changes, version: int):
+        global _calendar
+        current = _calendar
+        if current is None:
+            return
+
+        route_trains = current.route_trains
+        train_ids = set(changes.get(Train.__tablename__, ()))
+        if train_ids:
+            # Move changed trains between routes (or drop deleted ones)
+            by_route = {r: [t for t in ts if t not in train_ids] for r, ts in route_trains.items()}
+            for tid, rid in db.execute(select(Train.train_id, Train.route_id).where(Train.train_id.in_(train_ids))):
+                by_route.setdefault(rid, []).append(tid)
+            route_trains = {r: tuple(ts) for r, ts in by_route.items() if ts}
+
+        # Trains whose masks need rebuilding: owners before and after the change
+        affected = set(train_ids)
+        for cid in changes.get(TrainServiceCalendar.__tablename__, ()):
+            affected.add(current.calendar_rows.get(cid))
+        for eid in changes.get(TrainServiceException.__tablename__, ()):
+            affected.add(current.exception_rows.get(eid))
+        if changes.get(TrainServiceCalendar.__tablename__):
+            affected.update(db.execute(
+                select(TrainServiceCalendar.train_id)
+                .where(TrainServiceCalendar.calendar_id.in_(changes[TrainServiceCalendar.__tablename__]))
+            ).scalars())
+        if changes.get(TrainServiceException.__tablename__):
+            affected.update(db.execute(
+                select(TrainServiceException.train_id)
+                .where(TrainServiceException.exception_id.in_(changes[TrainServiceException.__tablename__]))
+            ).scalars())
+        affected.discard(None)
+
+        masks, calendar_rows, exception_rows = dict(current.masks), dict(current.calendar_rows), dict(current.exception_rows)
+        if affected:
+            new_masks, new_cal, new_exc = _load(db, affected)
+            for tid in affected:
+                masks.pop(tid, None)
+            masks.update(new_masks)
+            calendar_rows = {c: t for c, t in calendar_rows.items() if t not in affected}
+            calendar_rows.update(new_cal)
+            exception_rows = {e: t for e, t in exception_rows.items() if t not in affected}
+            exception_rows.update(new_exc)
+
+        updated = ServiceCalendar(route_trains, masks, calendar_rows, exception_rows, version)
+        with _calendar_lock:
+            if _calendar is current:
+                _calendar = updated
+
+    def reload(self, db: Session):
+        global _calendar
+        fresh = _build(db)
+        with _calendar_lock:
+            _calendar = fresh
+
+
+change_tracking.refresher.register(_ServiceCalendarRefresh())
@@ -0,0 +1,76 @@
+"""
+Single-flight request coalescing.
+
+The first request for a key runs the computation. Requests that arrive with
+the same key while it is still running wait for it and get the same result,
+or the same exception. The entry is removed as soon as the leader finishes,
+so nothing is kept afterwards; caching is a separate concern.
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger("train_search")
+
+SEARCH_COALESCING = os.getenv("SEARCH_COALESCING", "1") not in ("0", "false", "no")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Run fn() once per key among concurrent callers and share the outcome."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.info(
+                    "coalesced concurrent requests",
+                    extra={"flight": self.name, "waiters": call.waiters, "failed": call.error is not None}
+                )
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+search_flight = SingleFlight("search_trains")
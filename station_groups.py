@@ -0,0 +1,102 @@
+"""
+City-level station groups.
+
+"Warszawa" usually means any Warsaw station, not just the one that has
+"Warszawa" as an alias. A group maps a folded city key to the stations of
+that city. Searches given a group key search all of its stations at once.
+
+Groups are derived from the station rows. A key becomes a group when it is
+the exact name, Polish name or alias of some station, and at least one
+other station's name or Polish name starts with it as a whole word, e.g.
+"warszawa" -> Warszawa Centralna, Warszawa Wschodnia. Groups from
+STATION_GROUPS_FILE, a JSON object of {"City": ["code or name", ...]},
+are added on top and replace derived groups with the same key.
+
+Groups are built from the station index's rows. They are rebuilt whenever
+the change-log refresher swaps in a new index.
+"""
+from sqlalchemy.orm import Session
+from folding import fold, StationRef
+import json
+import logging
+import os
+import station_index
+import threading
+import warmup
+
+logger = logging.getLogger("train_search")
+
+STATION_GROUPS_FILE = os.getenv("STATION_GROUPS_FILE")
+
+
+class StationGroups:
+    def __init__(self, rows, configured=None):
+        rows = list(rows)
+        exact, names, by_word = {}, {}, {}
+        for row in rows:
+            sid = row["station_id"]
+            variants = [row["station_name"], row["station_name_PL"], row["station_id_code"]]
+            if row["station_name_comb_PL"]:
+                variants += row["station_name_comb_PL"].split("|")
+            for text in variants:
+                key = fold(text)
+                if key:
+                    exact.setdefault(key, set()).add(sid)
+                    names.setdefault(key, text.strip())
+            for name in (row["station_name"], row["station_name_PL"]):
+                words = fold(name).split()
+                if len(words) > 1:
+                    by_word.setdefault(words[0], set()).add(sid)
+
+        refs = {r["station_id"]: StationRef(r["station_id"], r["station_name_PL"]) for r in rows}
+        self.groups = {}     # key -> (display name, [StationRef] by id)
+        for key, members in by_word.items():
+            stations = exact.get(key, set()) | members
+            if key in exact and len(stations) > 1:
+                self.groups[key] = (names[key], [refs[s] for s in sorted(stations)])
+
+        for city, entries in (configured or {}).items():
+            stations = set()
+            for entry in entries:
+                stations |= exact.get(fold(entry), set())
+            if stations:
+                self.groups[fold(city)] = (city, [refs[s] for s in sorted(stations)])
+
+    def lookup(self, text: str):
+        """(display name, [StationRef]) when text names a group, else None."""
+        return self.groups.get(fold(text))
+
+
+def _configured():
+    if not STATION_GROUPS_FILE:
+        return {}
+    try:
+        with open(STATION_GROUPS_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.warning("station groups file unreadable, using derived groups only", exc_info=True)
+        return {}
+
+
+# ---------------- Process-wide groups ----------------
+# (StationIndex they were built from, StationGroups)
+_groups = (None, None)
+_groups_lock = threading.Lock()
+
+
+def get_station_groups(db: Session) -> StationGroups:
+    global _groups
+    index = station_index.get_station_index(db)
+    built_from, groups = _groups
+    if built_from is not index:
+        with _groups_lock:
+            built_from, groups = _groups
+            if built_from is not index:
+                groups = StationGroups(index.rows.values(), _configured())
+                _groups = (index, groups)
+    return groups
+
+
+@warmup.task
+def warm_station_groups(db: Session):
+    get_station_groups(db)
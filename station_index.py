@@ -0,0 +1,173 @@
+from sqlalchemy.orm import Session
+from models import Station
+from folding import fold
+import change_tracking
+import warmup
+import threading
+
+# Max suggestions kept per trie node (upper bound for ?limit=)
+MAX_SUGGESTIONS = 20
+
+# Ranking tiers: lower is better
+TIER_NAME = 0
+TIER_CODE = 1
+TIER_ALIAS = 2
+TIER_WORD = 3   # match on an inner word, e.g. "centr" -> "Warszawa Centralna"
+
+_COLUMNS = ("station_id", "station_name", "station_name_PL", "station_name_comb_PL", "station_id_code")
+
+
+# ---------------- Prefix trie ----------------
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.top = []
+
+
+class StationIndex:
+    """
+    In-memory prefix trie over station names, codes and aliases.
+
+    Every node keeps its best MAX_SUGGESTIONS stations pre-ranked, so a
+    lookup is a walk of len(q) nodes plus a slice. Instances are never
+    mutated after construction; refreshes build a new one and swap it in.
+    """
+
+    def __init__(self, rows, version: int = 0):
+        # station_id -> row dict; kept so a refresh can rebuild from deltas
+        self.rows = {r["station_id"]: r for r in rows}
+        self.version = version
+        self.root = _Node()
+        candidates = {}
+
+        for row in self.rows.values():
+            entry = {
+                "station_id": row["station_id"],
+                "station_name": row["station_name"],
+                "station_name_PL": row["station_name_PL"],
+                "station_id_code": row["station_id_code"],
+            }
+            keys = [
+                (row["station_name"], TIER_NAME),
+                (row["station_name_PL"], TIER_NAME),
+                (row["station_id_code"], TIER_CODE),
+            ]
+            if row["station_name_comb_PL"]:
+                keys += [(alias, TIER_ALIAS) for alias in row["station_name_comb_PL"].split("|")]
+
+            for text, tier in keys:
+                key = fold(text)
+                if not key:
+                    continue
+                self._add(candidates, key, tier, entry)
+
+                # inner words, so "centr" finds "Warszawa Centralna"
+                words = key.split()
+                for i in range(1, len(words)):
+                    self._add(candidates, " ".join(words[i:]), TIER_WORD, entry)
+
+        # Rank once at build time: best score per station, then shortest key
+        for node, best in candidates.items():
+            ranked = sorted(best.values(), key=lambda c: c[0])
+            node.top = [entry for _, entry in ranked[:MAX_SUGGESTIONS]]
+
+    @property
+    def size(self):
+        return len(self.rows)
+
+    def _add(self, candidates, key, tier, entry):
+        score = (len(key), tier, entry["station_name_PL"])
+        node = self.root
+        for ch in key:
+            node = node.children.setdefault(ch, _Node())
+            best = candidates.setdefault(node, {})
+            current = best.get(entry["station_id"])
+            if current is None or score < current[0]:
+                best[entry["station_id"]] = (score, entry)
+
+    def suggest(self, q: str, limit: int = 10):
+        node = self.root
+        for ch in fold(q):
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return node.top[:limit]
+
+    def with_changes(self, changed_rows, changed_ids, version: int):
+        """New index with changed_ids replaced by changed_rows (missing ones were deleted)."""
+        rows = dict(self.rows)
+        for station_id in changed_ids:
+            rows.pop(station_id, None)
+        for row in changed_rows:
+            rows[row["station_id"]] = row
+        return StationIndex(rows.values(), version)
+
+
+def _load_rows(db: Session, ids=None):
+    query = db.query(*(getattr(Station, c) for c in _COLUMNS))
+    if ids is not None:
+        query = query.filter(Station.station_id.in_(ids))
+    return [dict(zip(_COLUMNS, r)) for r in query.all()]
+
+
+# ---------------- Process-wide index ----------------
+_index = None
+_index_lock = threading.Lock()
+
+
+def _build(db: Session) -> StationIndex:
+    # Read the version first: a change racing the load is re-applied later
+    version = change_tracking.current_version(db)
+    return StationIndex(_load_rows(db), version)
+
+
+def get_station_index(db: Session) -> StationIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _build(db)
+    return _index
+
+
+@warmup.task
+def warm_station_index(db: Session):
+    get_station_index(db)
+
+
+def reset_station_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+# ---------------- Incremental refresh ----------------
+class _StationIndexRefresh:
+    tables = {Station.__tablename__}
+
+    @property
+    def version(self):
+        return _index.version if _index is not None else None
+
+    def apply_changes(self, db: Session, changes, version: int):
+        global _index
+        current = _index
+        if current is None:
+            return  # built lazily from fresh data on first use
+        ids = changes[Station.__tablename__]
+        # Build off to the side, then swap: readers keep using the old trie
+        updated = current.with_changes(_load_rows(db, ids), ids, version)
+        with _index_lock:
+            if _index is current:
+                _index = updated
+
+    def reload(self, db: Session):
+        global _index
+        fresh = _build(db)
+        with _index_lock:
+            _index = fresh
+
+
+change_tracking.refresher.register(_StationIndexRefresh())
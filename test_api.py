@@ -1,10 +1,19 @@
 import pytest
 import requests
+import json
+import time
 from datetime import date, timedelta
 
 # Base URL for the API
 BASE_URL = "http://localhost:8000"
 
+# SQL statement ceilings of a warm search on the Core read path, as measured.
+# They cover a full window of 6 trains, so one statement per train (N+1)
+# breaks them.
+ONE_WAY_QUERY_BUDGET = 7
+ROUND_TRIP_QUERY_BUDGET = 13
+SUGGEST_QUERY_BUDGET = 0
+
 class TestTrainSearchAPI:
     
     def test_mandatory_fields_validation(self):
@@ -409,6 +418,915 @@ class TestTrainSearchAPI:
         # Both should give same result
         assert response1.status_code == response2.status_code
 
+    def test_request_id_header(self):
+        """Test that the correlation id is echoed back, or generated when missing"""
+        params = {
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00"
+        }
+        response = requests.get(f"{BASE_URL}/search_trains", params=params,
+                                headers={"X-Request-ID": "test-correlation-id"})
+        assert response.headers["X-Request-ID"] == "test-correlation-id"
+
+        response = requests.get(f"{BASE_URL}/search_trains", params=params)
+        assert response.headers.get("X-Request-ID")
+
+    def test_cursor_pagination(self):
+        """Test next/prev cursors page through departures without overlap"""
+        params = {
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00",
+            "page_size": 1
+        }
+        response = requests.get(f"{BASE_URL}/search_trains", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        seen = [t["departure_time"] for t in data["onward"]]
+
+        cursor = data["next_cursor"]
+        while cursor:
+            response = requests.get(f"{BASE_URL}/search_trains", params={**params, "cursor": cursor})
+            assert response.status_code == 200
+            page = response.json()
+            assert page["prev_cursor"]
+            times = [t["departure_time"] for t in page["onward"]]
+            assert not set(times) & set(seen)
+            assert times == sorted(times) and (not seen or not times or times[0] >= seen[-1])
+            seen += times
+            cursor = page["next_cursor"]
+
+    def test_invalid_cursor(self):
+        """Test tampered cursors are rejected"""
+        response = requests.get(f"{BASE_URL}/search_trains", params={
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00",
+            "cursor": "not-a-cursor"
+        })
+        assert response.status_code == 400
+
+    def test_msgpack_negotiation(self):
+        """Test MessagePack responses carry the same data as JSON"""
+        msgpack = pytest.importorskip("msgpack")
+        params = {
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00"
+        }
+        as_json = requests.get(f"{BASE_URL}/search_trains", params=params)
+        as_msgpack = requests.get(f"{BASE_URL}/search_trains", params=params,
+                                  headers={"Accept": "application/msgpack"})
+        assert as_msgpack.status_code == 200
+        assert as_msgpack.headers["Content-Type"] == "application/msgpack"
+        assert msgpack.unpackb(as_msgpack.content) == as_json.json()
+
+    def test_polish_l_stroke_folding(self):
+        """Test Ł/ł fold to L/l, so 'Lodz' finds 'Łódź'"""
+        responses = [
+            requests.get(f"{BASE_URL}/search_trains", params={
+                "from_station": name,
+                "to_station": "Warsaw",
+                "travel_date": "2024-01-15",
+                "train_class": "2nd",
+                "time": "10:00"
+            })
+            for name in ["Łódź", "Lodz", "LÓDŹ"]
+        ]
+        assert len({r.status_code for r in responses}) == 1
+        for r in responses:
+            if r.status_code == 404:
+                assert "From station" not in r.json()["detail"]
+
+    def test_city_station_group(self):
+        """Test a city name searches all of its stations, merged by departure"""
+        response = requests.get(f"{BASE_URL}/search_trains", params={
+            "from_station": "Warszawa",
+            "to_station": "Krakow",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00"
+        })
+        assert response.status_code == 200
+        onward = response.json()["onward"]
+        assert onward
+        assert all(t["from_station"].startswith("Warszawa") for t in onward)
+        departures = [t["departure_time"] for t in onward]
+        assert departures == sorted(departures)
+
+    def test_profile_requires_token(self):
+        """Test an unauthorized X-Profile header does not trigger a capture"""
+        response = requests.get(f"{BASE_URL}/search_trains", params={
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00"
+        }, headers={"X-Profile": "not-the-token"})
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+
+    def test_concurrent_identical_searches(self):
+        """Test identical concurrent searches all get the same answer"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def search(from_station):
+            return requests.get(f"{BASE_URL}/search_trains", params={
+                "from_station": from_station,
+                "to_station": "Warsaw",
+                "travel_date": "2024-01-15",
+                "train_class": "2nd",
+                "time": "10:00"
+            })
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            ok = list(pool.map(search, ["Krakow", "KRAKOW", " krakow "] * 4))
+            missing = list(pool.map(search, ["NoSuchStation"] * 4))
+
+        assert {r.status_code for r in ok} == {200}
+        assert len({r.text for r in ok}) == 1
+        assert {r.status_code for r in missing} == {404}
+
+    def test_coalescing_keeps_validation(self):
+        """Test a search that fails validation never shares a valid one's result"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def search(time):
+            return requests.get(f"{BASE_URL}/search_trains", params={
+                "from_station": "Krakow",
+                "to_station": "Warsaw",
+                "travel_date": "2024-01-15",
+                "train_class": "2nd",
+                "time": time
+            })
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(search, ["06:00", " 06:00"] * 4))
+
+        assert [r.status_code for r in responses] == [200, 400] * 4
+
+class TestQueryBudget:
+    """
+    Checked in-process with query_budget.assert_max_queries, against the
+    database the server uses (DATABASE_URL or .env). Each search runs once
+    first, so lazily built caches are not counted.
+    """
+
+    @pytest.fixture
+    def db(self):
+        import search_core
+        from database import SessionLocal
+        if not search_core.SEARCH_CORE:
+            pytest.skip("budgets are for the Core read path; the ORM fallback queries per train")
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _search(self, db, **extra):
+        import crud
+        return crud.search_trains(
+            db,
+            from_station_name="Krakow",
+            to_station_name="Warsaw",
+            travel_date=date(2024, 1, 15),
+            train_class="2nd",
+            time="10:00",
+            **extra
+        )
+
+    def test_one_way_search_budget(self, db):
+        """Test one-way search with a time filter stays within its statement budget"""
+        from query_budget import assert_max_queries
+        self._search(db)
+        with assert_max_queries(ONE_WAY_QUERY_BUDGET):
+            result = self._search(db)
+        assert result["onward"]
+
+    def test_round_trip_search_budget(self, db):
+        """Test round trip search stays within its statement budget"""
+        from query_budget import assert_max_queries
+        legs = dict(return_date=date(2024, 1, 16), return_time="18:00")
+        self._search(db, **legs)
+        with assert_max_queries(ROUND_TRIP_QUERY_BUDGET):
+            result = self._search(db, **legs)
+        assert result["onward"] and result["return"]
+
+    def test_suggest_budget(self, db):
+        """Test station suggestions never scan the database per keystroke"""
+        import station_index
+        from query_budget import assert_max_queries
+        station_index.get_station_index(db).suggest("K", 10)
+        with assert_max_queries(SUGGEST_QUERY_BUDGET):
+            station_index.get_station_index(db).suggest("Kr", 10)
+
+
+class TestSearchCore:
+    """
+    The Core read path (SEARCH_CORE) must answer exactly like the ORM path.
+    Both run in-process against the database the server uses (DATABASE_URL
+    or .env).
+    """
+
+    SEARCHES = [
+        {"from_station_name": "Krakow", "to_station_name": "Warsaw", "train_class": "2nd", "time": "10:00"},
+        {"from_station_name": "Krakow", "to_station_name": "Gdansk", "train_class": "1st", "time": "06:00",
+         "travel_date": date(2024, 1, 16)},
+        {"from_station_name": "warszawa", "to_station_name": "GDANSK", "train_class": "2nd", "time": "23:00"},
+        {"from_station_name": "Krakow", "to_station_name": "Gdansk", "train_class": "2nd", "time": "10:00",
+         "train_type": "IC", "train_name": "Express 9"},
+        {"from_station_name": "Krakow", "to_station_name": "Gdansk", "train_class": "2nd", "time": "10:00",
+         "return_date": date(2024, 1, 16), "return_time": "12:00", "return_train_class": "1st"},
+        {"from_station_name": "Warsaw", "to_station_name": "Krakow", "train_class": "2nd", "time": "14:00",
+         "travel_date": date(2024, 1, 17), "return_date": date(2024, 1, 17), "return_time": "20:00"},
+    ]
+
+    @pytest.fixture
+    def db(self):
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _search(self, db, monkeypatch, core, **params):
+        import crud
+        import search_core
+        from fastapi.encoders import jsonable_encoder
+        monkeypatch.setattr(search_core, "SEARCH_CORE", core)
+        params.setdefault("travel_date", date(2024, 1, 15))
+        return jsonable_encoder(crud.search_trains(db, **params))
+
+    @pytest.mark.parametrize("params", SEARCHES)
+    def test_core_matches_orm(self, db, monkeypatch, params):
+        """Test the Core read path returns the same trains, classes, prices and cursors as the ORM path"""
+        orm = self._search(db, monkeypatch, False, **params)
+        core = self._search(db, monkeypatch, True, **params)
+        assert orm["onward"]
+        assert core == orm
+
+    def test_core_pages_match_orm(self, db, monkeypatch):
+        """Test paging forward and back through cursors gives the same pages on both paths"""
+        params = self.SEARCHES[1]
+        orm = self._search(db, monkeypatch, False, **params)
+        core = self._search(db, monkeypatch, True, **params)
+        pages = 0
+        while orm["next_cursor"]:
+            assert core == orm
+            cursor = orm["next_cursor"]
+            orm = self._search(db, monkeypatch, False, cursor=cursor, **params)
+            core = self._search(db, monkeypatch, True, cursor=cursor, **params)
+            pages += 1
+        assert core == orm
+        assert pages > 0
+
+        cursor = orm["prev_cursor"]
+        assert cursor
+        orm = self._search(db, monkeypatch, False, cursor=cursor, **params)
+        assert self._search(db, monkeypatch, True, cursor=cursor, **params) == orm
+        assert orm["onward"]
+
+    def test_cached_statements_take_new_values(self, db, monkeypatch):
+        """Test Core's cached lambda statements bind each search's own values, in any order"""
+        expected = [self._search(db, monkeypatch, False, **params) for params in self.SEARCHES]
+        pages = [
+            (cursor, self._search(db, monkeypatch, False, cursor=cursor, **self.SEARCHES[1]))
+            for cursor in (expected[1]["next_cursor"], expected[1]["prev_cursor"]) if cursor
+        ]
+        assert pages
+
+        # Every shape has been cached by the first pass; later passes must not replay its values
+        order = list(range(len(self.SEARCHES)))
+        for i in order + order[::-1] + order[::2] + order[1::2]:
+            assert self._search(db, monkeypatch, True, **self.SEARCHES[i]) == expected[i]
+            for cursor, page in pages:
+                assert self._search(db, monkeypatch, True, cursor=cursor, **self.SEARCHES[1]) == page
+
+
+class TestChangeTrackingAPI:
+
+    """
+    Timetable rows are edited straight in the database the server uses
+    (DATABASE_URL or .env); the server's refresher has to pick them up from
+    the change log within a few refresh intervals.
+    """
+
+    params = {
+        "from_station": "Krakow",
+        "to_station": "Warsaw",
+        "travel_date": "2024-01-15",
+        "train_class": "2nd",
+        "time": "10:00"
+    }
+
+    def _train_numbers(self):
+        response = requests.get(f"{BASE_URL}/search_trains", params=self.params)
+        assert response.status_code == 200
+        return [train["train_number"] for train in response.json()["onward"]]
+
+    def _wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "change was not picked up by the server"
+            time.sleep(0.2)
+
+    def test_cancellation_reaches_search(self):
+        """Test a cancelled run drops out of search and comes back when the cancellation is removed"""
+        from database import SessionLocal
+        from models import Train, TrainServiceException
+        train_number = self._train_numbers()[0]
+
+        db = SessionLocal()
+        try:
+            train = db.query(Train).filter(Train.train_no == train_number).one()
+            cancellation = TrainServiceException(
+                train_id=train.train_id, service_date=date(2024, 1, 15), runs=False
+            )
+            db.add(cancellation)
+            db.commit()
+            try:
+                self._wait_for(lambda: train_number not in self._train_numbers())
+            finally:
+                db.delete(cancellation)
+                db.commit()
+            self._wait_for(lambda: train_number in self._train_numbers())
+        finally:
+            db.close()
+
+
+class TestServiceCalendar:
+    """Masks are pure functions of the rules, so these run without the server."""
+
+    def _calendar(self, rules=(), exceptions=()):
+        from service_calendar import ServiceCalendar, build_train_mask
+        masks = {1: build_train_mask(list(rules), list(exceptions))}
+        return ServiceCalendar({10: (1, 2)}, masks, {}, {})
+
+    def test_weekly_rule(self):
+        """Test a weekday rule runs Monday to Friday inside its date range only"""
+        # 2024-01-15 is a Monday
+        calendar = self._calendar(rules=[("1111100", date(2024, 1, 15), date(2024, 1, 28))])
+        week = [calendar.runs_on(1, date(2024, 1, 15) + timedelta(days=i)) for i in range(7)]
+        assert week == [True] * 5 + [False] * 2
+        assert calendar.runs_on(1, date(2024, 1, 22))
+        assert not calendar.runs_on(1, date(2024, 1, 14))
+        assert not calendar.runs_on(1, date(2024, 1, 29))
+
+    def test_exceptions_override_rule(self):
+        """Test exceptions cancel a rule day and add an extra run"""
+        calendar = self._calendar(
+            rules=[("1111100", date(2024, 1, 15), date(2024, 1, 28))],
+            exceptions=[(date(2024, 1, 17), False), (date(2024, 1, 20), True)]
+        )
+        assert calendar.runs_on(1, date(2024, 1, 16))
+        assert not calendar.runs_on(1, date(2024, 1, 17))
+        assert calendar.runs_on(1, date(2024, 1, 20))
+        assert not calendar.runs_on(1, date(2024, 1, 21))
+
+    def test_exceptions_without_rules(self):
+        """Test a train with only exceptions runs every day except its cancellations"""
+        calendar = self._calendar(exceptions=[(date(2024, 1, 17), False), (date(2024, 1, 18), True)])
+        assert calendar.runs_on(1, date(2023, 12, 31))
+        assert calendar.runs_on(1, date(2024, 1, 16))
+        assert not calendar.runs_on(1, date(2024, 1, 17))
+        assert calendar.runs_on(1, date(2024, 1, 18))
+        assert calendar.runs_on(1, date(2025, 6, 1))
+
+    def test_running_trains(self):
+        """Test running_trains filters by day and returns None when nothing is removed"""
+        calendar = self._calendar(rules=[("1111100", date(2024, 1, 15), date(2024, 1, 28))])
+        # train 2 has no calendar rows and runs every day
+        assert calendar.running_trains([10], date(2024, 1, 20)) == [2]
+        assert calendar.running_trains([10], date(2024, 1, 15)) is None
+        assert calendar.running_trains([99], date(2024, 1, 20)) is None
+
+        from service_calendar import ServiceCalendar
+        assert ServiceCalendar({10: (1, 2)}, {}, {}, {}).running_trains([10], date(2024, 1, 20)) is None
+
+
+class TestFares:
+    """Tariff arithmetic against DEFAULT_TARIFF; runs without the server."""
+
+    @pytest.fixture
+    def tariff(self):
+        from fares import DEFAULT_TARIFF, Tariff
+        return Tariff(DEFAULT_TARIFF)
+
+    def test_distance_bands(self, tariff):
+        """Test each km is charged at the rate of the band it falls in"""
+        fares = tariff.quote([50, 100, 200, 400], [1.0] * 4, [0] * 4).tolist()
+        # 50 x 0.40 = 20, 100 x 0.30 = 30 up to 150 km, 150 x 0.22 = 33 up to 300 km, then 0.16
+        assert fares == [20.0, 35.0, 61.0, 99.0]
+
+    def test_min_fare(self, tariff):
+        """Test short trips are charged the minimum fare"""
+        assert tariff.quote([0, 10, 25], [1.0] * 3, [0] * 3).tolist() == [8.0, 8.0, 10.0]
+
+    def test_class_multipliers(self, tariff):
+        """Test class multipliers match class names case-insensitively, defaulting to 1.0"""
+        assert tariff.multiplier("1st") == 1.5
+        assert tariff.multiplier("First Class") == 1.5
+        assert tariff.multiplier("EXECUTIVE") == 1.8
+        assert tariff.multiplier("2nd") == 1.0
+        assert tariff.multiplier("sleeper") == 1.0
+        assert tariff.quote([100], [tariff.multiplier("1st")], [0]).tolist() == [52.5]
+
+    def test_unknown_distance_keeps_flat_price(self, tariff):
+        """Test trips without a distance keep the flat class price"""
+        assert tariff.quote([-1, 100], [1.5, 1.5], [200, 200]).tolist() == [200.0, 52.5]
+
+    def test_beyond_max_km(self, tariff):
+        """Test distances past max_km keep charging the last band's rate"""
+        at_max, beyond = tariff.quote([tariff.max_km, tariff.max_km + 100], [1.0, 1.0], [0, 0]).tolist()
+        assert beyond == pytest.approx(at_max + 100 * 0.16)
+
+    def test_fare_matches_search_pricing(self):
+        """Test fare() quotes the same price price_classes() gives search results"""
+        import fares
+        from schemas import ClassAvailability
+        trips = [("1st", 200, 120), ("2nd", 100, 7), ("2nd", 100, -1)]
+        pending = [
+            (ClassAvailability(class_type=class_type, total_berths=50, booked=0, available=50, price=price), km)
+            for class_type, price, km in trips
+        ]
+        fares.price_classes(pending)
+        assert [c.price for c, _ in pending] == [fares.fare(km, c, p) for c, p, km in trips]
+
+class TestStationSuggestAPI:
+
+    def test_suggest_prefix(self):
+        """Test station suggestions for a name prefix"""
+        response = requests.get(f"{BASE_URL}/stations/suggest", params={"q": "Krak"})
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data, list)
+        for station in data:
+            for field in ["station_id", "station_name", "station_name_PL", "station_id_code"]:
+                assert field in station
+
+    def test_suggest_polish_letters_folded(self):
+        """Test that Polish letters (including ł) fold to ASCII"""
+        response1 = requests.get(f"{BASE_URL}/stations/suggest", params={"q": "Lodz"})
+        response2 = requests.get(f"{BASE_URL}/stations/suggest", params={"q": "Łódź"})
+        assert response1.status_code == 200
+        assert response1.json() == response2.json()
+
+    def test_suggest_limit(self):
+        """Test that limit caps the number of suggestions"""
+        response = requests.get(f"{BASE_URL}/stations/suggest", params={"q": "W", "limit": 1})
+        assert response.status_code == 200
+        assert len(response.json()) <= 1
+
+    def test_suggest_no_match(self):
+        """Test prefix that matches no station"""
+        response = requests.get(f"{BASE_URL}/stations/suggest", params={"q": "XYZXYZ"})
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_suggest_missing_query(self):
+        """Test that q is mandatory"""
+        response = requests.get(f"{BASE_URL}/stations/suggest")
+        assert response.status_code == 422
+
+class TestOccupancyAPI:
+
+    def test_occupancy_grouped(self):
+        """Test occupancy aggregates by route and date"""
+        response = requests.get(f"{BASE_URL}/analytics/occupancy", params={"group_by": "route_id,travel_date"})
+        assert response.status_code in [200, 503]
+        if response.status_code == 200:
+            data = response.json()
+            assert "snapshot_at" in data
+            for row in data["rows"]:
+                assert row["sold"] <= row["total_berths"]
+                assert 0 <= row["load_factor"] <= 1
+
+    def test_occupancy_filters(self):
+        """Test occupancy with date and class filters"""
+        response = requests.get(f"{BASE_URL}/analytics/occupancy", params={
+            "group_by": "train_id,class_type",
+            "date_from": "2024-01-15",
+            "date_to": "2024-01-16",
+            "class_type": "1st"
+        })
+        assert response.status_code in [200, 503]
+        if response.status_code == 200:
+            for row in response.json()["rows"]:
+                assert "1st" in row["class_type"]
+
+    def test_occupancy_invalid_group_by(self):
+        """Test unknown group_by columns are rejected"""
+        response = requests.get(f"{BASE_URL}/analytics/occupancy", params={"group_by": "passenger"})
+        assert response.status_code == 400
+
+
+class TestSeatHoldAPI:
+
+    def _train_number(self):
+        response = requests.get(f"{BASE_URL}/search_trains", params={
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00"
+        })
+        assert response.status_code == 200
+        return response.json()["onward"][0]["train_number"]
+
+    def _hold(self, seats=1):
+        return requests.post(f"{BASE_URL}/holds", json={
+            "train_number": self._train_number(),
+            "travel_date": "2024-01-15",
+            "travel_class": "2nd",
+            "seats": seats
+        })
+
+    def test_hold_and_confirm(self):
+        """Test a hold can be confirmed into a booking exactly once, at the fare search quoted"""
+        response = requests.get(f"{BASE_URL}/search_trains", params={
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00"
+        })
+        train = response.json()["onward"][0]
+        quoted = train["classes"][0]["price"]
+
+        response = requests.post(f"{BASE_URL}/holds", json={
+            "train_number": train["train_number"],
+            "travel_date": "2024-01-15",
+            "travel_class": "2nd",
+            "seats": 2,
+            "from_station": "Krakow",
+            "to_station": "Warsaw"
+        })
+        assert response.status_code == 201
+        hold = response.json()
+        assert hold["seats"] == 2
+        assert hold["ticket_price"] == quoted
+        assert "expires_at" in hold
+
+        body = {
+            "contact_info": "jan@example.com",
+            "passengers": [
+                {"name": "Jan", "gender": "M", "age": 30},
+                {"name": "Anna", "gender": "F", "age": 28}
+            ]
+        }
+        response = requests.post(f"{BASE_URL}/holds/{hold['hold_id']}/confirm", json=body)
+        assert response.status_code == 200
+        booking = response.json()
+        assert booking["passengers"] == 2
+        assert booking["ticket_price"] == quoted
+        assert booking["total_price"] == round(quoted * 2, 2)
+
+        response = requests.post(f"{BASE_URL}/holds/{hold['hold_id']}/confirm", json=body)
+        assert response.status_code == 410
+
+    def test_hold_pins_reads_to_primary(self):
+        """Test a hold pins the client to the primary, so its next search shows the seats it took"""
+        params = {
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": "2024-01-15",
+            "train_class": "2nd",
+            "time": "10:00"
+        }
+
+        def available(client, **headers):
+            response = client.get(f"{BASE_URL}/search_trains", params=params, headers=headers)
+            assert response.status_code == 200
+            train = response.json()["onward"][0]
+            return train["train_number"], train["classes"][0]["available"]
+
+        train_number, before = available(requests, **{"X-Read-Primary": "1"})
+        client = requests.Session()
+        response = client.post(f"{BASE_URL}/holds", json={
+            "train_number": train_number,
+            "travel_date": "2024-01-15",
+            "travel_class": "2nd",
+            "seats": 1
+        })
+        assert response.status_code == 201
+        try:
+            assert client.cookies.get("pin_primary") == "1"
+            assert available(client) == (train_number, before - 1)
+        finally:
+            client.delete(f"{BASE_URL}/holds/{response.json()['hold_id']}")
+
+    def test_hold_release(self):
+        """Test releasing a hold gives its seats back once"""
+        response = self._hold()
+        assert response.status_code == 201
+        hold_id = response.json()["hold_id"]
+
+        assert requests.delete(f"{BASE_URL}/holds/{hold_id}").status_code == 204
+        assert requests.delete(f"{BASE_URL}/holds/{hold_id}").status_code == 404
+
+    def test_hold_too_many_seats(self):
+        """Test holds cannot take more seats than are available"""
+        response = self._hold(seats=10000)
+        assert response.status_code in [400, 409]
+
+    def test_hold_unknown_train(self):
+        """Test holding seats on a non-existent train"""
+        response = requests.post(f"{BASE_URL}/holds", json={
+            "train_number": 999999,
+            "travel_date": "2024-01-15",
+            "travel_class": "2nd",
+            "seats": 1
+        })
+        assert response.status_code == 404
+
+    def test_hold_stops_not_on_train(self):
+        """Test a hold priced for stops the train does not run between"""
+        response = requests.post(f"{BASE_URL}/holds", json={
+            "train_number": self._train_number(),
+            "travel_date": "2024-01-15",
+            "travel_class": "2nd",
+            "seats": 1,
+            "from_station": "Warsaw",
+            "to_station": "Krakow"
+        })
+        assert response.status_code == 404
+
+    def test_hold_date_without_seats(self):
+        """Test holds only take seats of the requested date, never another day's"""
+        response = requests.post(f"{BASE_URL}/holds", json={
+            "train_number": self._train_number(),
+            "travel_date": "2031-06-01",
+            "travel_class": "2nd",
+            "seats": 1
+        })
+        assert response.status_code == 404
+
+    def test_concurrent_holds(self):
+        """Test a burst of holds on one train gets a distinct hold each"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._train_number()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda _: self._hold(), range(16)))
+
+        held = [r.json()["hold_id"] for r in responses if r.status_code == 201]
+        assert {r.status_code for r in responses} <= {201, 409}
+        assert len(set(held)) == len(held)
+        for hold_id in held:
+            requests.delete(f"{BASE_URL}/holds/{hold_id}")
+
+    def test_availability_stream(self):
+        """Test the live stream starts with the current seats of each watched key"""
+        key = f"{self._train_number()}:2024-01-15:2nd"
+        with requests.get(f"{BASE_URL}/availability/stream", params={"watch": key}, stream=True, timeout=10) as response:
+            assert response.status_code == 200
+            assert response.headers["Content-Type"].startswith("text/event-stream")
+            lines = response.iter_lines(decode_unicode=True)
+            assert next(lines) == "event: availability"
+            data = json.loads(next(lines).removeprefix("data: "))
+        assert data["class_type"] == "2nd Class"
+        assert data["available"] >= 0
+        assert data["waitlist"] >= 0
+
+    def test_availability_stream_invalid_key(self):
+        """Test malformed watch keys are rejected"""
+        response = requests.get(f"{BASE_URL}/availability/stream", params={"watch": "not-a-key"})
+        assert response.status_code == 400
+
+
+class TestWaitlistAPI:
+
+    TRAVEL_DATE = "2024-01-17"
+
+    def _first_class(self):
+        response = requests.get(f"{BASE_URL}/search_trains", params={
+            "from_station": "Krakow",
+            "to_station": "Warsaw",
+            "travel_date": self.TRAVEL_DATE,
+            "train_class": "1st",
+            "time": "10:00"
+        })
+        assert response.status_code == 200
+        train = response.json()["onward"][0]
+        return train["train_number"], train["classes"][0]
+
+    def _post(self, path, seats, **extra):
+        train_number, _ = self._first_class()
+        return requests.post(f"{BASE_URL}{path}", json={
+            "train_number": train_number,
+            "travel_date": self.TRAVEL_DATE,
+            "travel_class": "1st",
+            "seats": seats,
+            **extra
+        })
+
+    def test_waitlist_requires_sold_out(self):
+        """Test the waitlist only takes entries that cannot be seated now"""
+        response = self._post("/waitlist", 1, contact_info="jan@example.com")
+        assert response.status_code == 409
+
+    def test_cancellation_promotes_waitlist(self):
+        """Test cancelling a booking promotes the waitlist and keeps its length current"""
+        _, seats = self._first_class()
+        holds, left = [], seats["available"]
+        # Sell out, keeping the last two seats in their own hold
+        while left > 2:
+            take = min(10, left - 2)
+            holds.append(self._post("/holds", take).json()["hold_id"])
+            left -= take
+        last = self._post("/holds", 2).json()["hold_id"]
+        # Everything this test books or queues is undone below, seats included
+        bookings, entry = [], None
+        try:
+            response = self._post("/waitlist", 2, contact_info="anna@example.com", priority=0)
+            assert response.status_code == 201
+            entry = response.json()
+            assert entry["status"] == "WAITING"
+            assert entry["position"] == 1
+            assert entry["priority"] == 5   # server-assigned, not the requested 0
+            token = entry["token"]
+            waitlist_url = f"{BASE_URL}/waitlist/{entry['waitlist_id']}"
+
+            _, seats = self._first_class()
+            assert seats["available"] == 0
+            assert seats["waitlist"] == 1
+
+            booking = requests.post(f"{BASE_URL}/holds/{last}/confirm", json={
+                "contact_info": "jan@example.com",
+                "passengers": [
+                    {"name": "Jan", "gender": "M", "age": 30},
+                    {"name": "Ewa", "gender": "F", "age": 31}
+                ]
+            }).json()
+            bookings.append({"booking_id": booking["booking_id"], "booking_token": booking["booking_token"]})
+            forged = {"bookings": [{"booking_id": booking["booking_id"], "booking_token": "guess"}]}
+            assert requests.post(f"{BASE_URL}/bookings/cancel", json=forged).status_code == 404
+
+            response = requests.post(f"{BASE_URL}/bookings/cancel", json={"bookings": bookings})
+            assert response.status_code == 200
+            assert response.json() == {"cancelled": 1, "promoted": 1}
+
+            assert requests.get(waitlist_url, params={"token": "guess"}).status_code == 404
+            entry = requests.get(waitlist_url, params={"token": token}).json()
+            assert entry["status"] == "PROMOTED"
+            assert entry["position"] is None
+            assert entry["booking_id"] is not None
+            bookings.append({"booking_id": entry["booking_id"], "booking_token": entry["booking_token"]})
+
+            _, seats = self._first_class()
+            assert seats["available"] == 0
+            assert seats["waitlist"] == 0
+        finally:
+            if entry is not None:
+                requests.delete(waitlist_url, params={"token": token})
+            for hold_id in holds + [last]:
+                requests.delete(f"{BASE_URL}/holds/{hold_id}")
+            if bookings:
+                requests.post(f"{BASE_URL}/bookings/cancel", json={"bookings": bookings})
+
+
+class TestHealthAPI:
+
+    def test_live(self):
+        """Test liveness answers without touching the database"""
+        response = requests.get(f"{BASE_URL}/health/live")
+        assert response.status_code == 200
+
+    def test_ready(self):
+        """Test readiness reports warm-up state and timings"""
+        response = requests.get(f"{BASE_URL}/health/ready")
+        assert response.status_code in [200, 503]
+        data = response.json()
+        assert "ready" in data
+        assert set(data["admission"]["running"]) == {"booking", "search"}
+        if response.status_code == 200:
+            assert data["ready"] is True
+            assert data["warmup_seconds"] is not None
+            assert "warm_statements" in data["tasks"]
+
+
+class TestTimetableImport:
+    """
+    Run in-process against a scratch SQLite database, so the server's data
+    is left alone.
+    """
+
+    FILES = {
+        "stations.csv": [
+            "station_id_code,station_name,station_name_PL,station_name_comb_PL",
+            "AAA,Alpha,Alfa,",
+            "BBB,Beta,Beta,",
+        ],
+        "trains.csv": [
+            "train_no,train_name,train_type,source_station_code,destination_station_code,alternate_train_no",
+            "901,Test,Express,AAA,BBB,",
+        ],
+        "stop_times.csv": [
+            "train_no,stop_number,station_code,arrival_time,departure_time,distance_from_start_km",
+            "901,1,AAA,,08:00,0",
+            "901,2,BBB,11:65,11:70,100",
+            "901,2,BBB,11:00,,100",
+            "902,1,AAA,,09:00,0",
+        ],
+    }
+
+    @pytest.fixture
+    def timetable(self, tmp_path):
+        from sqlalchemy import create_engine
+        from models import Base
+        bind = create_engine(f"sqlite:///{tmp_path / 'timetable.db'}")
+        Base.metadata.create_all(bind)
+        source = tmp_path / "csv"
+        source.mkdir()
+        for name, lines in self.FILES.items():
+            (source / name).write_text("\n".join(lines) + "\n", encoding="utf-8")
+        try:
+            yield bind, source
+        finally:
+            bind.dispose()
+
+    def _stops(self, bind):
+        from sqlalchemy import select
+        from models import RouteStation
+        with bind.connect() as conn:
+            return conn.execute(
+                select(RouteStation.stop_number, RouteStation.arrival_time).order_by(RouteStation.stop_number)
+            ).all()
+
+    def test_import_rejects_bad_rows(self, timetable, tmp_path):
+        """Test bad rows are written to the rejects file with their line and the good rows load"""
+        from timetable_import import TimetableImporter
+        bind, source = timetable
+        rejects = tmp_path / "rejects.txt"
+        stats = TimetableImporter(bind, chunk_size=2, rejects_path=str(rejects)).run(str(source))
+
+        assert stats["stations"]["inserted"] == 2
+        assert stats["stop_times"]["read"] == 4
+        assert stats["stop_times"]["rejected"] == 2
+        assert rejects.read_text(encoding="utf-8").splitlines() == [
+            "stop_times.csv:3: arrival_time must be HH:MM[:SS], got '11:65'",
+            "stop_times.csv:5: unknown train_no 902",
+        ]
+        assert [stop for stop, _ in self._stops(bind)] == [1, 2]
+
+    def test_import_is_idempotent(self, timetable):
+        """Test importing the same files twice updates rows instead of duplicating them"""
+        from timetable_import import TimetableImporter
+        bind, source = timetable
+        TimetableImporter(bind).run(str(source))
+        stats = TimetableImporter(bind).run(str(source))
+
+        assert stats["stations"]["inserted"] == 0
+        assert stats["stations"]["updated"] == 2
+        assert stats["stop_times"]["inserted"] == 0
+        assert len(self._stops(bind)) == 2
+
+    def test_import_resumes_from_checkpoint(self, timetable, tmp_path, monkeypatch):
+        """Test an interrupted import resumes after the last committed chunk"""
+        from timetable_import import TimetableImporter
+        bind, source = timetable
+        checkpoint = str(tmp_path / "checkpoint.json")
+        rejects = tmp_path / "rejects.txt"
+
+        apply_stop_times = TimetableImporter.apply_stop_times
+        calls = []
+
+        def interrupted(self, conn, rows):
+            calls.append(rows)
+            if len(calls) > 1:
+                raise RuntimeError("interrupted")
+            return apply_stop_times(self, conn, rows)
+
+        monkeypatch.setattr(TimetableImporter, "apply_stop_times", interrupted)
+        with pytest.raises(RuntimeError):
+            TimetableImporter(bind, chunk_size=1, checkpoint_path=checkpoint, rejects_path=str(rejects)).run(str(source))
+        assert len(self._stops(bind)) == 1
+
+        monkeypatch.setattr(TimetableImporter, "apply_stop_times", apply_stop_times)
+        stats = TimetableImporter(
+            bind, chunk_size=1, checkpoint_path=checkpoint, rejects_path=str(rejects)
+        ).run(str(source))
+
+        assert stats["stations"]["skipped"] == 2
+        assert stats["stations"]["read"] == 0
+        assert stats["stop_times"]["skipped"] == 2
+        assert stats["stop_times"]["read"] == 2
+        assert [stop for stop, _ in self._stops(bind)] == [1, 2]
+        # The rejected line was checkpointed before the interruption and is not reported twice
+        assert rejects.read_text(encoding="utf-8").count("stop_times.csv:3:") == 1
+
+
 if __name__ == "__main__":
     # Run tests
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -0,0 +1,538 @@
+"""
+Streaming bulk importer for timetable CSV files.
+
+    python timetable_import.py DIR [--chunk-size N] [--checkpoint FILE] [--rejects FILE]
+
+DIR may contain any of the files below; they are loaded in this order, and
+foreign keys are resolved by natural key through in-memory maps:
+
+    stations.csv           station_id_code, station_name, station_name_PL, station_name_comb_PL
+    trains.csv             train_no, train_name, train_type, source_station_code,
+                           destination_station_code, alternate_train_no
+    stop_times.csv         train_no, stop_number, station_code, arrival_time,
+                           departure_time, distance_from_start_km
+    berth_classes.csv      train_no, class_type, total_berths, price
+    seat_availability.csv  train_no, class_type, travel_date, available_seats
+
+Routes are keyed by (source station, destination station) and created on
+demand from trains.csv. Rows whose natural key already exists are updated,
+new rows are inserted, so reloading the same files is idempotent. Each chunk
+commits on its own and is recorded in the checkpoint file, so an
+interrupted run resumes where it stopped.
+"""
+from datetime import date, datetime, time
+from sqlalchemy import bindparam, create_engine, select
+from models import Station, Route, Train, RouteStation, BerthClass, TrainSeatAvailability
+from database import DATABASE_URL, engine_options
+import folding
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+
+logger = logging.getLogger("train_search")
+
+CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+
+class RowError(ValueError):
+    pass
+
+
+# ---------------- Field parsers ----------------
+def _required(raw, field):
+    value = (raw.get(field) or "").strip()
+    if not value:
+        raise RowError(f"{field} is required")
+    return value
+
+
+def _optional(raw, field):
+    value = (raw.get(field) or "").strip()
+    return value or None
+
+
+def _int(raw, field, required=True):
+    value = _required(raw, field) if required else _optional(raw, field)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f"{field} must be an integer, got {value!r}")
+
+
+def _time(raw, field):
+    value = _optional(raw, field)
+    if value is None:
+        return None
+    try:
+        parts = [int(p) for p in value.split(":")]
+        # GTFS-style times past midnight (25:10) wrap to the next day
+        return time(parts[0] % 24, parts[1], parts[2] if len(parts) > 2 else 0)
+    except (ValueError, IndexError):
+        raise RowError(f"{field} must be HH:MM[:SS], got {value!r}")
+
+
+def _date(raw, field):
+    value = _required(raw, field)
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise RowError(f"{field} must be YYYY-MM-DD, got {value!r}")
+
+
+# ---------------- Bulk write paths ----------------
+def _copy_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+def _copy_insert(conn, table, rows):
+    """PostgreSQL COPY ... FROM STDIN, the fastest insert path psycopg offers."""
+    columns = list(rows[0])
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([_copy_value(row[c]) for c in columns])
+
+    sql = 'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        table.name, ", ".join(f'"{c}"' for c in columns)
+    )
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if conn.dialect.driver == "psycopg2":
+            buf.seek(0)
+            cursor.copy_expert(sql, buf)
+        else:
+            with cursor.copy(sql) as copy:
+                copy.write(buf.getvalue())
+    finally:
+        cursor.close()
+
+
+def bulk_insert(conn, table, rows):
+    if not rows:
+        return
+    if conn.dialect.name == "postgresql" and conn.dialect.driver in ("psycopg2", "psycopg"):
+        _copy_insert(conn, table, rows)
+    else:
+        # executemany; pyodbc engines get fast_executemany from engine_options()
+        conn.execute(table.insert(), rows)
+
+
+def bulk_update(conn, table, pk, rows):
+    """rows carry the primary key under '_pk'."""
+    if not rows:
+        return
+    columns = [c for c in rows[0] if c != "_pk"]
+    stmt = (
+        table.update()
+        .where(table.c[pk] == bindparam("_pk"))
+        .values({c: bindparam(c) for c in columns})
+    )
+    conn.execute(stmt, rows)
+
+
+# ---------------- Importer ----------------
+class TimetableImporter:
+    def __init__(self, bind, chunk_size=CHUNK_SIZE, checkpoint_path=None, rejects_path=None):
+        self.bind = bind
+        self.chunk_size = chunk_size
+        self.checkpoint_path = checkpoint_path
+        self.rejects_path = rejects_path
+        self.checkpoint = self._load_checkpoint()
+        self.stats = {}
+
+        # natural key -> id
+        self.stations = {}      # station_id_code -> station_id
+        self.routes = {}        # (source_station_id, destination_station_id) -> route_id
+        self.trains = {}        # train_no -> (train_id, route_id)
+        self.stops = {}         # (train_id, stop_number) -> route_station_id
+        self.berths = {}        # (train_id, lower(class_type)) -> berth_class_id
+
+    # Files in dependency order
+    FILES = [
+        ("stations.csv", "stations"),
+        ("trains.csv", "trains"),
+        ("stop_times.csv", "stop_times"),
+        ("berth_classes.csv", "berth_classes"),
+        ("seat_availability.csv", "seat_availability"),
+    ]
+
+    # ---------------- Checkpoint ----------------
+    def _load_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_checkpoint(self, name, path, rows_done):
+        if not self.checkpoint_path:
+            return
+        st = os.stat(path)
+        self.checkpoint[name] = {"size": st.st_size, "mtime": st.st_mtime, "rows": rows_done}
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _resume_from(self, name, path):
+        entry = self.checkpoint.get(name)
+        st = os.stat(path)
+        # A changed file starts over; upserts make that safe
+        if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            return entry["rows"]
+        return 0
+
+    # ---------------- Maps ----------------
+    def load_maps(self, conn):
+        self.stations = dict(conn.execute(select(Station.station_id_code, Station.station_id)).all())
+        self.routes = {
+            (src, dst): rid
+            for rid, src, dst in conn.execute(
+                select(Route.route_id, Route.source_station_id, Route.destination_station_id)
+            )
+        }
+        self.trains = {
+            no: (tid, rid)
+            for tid, no, rid in conn.execute(select(Train.train_id, Train.train_no, Train.route_id))
+        }
+        self.stops = {
+            (tid, stop): rsid
+            for rsid, tid, stop in conn.execute(
+                select(RouteStation.route_station_id, RouteStation.train_id, RouteStation.stop_number)
+            )
+        }
+        self.berths = {
+            (tid, ct.lower()): bcid
+            for bcid, tid, ct in conn.execute(
+                select(BerthClass.berth_class_id, BerthClass.train_id, BerthClass.class_type)
+            )
+        }
+
+    def _station(self, code):
+        station_id = self.stations.get(code)
+        if station_id is None:
+            raise RowError(f"unknown station code {code!r}")
+        return station_id
+
+    def _train(self, train_no):
+        train = self.trains.get(train_no)
+        if train is None:
+            raise RowError(f"unknown train_no {train_no}")
+        return train
+
+    # ---------------- stations.csv ----------------
+    def parse_stations(self, raw):
+        return {
+            "station_id_code": _required(raw, "station_id_code"),
+            "station_name": _required(raw, "station_name"),
+            "station_name_PL": _required(raw, "station_name_PL"),
+            "station_name_comb_PL": _optional(raw, "station_name_comb_PL") or _required(raw, "station_name_PL"),
+        }
+
+    def apply_stations(self, conn, rows):
+        table = Station.__table__
+        inserts, updates = [], []
+        for row in rows:
+            station_id = self.stations.get(row["station_id_code"])
+            if station_id is None:
+                inserts.append(row)
+            else:
+                updates.append({**row, "_pk": station_id})
+        inserts = _last_wins(inserts, ("station_id_code",))
+        bulk_insert(conn, table, inserts)
+        bulk_update(conn, table, "station_id", updates)
+        if inserts:
+            codes = [r["station_id_code"] for r in inserts]
+            self.stations.update(conn.execute(
+                select(Station.station_id_code, Station.station_id).where(Station.station_id_code.in_(codes))
+            ).all())
+        folding.rebuild_station_keys(
+            conn, {self.stations[r["station_id_code"]] for r in inserts} | {r["_pk"] for r in updates}
+        )
+        return len(inserts), len(updates)
+
+    # ---------------- trains.csv ----------------
+    def parse_trains(self, raw):
+        return {
+            "train_no": _int(raw, "train_no"),
+            "train_name": _required(raw, "train_name"),
+            "train_type": _required(raw, "train_type"),
+            "alternate_train_no": _int(raw, "alternate_train_no", required=False),
+            "source_station_id": self._station(_required(raw, "source_station_code")),
+            "destination_station_id": self._station(_required(raw, "destination_station_code")),
+        }
+
+    def _ensure_routes(self, conn, pairs):
+        missing = [p for p in dict.fromkeys(pairs) if p not in self.routes]
+        if not missing:
+            return
+        bulk_insert(conn, Route.__table__, [
+            {"source_station_id": src, "destination_station_id": dst} for src, dst in missing
+        ])
+        sources = {src for src, _ in missing}
+        for rid, src, dst in conn.execute(
+            select(Route.route_id, Route.source_station_id, Route.destination_station_id)
+            .where(Route.source_station_id.in_(sources))
+        ):
+            self.routes.setdefault((src, dst), rid)
+
+    def apply_trains(self, conn, rows):
+        self._ensure_routes(conn, [(r["source_station_id"], r["destination_station_id"]) for r in rows])
+
+        table = Train.__table__
+        inserts, updates = [], []
+        for row in rows:
+            values = {
+                "train_no": row["train_no"],
+                "train_name": row["train_name"],
+                "train_type": row["train_type"],
+                "alternate_train_no": row["alternate_train_no"],
+                "route_id": self.routes[(row["source_station_id"], row["destination_station_id"])],
+            }
+            existing = self.trains.get(row["train_no"])
+            if existing is None:
+                inserts.append(values)
+            else:
+                updates.append({**values, "_pk": existing[0]})
+        inserts = _last_wins(inserts, ("train_no",))
+        bulk_insert(conn, table, inserts)
+        bulk_update(conn, table, "train_id", updates)
+        for values in updates:
+            self.trains[values["train_no"]] = (values["_pk"], values["route_id"])
+        if inserts:
+            numbers = [r["train_no"] for r in inserts]
+            for tid, no, rid in conn.execute(
+                select(Train.train_id, Train.train_no, Train.route_id).where(Train.train_no.in_(numbers))
+            ):
+                self.trains[no] = (tid, rid)
+        return len(inserts), len(updates)
+
+    # ---------------- stop_times.csv ----------------
+    def parse_stop_times(self, raw):
+        train_id, route_id = self._train(_int(raw, "train_no"))
+        return {
+            "train_id": train_id,
+            "route_id": route_id,
+            "station_id": self._station(_required(raw, "station_code")),
+            "stop_number": _int(raw, "stop_number"),
+            "arrival_time": _time(raw, "arrival_time"),
+            "departure_time": _time(raw, "departure_time"),
+            "distance_from_start_km": _int(raw, "distance_from_start_km", required=False),
+        }
+
+    def apply_stop_times(self, conn, rows):
+        table = RouteStation.__table__
+        inserts, updates = [], []
+        for row in rows:
+            rsid = self.stops.get((row["train_id"], row["stop_number"]))
+            if rsid is None:
+                inserts.append(row)
+            else:
+                updates.append({**row, "_pk": rsid})
+        inserts = _last_wins(inserts, ("train_id", "stop_number"))
+        bulk_insert(conn, table, inserts)
+        bulk_update(conn, table, "route_station_id", updates)
+        if inserts:
+            train_ids = {r["train_id"] for r in inserts}
+            for rsid, tid, stop in conn.execute(
+                select(RouteStation.route_station_id, RouteStation.train_id, RouteStation.stop_number)
+                .where(RouteStation.train_id.in_(train_ids))
+            ):
+                self.stops[(tid, stop)] = rsid
+        return len(inserts), len(updates)
+
+    # ---------------- berth_classes.csv ----------------
+    def parse_berth_classes(self, raw):
+        train_id, _ = self._train(_int(raw, "train_no"))
+        return {
+            "train_id": train_id,
+            "class_type": _required(raw, "class_type"),
+            "total_berths": _int(raw, "total_berths"),
+            "price": _int(raw, "price"),
+        }
+
+    def apply_berth_classes(self, conn, rows):
+        table = BerthClass.__table__
+        inserts, updates = [], []
+        for row in rows:
+            bcid = self.berths.get((row["train_id"], row["class_type"].lower()))
+            if bcid is None:
+                inserts.append(row)
+            else:
+                updates.append({**row, "_pk": bcid})
+        inserts = _last_wins(inserts, ("train_id", "class_type"))
+        bulk_insert(conn, table, inserts)
+        bulk_update(conn, table, "berth_class_id", updates)
+        if inserts:
+            train_ids = {r["train_id"] for r in inserts}
+            for bcid, tid, ct in conn.execute(
+                select(BerthClass.berth_class_id, BerthClass.train_id, BerthClass.class_type)
+                .where(BerthClass.train_id.in_(train_ids))
+            ):
+                self.berths[(tid, ct.lower())] = bcid
+        return len(inserts), len(updates)
+
+    # ---------------- seat_availability.csv ----------------
+    def parse_seat_availability(self, raw):
+        train_id, _ = self._train(_int(raw, "train_no"))
+        class_type = _required(raw, "class_type")
+        bcid = self.berths.get((train_id, class_type.lower()))
+        if bcid is None:
+            raise RowError(f"unknown class {class_type!r} for train_no {raw.get('train_no')}")
+        return {
+            "train_id": train_id,
+            "berth_class_id": bcid,
+            "travel_date": _date(raw, "travel_date"),
+            "available_seats": _int(raw, "available_seats"),
+        }
+
+    def apply_seat_availability(self, conn, rows):
+        # Too many (class, date) pairs to preload; look up just this chunk's keys
+        table = TrainSeatAvailability.__table__
+        keys = {(r["berth_class_id"], r["travel_date"]) for r in rows}
+        existing = {
+            (bcid, d): aid
+            for aid, bcid, d in conn.execute(
+                select(
+                    TrainSeatAvailability.availability_id,
+                    TrainSeatAvailability.berth_class_id,
+                    TrainSeatAvailability.travel_date,
+                ).where(
+                    TrainSeatAvailability.berth_class_id.in_({k[0] for k in keys}),
+                    TrainSeatAvailability.travel_date.in_({k[1] for k in keys}),
+                )
+            )
+            if (bcid, d) in keys
+        }
+        inserts, updates = [], []
+        for row in rows:
+            aid = existing.get((row["berth_class_id"], row["travel_date"]))
+            if aid is None:
+                inserts.append(row)
+            else:
+                updates.append({**row, "_pk": aid})
+        inserts = _last_wins(inserts, ("berth_class_id", "travel_date"))
+        bulk_insert(conn, table, inserts)
+        bulk_update(conn, table, "availability_id", updates)
+        return len(inserts), len(updates)
+
+    # ---------------- Driver ----------------
+    def run(self, directory):
+        with self.bind.connect() as conn:
+            self.load_maps(conn)
+
+        for filename, kind in self.FILES:
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                self.import_file(path, kind)
+        return self.stats
+
+    def import_file(self, path, kind):
+        parse = getattr(self, f"parse_{kind}")
+        apply = getattr(self, f"apply_{kind}")
+        stats = {"read": 0, "inserted": 0, "updated": 0, "rejected": 0, "skipped": 0, "seconds": 0.0}
+        self.stats[kind] = stats
+        started = datetime.now()
+
+        done = self._resume_from(kind, path)
+        stats["skipped"] = done
+
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            # line numbers are 1-based and the header is line 1
+            numbered = enumerate(itertools.islice(reader, done, None), start=done + 2)
+
+            while True:
+                chunk = list(itertools.islice(numbered, self.chunk_size))
+                if not chunk:
+                    break
+
+                rows, rejects = [], []
+                for line, raw in chunk:
+                    try:
+                        rows.append(parse(raw))
+                    except RowError as e:
+                        rejects.append((line, str(e)))
+
+                if rows:
+                    with self.bind.begin() as conn:
+                        inserted, updated = apply(conn, rows)
+                    stats["inserted"] += inserted
+                    stats["updated"] += updated
+
+                stats["read"] += len(chunk)
+                stats["rejected"] += len(rejects)
+                self._write_rejects(path, rejects)
+                done += len(chunk)
+                self._save_checkpoint(kind, path, done)
+
+        stats["seconds"] = (datetime.now() - started).total_seconds()
+        stats["rows_per_second"] = round(stats["read"] / stats["seconds"]) if stats["seconds"] else stats["read"]
+        logger.info("timetable import finished %s", os.path.basename(path), extra={"file": os.path.basename(path), **stats})
+        return stats
+
+    def _write_rejects(self, path, rejects):
+        if not rejects:
+            return
+        if not self.rejects_path:
+            name = os.path.basename(path)
+            # Spelled out in the message too: the CLI's log format shows no extras
+            for line, reason in rejects[:5]:
+                logger.warning(
+                    "rejected row %s:%s: %s", name, line, reason,
+                    extra={"file": name, "line": line, "reason": reason}
+                )
+            if len(rejects) > 5:
+                logger.warning(
+                    "%s more rejected rows in %s; pass --rejects FILE to keep them all", len(rejects) - 5, name,
+                    extra={"file": name, "rejected": len(rejects) - 5}
+                )
+            return
+        with open(self.rejects_path, "a", encoding="utf-8") as f:
+            for line, reason in rejects:
+                f.write(f"{os.path.basename(path)}:{line}: {reason}\n")
+
+
+def _last_wins(rows, key_fields):
+    """Duplicate natural keys inside one chunk: keep the last row."""
+    by_key = {}
+    for row in rows:
+        by_key[tuple(row[k] for k in key_fields)] = row
+    return list(by_key.values())
+
+
+# ---------------- CLI ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load timetable CSV files")
+    parser.add_argument("directory")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--checkpoint", help="resume file; rerun with the same path to continue")
+    parser.add_argument("--rejects", help="write rejected rows here instead of logging them")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+
+    bind = create_engine(args.database_url, **engine_options(args.database_url))
+    importer = TimetableImporter(bind, args.chunk_size, args.checkpoint, args.rejects)
+    stats = importer.run(args.directory)
+
+    for kind, s in stats.items():
+        print(
+            f"{kind:18} read={s['read']:>9} inserted={s['inserted']:>9} updated={s['updated']:>9} "
+            f"rejected={s['rejected']:>7} resumed_after={s['skipped']:>9} "
+            f"{s['seconds']:8.2f}s {s['rows_per_second']:>9} rows/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Waitlist, cancellation and promotion.
+
+When a (train, date, class) is sold out, travellers join its waitlist.
+Entries are served by priority (lower first), then by arrival. The API
+always joins at DEFAULT_PRIORITY; clients cannot choose their place.
+
+Entries and bookings carry a random token, returned only to whoever
+created them. Reading or leaving an entry and cancelling a booking
+require it, so sequential ids cannot be used to act on other people's.
+
+Seats come back when bookings are cancelled (in bulk) or holds are
+released or expire. Whatever frees them calls promote() in the same
+transaction. promote() locks the availability rows, walks each queue in
+service order and turns every entry that fits into a booking. An entry
+too large for what is left is skipped, not allowed to block smaller ones
+behind it. All promoted bookings, status changes and counter updates are
+committed together.
+
+TrainSeatAvailability.waitlist_count is the number of WAITING entries.
+Every status change adjusts it in the same transaction, so searches show
+waitlist lengths without a COUNT.
+"""
+from sqlalchemy import and_, bindparam, func, or_, select, update
+from models import Booking, TrainSeatAvailability, WaitlistEntry
+import hmac
+import logging
+import os
+import secrets
+
+logger = logging.getLogger("train_search")
+
+WAITLIST_MAX_SEATS = int(os.getenv("WAITLIST_MAX_SEATS", "10"))
+WAITLIST_PROMOTE_SCAN = int(os.getenv("WAITLIST_PROMOTE_SCAN", "500"))
+DEFAULT_PRIORITY = 5
+
+WAITING = "WAITING"
+PROMOTED = "PROMOTED"
+CANCELLED = "CANCELLED"
+CONFIRMED = "CONFIRMED"   # booking status, as written by seat_holds
+
+
+class WaitlistError(Exception):
+    """Raised with a user-facing message; .status_code maps to the HTTP status."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _counters(db, deltas):
+    """Apply {availability_id: (seat delta, waitlist delta)} in one executemany."""
+    table = TrainSeatAvailability.__table__
+    db.execute(
+        table.update()
+        .where(table.c.availability_id == bindparam("_id"))
+        .values(
+            available_seats=table.c.available_seats + bindparam("_seats"),
+            waitlist_count=table.c.waitlist_count + bindparam("_waiting"),
+        ),
+        [{"_id": aid, "_seats": seats, "_waiting": waiting} for aid, (seats, waiting) in deltas.items()]
+    )
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def _owns(token, expected) -> bool:
+    return expected is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+
+# ---------------- Join / leave ----------------
+def join(db, availability: TrainSeatAvailability, travel_date, seats: int, contact_info: str,
+         fare=None, priority: int = DEFAULT_PRIORITY) -> WaitlistEntry:
+    if seats < 1 or seats > WAITLIST_MAX_SEATS:
+        raise WaitlistError(400, f"Seats must be between 1 and {WAITLIST_MAX_SEATS}")
+
+    db.refresh(availability)
+    if availability.available_seats >= seats:
+        raise WaitlistError(409, f"{availability.available_seats} seats are available, place a hold instead")
+
+    entry = WaitlistEntry(
+        availability_id=availability.availability_id,
+        train_id=availability.train_id,
+        berth_class_id=availability.berth_class_id,
+        travel_date=travel_date,
+        seats=seats,
+        fare=fare,
+        priority=priority,
+        contact_info=contact_info,
+        status=WAITING,
+        token=new_token(),
+    )
+    db.add(entry)
+    _counters(db, {availability.availability_id: (0, 1)})
+    db.flush()
+    # Seats freed since the check above go to the queue, this entry included
+    promote(db, [availability.availability_id])
+    db.commit()
+    return entry
+
+
+def get_entry(db, waitlist_id: int, token: str) -> WaitlistEntry:
+    """The entry, if token is its own; 404 otherwise so ids cannot be probed."""
+    entry = db.get(WaitlistEntry, waitlist_id)
+    if entry is None or not _owns(token, entry.token):
+        raise WaitlistError(404, f"Waitlist entry {waitlist_id} not found")
+    return entry
+
+
+def leave(db, waitlist_id: int, token: str):
+    entry = get_entry(db, waitlist_id, token)
+
+    left = db.execute(
+        update(WaitlistEntry)
+        .where(WaitlistEntry.waitlist_id == waitlist_id, WaitlistEntry.status == WAITING)
+        .values(status=CANCELLED)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not left:
+        db.rollback()
+        raise WaitlistError(410, f"Waitlist entry {waitlist_id} is no longer waiting")
+
+    _counters(db, {entry.availability_id: (0, -1)})
+    db.commit()
+
+
+def position(db, entry: WaitlistEntry):
+    """1-based place in the queue of a WAITING entry, else None."""
+    if entry.status != WAITING:
+        return None
+    ahead = db.execute(
+        select(func.count())
+        .select_from(WaitlistEntry)
+        .where(
+            WaitlistEntry.availability_id == entry.availability_id,
+            WaitlistEntry.status == WAITING,
+            # (priority, waitlist_id) < (entry's); spelled out, SQL Server has no row comparison
+            or_(
+                WaitlistEntry.priority < entry.priority,
+                and_(WaitlistEntry.priority == entry.priority, WaitlistEntry.waitlist_id < entry.waitlist_id)
+            )
+        )
+    ).scalar_one()
+    return ahead + 1
+
+
+# ---------------- Promotion ----------------
+def promote(db, availability_ids):
+    """
+    Turn waiting entries that now fit into bookings. Runs inside the
+    caller's transaction and does not commit. Returns the number promoted.
+    """
+    if not availability_ids:
+        return 0
+    free = dict(db.execute(
+        select(TrainSeatAvailability.availability_id, TrainSeatAvailability.available_seats)
+        .where(
+            TrainSeatAvailability.availability_id.in_(sorted(set(availability_ids))),
+            TrainSeatAvailability.waitlist_count > 0,
+            TrainSeatAvailability.available_seats > 0
+        )
+        .with_for_update()
+    ).all())
+
+    promoted, deltas = [], {}
+    for availability_id, left in free.items():
+        queue = db.execute(
+            select(WaitlistEntry)
+            .where(WaitlistEntry.availability_id == availability_id, WaitlistEntry.status == WAITING)
+            .order_by(WaitlistEntry.priority, WaitlistEntry.waitlist_id)
+            .limit(WAITLIST_PROMOTE_SCAN)
+            .with_for_update()
+        ).scalars()
+        taken = []
+        for entry in queue:
+            if entry.seats <= left:
+                left -= entry.seats
+                taken.append(entry)
+                if not left:
+                    break
+        if taken:
+            promoted.extend(taken)
+            deltas[availability_id] = (-sum(e.seats for e in taken), -len(taken))
+
+    if not promoted:
+        return 0
+
+    bookings = [
+        Booking(
+            availability_id=e.availability_id,
+            train_id=e.train_id,
+            berth_class_id=e.berth_class_id,
+            travel_date=e.travel_date,
+            seats=e.seats,
+            fare=e.fare,
+            contact_info=e.contact_info,
+            status=CONFIRMED,
+            token=new_token(),
+        )
+        for e in promoted
+    ]
+    db.add_all(bookings)
+    db.flush()   # one batched INSERT; assigns booking ids
+    for entry, booking in zip(promoted, bookings):
+        entry.status = PROMOTED
+        entry.booking_id = booking.booking_id
+    _counters(db, deltas)
+    logger.info("waitlist promoted", extra={"promoted": len(promoted), "rows": len(deltas)})
+    return len(promoted)
+
+
+# ---------------- Cancellation ----------------
+def cancel_bookings(db, tokens):
+    """
+    Cancel CONFIRMED bookings, return their seats and promote from the
+    waitlist, all in one transaction. tokens: {booking_id: token}; ids whose
+    token does not match are treated as unknown. Returns (cancelled, promoted).
+    """
+    rows = [
+        r for r in db.execute(
+            select(Booking.booking_id, Booking.availability_id, Booking.seats, Booking.token)
+            .where(Booking.booking_id.in_(list(tokens)), Booking.status == CONFIRMED)
+            .with_for_update()
+        )
+        if _owns(tokens[r.booking_id], r.token)
+    ]
+    if not rows:
+        db.rollback()
+        raise WaitlistError(404, "No active bookings with these ids")
+
+    db.execute(
+        update(Booking)
+        .where(Booking.booking_id.in_([r.booking_id for r in rows]), Booking.status == CONFIRMED)
+        .values(status=CANCELLED)
+        .execution_options(synchronize_session=False)
+    )
+    deltas = {}
+    for _, availability_id, seats, _ in rows:
+        # Bookings from before availability_id was recorded give no seats back
+        if availability_id is not None:
+            deltas[availability_id] = (deltas.get(availability_id, (0, 0))[0] + seats, 0)
+    if deltas:
+        _counters(db, deltas)
+    promoted = promote(db, deltas)
+    db.commit()
+    return len(rows), promoted
@@ -0,0 +1,95 @@
+"""
+Process warm-up and readiness.
+
+Caches register a builder with @warmup.task. warm_up() runs them once:
+in the gunicorn master when preload_app is on (see gunicorn.conf.py),
+so forked workers inherit the built structures copy-on-write, or in the
+worker's lifespan otherwise. /health/ready answers 503 until it finished.
+A failed warm-up is retried in the background every WARMUP_RETRY_INTERVAL
+seconds, so a database outage at deploy does not leave workers unready.
+"""
+import time
+
+# Taken before the heavy imports below; main.py imports this module first
+PROCESS_STARTED = time.perf_counter()
+
+from sqlalchemy.orm import configure_mappers
+from database import SessionLocal
+import logging
+import os
+import threading
+
+logger = logging.getLogger("train_search")
+
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+
+_tasks = []
+_state = {
+    "ready": False,
+    "warmed_in_pid": None,
+    "import_seconds": None,
+    "warmup_seconds": None,
+    "tasks": {},
+    "error": None,
+}
+_lock = threading.Lock()
+
+
+def task(fn):
+    """Register fn(db) to run during warm-up."""
+    _tasks.append(fn)
+    return fn
+
+
+def mark_imported():
+    if _state["import_seconds"] is None:
+        _state["import_seconds"] = round(time.perf_counter() - PROCESS_STARTED, 4)
+
+
+def warm_up():
+    """Run every registered task once per process tree. Safe to call repeatedly."""
+    with _lock:
+        if _state["ready"]:
+            return _state
+
+        started = time.perf_counter()
+        configure_mappers()
+        db = SessionLocal()
+        try:
+            for fn in _tasks:
+                t = time.perf_counter()
+                fn(db)
+                _state["tasks"][fn.__qualname__] = round(time.perf_counter() - t, 4)
+        except Exception as e:
+            _state["error"] = repr(e)
+            logger.exception("warm-up failed")
+            raise
+        finally:
+            db.close()
+
+        _state["warmup_seconds"] = round(time.perf_counter() - started, 4)
+        _state["warmed_in_pid"] = os.getpid()
+        _state["error"] = None
+        _state["ready"] = True
+        logger.info("warm-up finished", extra={k: v for k, v in _state.items() if k != "ready"})
+        return _state
+
+
+def warm_up_in_background():
+    if _state["ready"]:
+        return
+    threading.Thread(target=_warm_up_quietly, name="warm-up", daemon=True).start()
+
+
+def _warm_up_quietly():
+    while True:
+        try:
+            warm_up()
+            return
+        except Exception:
+            pass  # already logged; readiness keeps reporting the error
+        time.sleep(WARMUP_RETRY_INTERVAL)
+
+
+def status():
+    return {**_state, "pid": os.getpid(), "inherited": _state["warmed_in_pid"] not in (None, os.getpid())}